@@ -0,0 +1,4 @@
+import time
+
+# app.main reports how long importing the app took from here.
+IMPORT_STARTED = time.perf_counter()
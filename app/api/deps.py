@@ -1,22 +1,72 @@
+from datetime import timezone
 from typing import Annotated
-from fastapi import Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import Depends, HTTPException, Request, status
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import jwt, JWTError
-from app.core.database import SessionLocal
+from app.core.database import SessionLocal, read_session
 from app.core.config import SECRET_KEY, ALGORITHM
 from app.core.security import oauth2_scheme
 from app.models.models import Users
+from app.services.principals import Principal, cache_principal, get_principal
 
-def get_db():
-    db = SessionLocal()
+async def get_db():
+    async with SessionLocal() as db:
+        yield db
+
+db_dependency = Annotated[AsyncSession, Depends(get_db)]
+
+def _token_user_id(request: Request) -> int | None:
+    # Only picks where to read from, so the token isn't verified here;
+    # get_current_user does that.
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    principal = get_principal(token)
+    if principal is not None:
+        return principal.id
+    try:
+        return jwt.get_unverified_claims(token).get("id")
+    except JWTError:
+        return None
+
+async def get_read_db(request: Request):
+    # For read-only endpoints: a replica when configured, see read_session.
+    db = await read_session(_token_user_id(request))
     try:
         yield db
     finally:
-        db.close()
+        await db.close()
 
-db_dependency = Annotated[Session, Depends(get_db)]
+read_db_dependency = Annotated[AsyncSession, Depends(get_read_db)]
+
+async def get_user(user_id: int) -> Users | None:
+    """Loads a user for authentication, from a replica when possible."""
+    async with await read_session(user_id) as db:
+        user = await db.get(Users, user_id)
+    if user is None and db.info.get("replica"):
+        # Registered moments ago and not replicated yet.
+        async with SessionLocal() as db:
+            user = await db.get(Users, user_id)
+    return user
+
+def _issued_before_password_change(payload: dict, user: Users) -> bool:
+    # A password reset signs out every session, not only cached ones.
+    changed_at = user.password_changed_at
+    if changed_at is None:
+        return False
+    if changed_at.tzinfo is None:
+        changed_at = changed_at.replace(tzinfo=timezone.utc)
+    return payload.get("iat", 0) < changed_at.timestamp()
+
+async def get_current_user(
+    token: Annotated[str, Depends(oauth2_scheme)]
+) -> Principal:
+    # A cache hit skips both the JWT decode and the user lookup; entries
+    # never outlive the token's own exp.
+    principal = get_principal(token)
+    if principal is not None:
+        return principal
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: db_dependency):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -31,7 +81,11 @@ async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)], db: db
     except JWTError:
         raise credentials_exception
     
-    user = db.query(Users).filter(Users.id == user_id).first()
-    if user is None:
+    user = await get_user(user_id)
+    if user is None or not user.is_active or _issued_before_password_change(payload, user):
         raise credentials_exception
-    return user
+
+    principal = Principal.from_user(user)
+    # Without an exp the entry lasts the cache's own TTL.
+    cache_principal(token, principal, payload.get("exp"))
+    return principal
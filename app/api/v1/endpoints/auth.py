@@ -1,12 +1,15 @@
+from datetime import datetime, timezone
+
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.responses import HTMLResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from passlib.context import CryptContext
 from jose import jwt, JWTError
-import os
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.api.deps import db_dependency
-from app.models.models import Users
+from app.api.deps import db_dependency, read_db_dependency
+from app.core.database import SessionLocal, replica_router
+from app.models.models import UserUsage, Users
 from app.schemas.schemas import (
     RegisterUser,
     LoginUser,
@@ -15,13 +18,14 @@ from app.schemas.schemas import (
     NewPassword,
 )
 from app.core.security import create_access_token, decode_verification_token
-from app.services.email import send_verification_email, send_password_reset_email
-from app.core.config import SECRET_KEY, ALGORITHM
+from app.services.email import queue_verification_email, queue_password_reset_email
+from app.services.outbox import wake_outbox
+from app.services.principals import invalidate_user
+from app.core.config import SECRET_KEY, ALGORITHM, DOMAIN
+from app.core.passwords import hash_password, verify_password
 
 router = APIRouter(prefix="/auth", tags=["authentication"])
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
 
 @router.post("/register")
 async def create_user(db: db_dependency, create_user_request: RegisterUser):
@@ -31,8 +35,8 @@ async def create_user(db: db_dependency, create_user_request: RegisterUser):
             "message": "Password and Confirm Password do not match",
         }
 
-    existing_user = (
-        db.query(Users).filter(Users.email == create_user_request.email).first()
+    existing_user = await db.scalar(
+        select(Users).where(Users.email == create_user_request.email)
     )
     if existing_user:
         return {
@@ -45,29 +49,59 @@ async def create_user(db: db_dependency, create_user_request: RegisterUser):
         last_name=create_user_request.last_name,
         middle_name=create_user_request.middle_name,
         email=create_user_request.email,
-        hashed_password=pwd_context.hash(create_user_request.password),
+        hashed_password=await hash_password(create_user_request.password),
     )
     db.add(create_user_model)
-    db.commit()
+    await db.flush()
+    db.add(UserUsage(user_id=create_user_model.id, bytes_used=0, file_count=0))
+    queue_verification_email(
+        db, create_user_request.email, create_user_request.first_name
+    )
+    await db.commit()
+    wake_outbox()
 
-    await send_verification_email(create_user_model.email, create_user_model.first_name)
     return {
         "message": "User created successfully. Please check your email to verify your account."
     }
 
 
+async def _find_login_user(db: AsyncSession, email: str) -> Users | None:
+    user = await db.scalar(select(Users).where(Users.email == email))
+    if db.info.get("replica") and (
+        user is None or replica_router.wrote_recently(user.id)
+    ):
+        # Registered or changed moments ago; the replica may not have it yet.
+        async with SessionLocal() as primary:
+            user = await primary.scalar(select(Users).where(Users.email == email))
+    return user
+
+
+async def _save_password_hash(user_id: int, new_hash: str):
+    # The user may have been read from a replica; writes go to the primary.
+    async with SessionLocal() as db:
+        await db.execute(
+            update(Users).where(Users.id == user_id).values(hashed_password=new_hash)
+        )
+        await db.commit()
+
+
 @router.post("/login", response_model=Token)
-async def login_user(db: db_dependency, login_request: LoginUser):
-    user = db.query(Users).filter(Users.email == login_request.email).first()
+async def login_user(db: read_db_dependency, login_request: LoginUser):
+    user = await _find_login_user(db, login_request.email)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Invalid Credentials"
         )
 
-    if not pwd_context.verify(login_request.password, user.hashed_password):
+    verified, new_hash = await verify_password(
+        login_request.password, user.hashed_password
+    )
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="Invalid Credentials"
         )
+    if new_hash:
+        await _save_password_hash(user.id, new_hash)
 
     token = create_access_token(data={"sub": user.email, "id": user.id})
     return {
@@ -79,18 +113,21 @@ async def login_user(db: db_dependency, login_request: LoginUser):
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(
-    db: db_dependency, form_data: OAuth2PasswordRequestForm = Depends()
+    db: read_db_dependency, form_data: OAuth2PasswordRequestForm = Depends()
 ):
-    user = db.query(Users).filter(Users.email == form_data.username).first()
+    user = await _find_login_user(db, form_data.username)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Credentials"
         )
 
-    if not pwd_context.verify(form_data.password, user.hashed_password):
+    verified, new_hash = await verify_password(form_data.password, user.hashed_password)
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid Credentials"
         )
+    if new_hash:
+        await _save_password_hash(user.id, new_hash)
 
     token = create_access_token(data={"sub": user.email, "id": user.id})
     return {
@@ -101,7 +138,7 @@ async def login_for_access_token(
 
 
 @router.get("/verify", response_class=HTMLResponse)
-def verify_email(token: str, db: db_dependency):
+async def verify_email(token: str, db: db_dependency):
     try:
         email = decode_verification_token(token)
         if not email:
@@ -121,7 +158,7 @@ def verify_email(token: str, db: db_dependency):
         </html>
         """
 
-    user = db.query(Users).filter(Users.email == email).first()
+    user = await db.scalar(select(Users).where(Users.email == email))
 
     if not user:
         return """
@@ -150,7 +187,9 @@ def verify_email(token: str, db: db_dependency):
         """
 
     user.is_verified = True
-    db.commit()
+    await db.commit()
+    # Cached principals still say unverified.
+    await invalidate_user(user.id)
 
     return """
     <html>
@@ -167,21 +206,19 @@ def verify_email(token: str, db: db_dependency):
 
 @router.post("/reset_password")
 async def reset_password(email_data: PasswordReset, db: db_dependency):
-    user = db.query(Users).filter(Users.email == email_data.email).first()
+    user = await db.scalar(select(Users).where(Users.email == email_data.email))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
         )
 
     token = create_access_token({"sub": user.email})
+    link = f"http://{DOMAIN}/auth/reset-password?token={token}"
 
     user.password_reset_token = token
-    db.commit()
-
-    domain = os.getenv("DOMAIN", "localhost:8000")
-    link = f"http://{domain}/auth/reset-password?token={token}"
-
-    await send_password_reset_email(user.email, link)
+    queue_password_reset_email(db, user.email, link)
+    await db.commit()
+    wake_outbox()
 
     return {"message": "Password reset email sent", "token": token}
 
@@ -205,7 +242,7 @@ async def confirm_password_reset(data: NewPassword, db: db_dependency):
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token"
         )
 
-    user = db.query(Users).filter(Users.email == email).first()
+    user = await db.scalar(select(Users).where(Users.email == email))
     if not user:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="User not found"
@@ -216,8 +253,12 @@ async def confirm_password_reset(data: NewPassword, db: db_dependency):
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid or expired token"
         )
 
-    user.hashed_password = pwd_context.hash(data.new_password)
+    user.hashed_password = await hash_password(data.new_password)
     user.password_reset_token = None
-    db.commit()
+    user.password_changed_at = datetime.now(timezone.utc)
+    await db.commit()
+    # Drops cached principals; get_current_user then rejects tokens issued
+    # before the change.
+    await invalidate_user(user.id)
 
     return {"message": "Password reset successfully"}
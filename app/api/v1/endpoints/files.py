@@ -1,133 +1,978 @@
-from fastapi import APIRouter, Depends, UploadFile, File, status, HTTPException
-from fastapi.responses import FileResponse
-from sqlalchemy.orm import Session
-import shutil
+from fastapi import APIRouter, Depends, Query, Request, Response, status, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from datetime import datetime, timezone
+from functools import partial
+from typing import Annotated, Literal
+from urllib.parse import quote
 import os
+import time
 import uuid
 
-from app.api.deps import db_dependency, get_current_user
-from app.models.models import FileManage, Users
-from app.schemas.schemas import FileDetail
+from app.api.deps import db_dependency, get_current_user, read_db_dependency
+from app.core.config import (
+    BATCH_MAX_FILES,
+    DOWNLOAD_LINK_MAX_TTL,
+    DOWNLOAD_LINK_TTL,
+    DOWNLOAD_OFFLOAD,
+    DOWNLOAD_OFFLOAD_PREFIX,
+    INSTANT_UPLOAD_SCOPE,
+    UPLOAD_SESSION_CHUNK_SIZE,
+    UPLOAD_SESSION_MAX_CHUNK_SIZE,
+)
+from app.models.models import Blob, FileJob, FileManage, UploadSession
+from app.schemas.schemas import (
+    BatchItemResult,
+    BatchResult,
+    FileBatch,
+    FileDetail,
+    FileJobDetail,
+    BlobClaim,
+    UploadSessionCreate,
+    UploadSessionDetail,
+    UsageDetail,
+)
+from app.services.blobs import (
+    TEMP_DIR,
+    acquire_blob,
+    add_files,
+    release_blob,
+    store_blob,
+    store_blobs,
+    unlink_blob,
+)
+from app.services import upload_sessions
+from app.services.archives import archive_name, stream_zip
+from app.services.compression import accepts_encoding, open_decoded
+from app.services.counters import download_counts
+from app.services.downloads import (
+    decoded_download,
+    file_download,
+    memory_download,
+    offload_download,
+    redirect_download,
+    wants_full_body,
+)
+from app.services.export import EXPORT_COLUMNS, stream_ndjson
+from app.services.file_cache import (
+    FileMeta,
+    cached_body,
+    get_file_meta,
+    invalidate_files,
+)
+from app.services.file_jobs import forget_file_jobs, wake_file_jobs
+from app.services.listing import LIST_COLUMNS, count_files, page_files
+from app.services.principals import Principal
+from app.services.search import FileFilters, match_filename, relevance
+from app.services.signed_links import link_is_current, sign_link, verify_link
+from app.services.storage import storage
+from app.services.uploads import (
+    MULTIPART_FILE_BODY,
+    MULTIPART_FILES_BODY,
+    FileSink,
+    receive_body,
+    receive_multipart,
+)
+from app.services.usage import (
+    check_quota,
+    check_upload_quota,
+    get_usage,
+    quota_for,
+    release_usage,
+)
 
 router = APIRouter(prefix="/files", tags=["manage_files"])
 
+os.makedirs(TEMP_DIR, exist_ok=True)
+os.makedirs(upload_sessions.SESSION_DIR, exist_ok=True)
 
-@router.post("/upload", status_code=status.HTTP_201_CREATED)
+
+def _new_sink(filename: str, content_type: str | None) -> FileSink:
+    return FileSink(os.path.join(TEMP_DIR, str(uuid.uuid4())), filename, content_type)
+
+
+def _file_row(user_id: int, filename: str, file_type: str, size: int, sha256: str):
+    return FileManage(
+        user_id=user_id,
+        filename=filename,
+        stored_filename=sha256,
+        file_type=file_type,
+        file_size=size,
+        path=storage.key_for(sha256),
+        sha256=sha256,
+    )
+
+
+async def _save_upload(db: AsyncSession, user_id: int, upload: FileSink):
+    new_file = _file_row(
+        user_id, upload.filename, upload.content_type, upload.size, upload.sha256
+    )
+    await store_blob(db, upload, [new_file])
+
+
+async def _claim_blob(db: AsyncSession, user_id: int, claim: BlobClaim) -> bool:
+    query = select(Blob.sha256).where(
+        Blob.sha256 == claim.sha256, Blob.size == claim.file_size
+    )
+    if INSTANT_UPLOAD_SCOPE == "user":
+        query = query.where(
+            select(FileManage.id)
+            .where(FileManage.sha256 == Blob.sha256, FileManage.user_id == user_id)
+            .exists()
+        )
+    blob = await db.scalar(query) and await acquire_blob(db, claim.sha256)
+    if not blob:
+        await db.rollback()
+        return False
+
+    new_file = _file_row(
+        user_id, claim.filename, claim.file_type, claim.file_size, claim.sha256
+    )
+    new_file.path = blob.path
+    new_file.content_encoding = blob.content_encoding
+    await add_files(db, [new_file])
+    await db.commit()
+    return True
+
+
+def _upload_response(upload: FileSink):
+    return {
+        "message": f"'{upload.filename}' uploaded successfully",
+        "file_size": upload.size,
+        "sha256": upload.sha256,
+    }
+
+
+@router.post(
+    "/upload", status_code=status.HTTP_201_CREATED, openapi_extra=MULTIPART_FILE_BODY
+)
 async def upload_file(
+    request: Request,
     db: db_dependency,
-    current_user: Users = Depends(get_current_user),
-    file: UploadFile = File(...),
+    current_user: Principal = Depends(get_current_user),
 ):
-    upload_dir = "uploaded_files"
-    os.makedirs(upload_dir, exist_ok=True)
+    # Refuse uploads that can't fit before any bytes are read
+    limit = await check_upload_quota(db, current_user.id, request)
+    # Don't hold a pooled connection while the body streams in
+    await db.close()
 
-    file_extension = os.path.splitext(file.filename)[1]
-    stored_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(upload_dir, stored_filename)
+    # Only the first file part is kept; the multipart body is parsed as it
+    # arrives instead of being spooled to a temp file first.
+    uploads = await receive_multipart(request, _new_sink, limit=limit)
+    for extra in uploads[1:]:
+        await extra.abort()
+    upload = uploads[0]
 
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    await _save_upload(db, current_user.id, upload)
+    wake_file_jobs()
+    await invalidate_files(current_user.id, [upload.filename])
 
-    file_size = os.path.getsize(file_path)
+    return _upload_response(upload)
 
-    new_file = FileManage(
-        user_id=current_user.id,
-        filename=file.filename,
-        stored_filename=stored_filename,
-        file_type=file.content_type,
-        file_size=file_size,
-        path=file_path,
-    )
 
-    db.add(new_file)
-    db.commit()
-    db.refresh(new_file)
+@router.put("/upload/{filename}", status_code=status.HTTP_201_CREATED)
+async def upload_file_raw(
+    filename: str,
+    request: Request,
+    db: db_dependency,
+    current_user: Principal = Depends(get_current_user),
+):
+    limit = await check_upload_quota(db, current_user.id, request)
+    await db.close()
+
+    sink = _new_sink(filename, request.headers.get("content-type"))
+    upload = await receive_body(request, sink, limit)
 
-    return {"message": f"'{file.filename}' uploaded successfully"}
+    await _save_upload(db, current_user.id, upload)
+    wake_file_jobs()
+    await invalidate_files(current_user.id, [upload.filename])
 
+    return _upload_response(upload)
 
-@router.get("/list", status_code=status.HTTP_200_OK, response_model=list[FileDetail])
-async def list_files(
+
+@router.post("/upload/check", status_code=status.HTTP_200_OK)
+async def upload_by_hash(
+    claim: BlobClaim,
     db: db_dependency,
-    current_user: Users = Depends(get_current_user),
-    filename: str = None,
+    current_user: Principal = Depends(get_current_user),
 ):
-    if filename:
-        files = (
-            db.query(FileManage)
-            .filter(
-                FileManage.user_id == current_user.id,
-                FileManage.filename.ilike(f"%{filename}%"),
+    # Hash-first negotiation: when the content is already stored the file is
+    # created without transferring any bytes, otherwise the client uploads.
+    if not await _claim_blob(db, current_user.id, claim):
+        return {"exists": False, "message": "Upload the file contents"}
+    wake_file_jobs()
+    await invalidate_files(current_user.id, [claim.filename])
+
+    return {
+        "exists": True,
+        "message": f"'{claim.filename}' uploaded successfully",
+        "file_size": claim.file_size,
+        "sha256": claim.sha256,
+    }
+
+
+@router.post(
+    "/upload/batch",
+    status_code=status.HTTP_200_OK,
+    response_model=BatchResult,
+    response_model_exclude_none=True,
+    openapi_extra=MULTIPART_FILES_BODY,
+)
+async def upload_files(
+    request: Request,
+    db: db_dependency,
+    current_user: Principal = Depends(get_current_user),
+):
+    limit = await check_upload_quota(db, current_user.id, request)
+    await db.close()
+
+    # Every "files" part is streamed to its own temp file, then all of them
+    # are recorded in a single transaction.
+    uploads = await receive_multipart(
+        request, _new_sink, field_name="files", limit=limit
+    )
+    errors = await store_blobs(
+        db,
+        [
+            (
+                upload,
+                _file_row(
+                    current_user.id,
+                    upload.filename,
+                    upload.content_type,
+                    upload.size,
+                    upload.sha256,
+                ),
             )
-            .all()
-        )
-        if not files:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="This file cannot be found",
+            for upload in uploads
+        ],
+    )
+    wake_file_jobs()
+    await invalidate_files(current_user.id, [upload.filename for upload in uploads])
+
+    results = []
+    for upload, error in zip(uploads, errors):
+        if error is None:
+            results.append(
+                BatchItemResult(
+                    filename=upload.filename,
+                    status=status.HTTP_201_CREATED,
+                    file_size=upload.size,
+                    sha256=upload.sha256,
+                )
             )
-        return files
+        else:
+            results.append(
+                BatchItemResult(
+                    filename=upload.filename,
+                    status=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                    detail="Could not store the file",
+                )
+            )
+    return _batch_result(results)
+
+
+def _batch_result(results: list[BatchItemResult]) -> BatchResult:
+    succeeded = sum(1 for result in results if result.status < 400)
+    return BatchResult(
+        succeeded=succeeded, failed=len(results) - succeeded, results=results
+    )
+
+
+async def _get_session(
+    db: AsyncSession, session_id: str, user_id: int
+) -> UploadSession:
+    upload = await db.scalar(
+        select(UploadSession).where(
+            UploadSession.id == session_id,
+            UploadSession.user_id == user_id,
+            UploadSession.expires_at > datetime.now(timezone.utc),
+        )
+    )
+    if not upload:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="Upload session not found"
+        )
+    return upload
+
 
-    if not filename:
-        files = db.query(FileManage).filter(FileManage.user_id == current_user.id).all()
-        if not files:
+async def _session_detail(upload: UploadSession) -> UploadSessionDetail:
+    return UploadSessionDetail(
+        session_id=upload.id,
+        filename=upload.filename,
+        file_size=upload.file_size,
+        chunk_size=upload.chunk_size,
+        chunk_count=upload.chunk_count,
+        received=await run_in_threadpool(upload_sessions.received_chunks, upload.id),
+        expires_at=upload.expires_at,
+    )
+
+
+def _check_session_open(upload: UploadSession):
+    # Chunks are read by path while assembling, so none may change then.
+    if upload.status != "open":
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload session is being completed",
+        )
+
+
+async def _set_session_status(
+    db: AsyncSession, session_id: str, old: str, new: str
+) -> bool:
+    result = await db.execute(
+        update(UploadSession)
+        .where(UploadSession.id == session_id, UploadSession.status == old)
+        .values(status=new)
+    )
+    await db.commit()
+    return result.rowcount > 0
+
+
+async def _complete_session(db: AsyncSession, session_id: str, user_id: int):
+    upload = await _get_session(db, session_id, user_id)
+    filename, file_type = upload.filename, upload.file_type
+    if not await _set_session_status(db, upload.id, "open", "assembling"):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Upload session is already being completed",
+        )
+
+    try:
+        received = await run_in_threadpool(upload_sessions.received_chunks, upload.id)
+        missing = set(range(upload.chunk_count)) - set(received)
+        if missing:
             raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="You have no files uploaded",
+                status_code=status.HTTP_409_CONFLICT,
+                detail=f"Missing chunks: {sorted(missing)[:100]}",
             )
+
+        staged = await run_in_threadpool(upload_sessions.assemble, upload)
+        new_file = _file_row(user_id, filename, file_type, staged.size, staged.sha256)
+        await store_blob(db, staged, [new_file])
+    except Exception:
+        await db.rollback()
+        await _set_session_status(db, session_id, "assembling", "open")
+        raise
+
+    # Not deleted along with storing the file: store_blob rolls back pending
+    # changes before a transfer. Left behind, the sweep removes it on expiry.
+    await db.execute(delete(UploadSession).where(UploadSession.id == session_id))
+    await db.commit()
+    await run_in_threadpool(upload_sessions.discard, session_id)
+    return filename, staged.size, staged.sha256
+
+
+@router.post(
+    "/sessions",
+    status_code=status.HTTP_201_CREATED,
+    response_model=UploadSessionDetail,
+)
+async def create_upload_session(
+    request: UploadSessionCreate,
+    db: db_dependency,
+    current_user: Principal = Depends(get_current_user),
+):
+    if (request.chunk_size or 0) > UPLOAD_SESSION_MAX_CHUNK_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"chunk_size may not exceed {UPLOAD_SESSION_MAX_CHUNK_SIZE} bytes",
+        )
+    await check_quota(db, current_user.id, request.file_size)
+
+    upload = await run_in_threadpool(
+        upload_sessions.new_session,
+        current_user.id,
+        request.filename,
+        request.file_type,
+        request.file_size,
+        request.chunk_size or UPLOAD_SESSION_CHUNK_SIZE,
+    )
+    db.add(upload)
+    await db.commit()
+    return await _session_detail(upload)
+
+
+@router.get(
+    "/sessions/{session_id}",
+    status_code=status.HTTP_200_OK,
+    response_model=UploadSessionDetail,
+)
+async def get_upload_session(
+    session_id: str,
+    db: db_dependency,
+    current_user: Principal = Depends(get_current_user),
+):
+    upload = await _get_session(db, session_id, current_user.id)
+    return await _session_detail(upload)
+
+
+@router.put("/sessions/{session_id}/chunks/{index}", status_code=status.HTTP_200_OK)
+async def upload_chunk(
+    session_id: str,
+    index: int,
+    request: Request,
+    db: db_dependency,
+    current_user: Principal = Depends(get_current_user),
+):
+    upload = await _get_session(db, session_id, current_user.id)
+    await db.close()
+    _check_session_open(upload)
+    if not 0 <= index < upload.chunk_count:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Chunk index out of range"
+        )
+    expected = upload_sessions.chunk_length(upload, index)
+
+    def wrong_size(size="more"):
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Chunk {index} must be {expected} bytes, got {size}",
+        )
+
+    # Each attempt writes its own part file, so parallel retries of the same
+    # chunk never interleave; the rename makes the chunk visible atomically.
+    # Reading stops at the expected length, which the quota was checked for.
+    final_path = upload_sessions.chunk_path(upload.id, index)
+    sink = FileSink(f"{final_path}.{uuid.uuid4()}.part", upload.filename, None)
+    await receive_body(request, sink, expected, wrong_size)
+
+    if sink.size != expected:
+        await run_in_threadpool(os.remove, sink.path)
+        raise wrong_size(sink.size)
+    # Completion may have started while the chunk streamed in.
+    try:
+        _check_session_open(await _get_session(db, session_id, current_user.id))
+    except HTTPException:
+        await run_in_threadpool(os.remove, sink.path)
+        raise
+    finally:
+        await db.close()
+    await run_in_threadpool(os.replace, sink.path, final_path)
+
+    return {"index": index, "size": sink.size, "sha256": sink.sha256}
+
+
+@router.post("/sessions/{session_id}/complete", status_code=status.HTTP_201_CREATED)
+async def complete_upload_session(
+    session_id: str,
+    db: db_dependency,
+    current_user: Principal = Depends(get_current_user),
+):
+    filename, size, sha256 = await _complete_session(db, session_id, current_user.id)
+    wake_file_jobs()
+    await invalidate_files(current_user.id, [filename])
+    return {
+        "message": f"'{filename}' uploaded successfully",
+        "file_size": size,
+        "sha256": sha256,
+    }
+
+
+@router.delete("/sessions/{session_id}", status_code=status.HTTP_200_OK)
+async def abort_upload_session(
+    session_id: str,
+    db: db_dependency,
+    current_user: Principal = Depends(get_current_user),
+):
+    upload = await _get_session(db, session_id, current_user.id)
+    await db.delete(upload)
+    await db.commit()
+    await run_in_threadpool(upload_sessions.discard, session_id)
+    return {"message": "Upload session aborted"}
+
+
+@router.get("/usage", status_code=status.HTTP_200_OK, response_model=UsageDetail)
+async def storage_usage(
+    db: read_db_dependency,
+    current_user: Principal = Depends(get_current_user),
+):
+    usage = await get_usage(db, current_user.id)
+    quota = quota_for(usage)
+    return UsageDetail(
+        bytes_used=usage.bytes_used,
+        file_count=usage.file_count,
+        quota_bytes=quota,
+        bytes_available=None if quota is None else max(0, quota - usage.bytes_used),
+    )
+
+
+@router.get("/list", status_code=status.HTTP_200_OK, response_model=list[FileDetail])
+async def list_files(
+    response: Response,
+    db: read_db_dependency,
+    filters: Annotated[FileFilters, Depends()],
+    current_user: Principal = Depends(get_current_user),
+    filename: str = None,
+    match: Literal["substring", "prefix", "tokens"] = "substring",
+    sort: Literal["uploaded_at", "filename", "file_size"] = "uploaded_at",
+    order: Literal["asc", "desc"] = "desc",
+    limit: int = Query(default=100, ge=1, le=1000),
+    cursor: str | None = None,
+    include_total: bool = False,
+):
+    query = select(*LIST_COLUMNS).where(FileManage.user_id == current_user.id)
+    if filename:
+        query = query.where(match_filename(filename, match))
+    query = filters.apply(query)
+
+    rows, next_cursor = await page_files(
+        db, query, sort, order == "desc", limit, cursor
+    )
+    files = [row._asdict() for row in rows]
+
+    # The next page's cursor and the optional total travel in headers so the
+    # body stays a plain list of files.
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if include_total:
+        if filename or filters.active():
+            total = await count_files(db, query)
+        else:
+            # Kept with every upload and delete, so no rows need counting.
+            total = (await get_usage(db, current_user.id)).file_count
+        response.headers["X-Total-Count"] = str(total)
+
+    if not files and not cursor:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=(
+                "This file cannot be found"
+                if filename or filters.active()
+                else "You have no files uploaded"
+            ),
+        )
     return files
 
 
-@router.get("/download/{filename}", status_code=status.HTTP_200_OK)
-async def download_file(
-    filename: str, db: db_dependency, current_user: Users = Depends(get_current_user)
+@router.get("/search", status_code=status.HTTP_200_OK, response_model=list[FileDetail])
+async def search_files(
+    response: Response,
+    db: read_db_dependency,
+    filters: Annotated[FileFilters, Depends()],
+    current_user: Principal = Depends(get_current_user),
+    q: str = Query(min_length=1, max_length=255),
+    match: Literal["substring", "prefix", "tokens"] = "tokens",
+    limit: int = Query(default=20, ge=1, le=100),
+    offset: int = Query(default=0, ge=0, le=10000),
+):
+    """Files whose names match `q`, best matches first.
+
+    Ranked results can't be walked with a keyset cursor, so pages are
+    fetched by offset; X-Next-Offset is set while more may follow.
+    """
+    query = select(*LIST_COLUMNS).where(
+        FileManage.user_id == current_user.id, match_filename(q, match)
+    )
+    query = filters.apply(query).order_by(*relevance(q))
+    rows = (await db.execute(query.offset(offset).limit(limit + 1))).all()
+    if len(rows) > limit:
+        response.headers["X-Next-Offset"] = str(offset + limit)
+    return [row._asdict() for row in rows[:limit]]
+
+
+@router.get("/export", status_code=status.HTTP_200_OK)
+async def export_files(
+    filters: Annotated[FileFilters, Depends()],
+    current_user: Principal = Depends(get_current_user),
 ):
-    file_record = (
-        db.query(FileManage)
-        .filter(FileManage.filename == filename, FileManage.user_id == current_user.id)
-        .first()
+    """The whole catalog (or the filtered part) as NDJSON, one file per line.
+
+    Streamed in upload order straight from the database; the first bytes
+    go out before the last rows are read.
+    """
+    query = filters.apply(
+        select(*EXPORT_COLUMNS).where(FileManage.user_id == current_user.id)
+    ).order_by(FileManage.uploaded_at, FileManage.id)
+    return StreamingResponse(
+        stream_ndjson(query, user_id=current_user.id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="files.ndjson"'},
+    )
+
+
+async def _get_file(db: AsyncSession, filename: str, user_id: int) -> FileManage:
+    file_record = await db.scalar(
+        select(FileManage)
+        .where(FileManage.filename == filename, FileManage.user_id == user_id)
+        .order_by(FileManage.id)
+        .limit(1)
     )
 
     if not file_record:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="File not found"
         )
+    return file_record
 
-    file_path = file_record.path
-    if not os.path.exists(file_path):
-        raise HTTPException(
-            status_code=status.HTTP_404_NOT_FOUND, detail="File not found on server"
+
+def _open_blob(key: str, encoding: str | None):
+    return open_decoded(storage.open_read(key), encoding)
+
+
+async def _get_files(db: AsyncSession, filenames: list[str], user_id: int, *columns):
+    """Looks up several files by name, returning the first match for each."""
+    rows = await db.execute(
+        select(FileManage.id, FileManage.filename, *columns)
+        .where(FileManage.user_id == user_id, FileManage.filename.in_(filenames))
+        .order_by(FileManage.id)
+    )
+    found = {}
+    for row in rows:
+        found.setdefault(row.filename, row)
+    return found
+
+
+@router.get(
+    "/processing/{filename}",
+    status_code=status.HTTP_200_OK,
+    response_model=list[FileJobDetail],
+)
+async def file_processing(
+    filename: str,
+    db: read_db_dependency,
+    current_user: Principal = Depends(get_current_user),
+):
+    file_record = await _get_file(db, filename, current_user.id)
+    jobs = await db.execute(
+        select(
+            FileJob.processor,
+            FileJob.status,
+            FileJob.attempts,
+            FileJob.last_error,
+            FileJob.result,
+            FileJob.finished_at,
         )
+        .where(FileJob.file_id == file_record.id)
+        .order_by(FileJob.id)
+    )
+    return [job._asdict() for job in jobs]
 
-    # Increment download count
-    file_record.download_count += 1
-    db.commit()
 
-    return FileResponse(
-        path=file_path, filename=file_record.filename, media_type=file_record.file_type
+async def _send_file(
+    request: Request, file_record: FileMeta, offload: bool = False
+) -> Response:
+    if file_record.sha256 is None:
+        # Stored before content addressing, under a plain filesystem path.
+        file_path = file_record.path
+    else:
+        file_path = storage.local_path(file_record.path)
+
+    encoding = file_record.content_encoding
+    decode = encoding and not accepts_encoding(request, encoding)
+    # Only blobs live under the proxy's location for STORAGE_ROOT.
+    offload = (
+        offload
+        and DOWNLOAD_OFFLOAD
+        and file_path is not None
+        and file_record.sha256 is not None
+        and not decode
     )
+    body = None
+    if (
+        request.method == "GET"
+        and "range" not in request.headers
+        and file_path is not None
+        and not decode
+        and not offload
+    ):
+        # Small files are served from memory; ranges and HEAD go to disk.
+        body = await cached_body(file_record, file_path)
+    if (
+        body is None
+        and file_path is not None
+        and not offload
+        and not await run_in_threadpool(os.path.exists, file_path)
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="File not found on server",
+        )
 
+    if decode:
+        response = decoded_download(
+            request,
+            partial(_open_blob, file_record.path, encoding),
+            file_record.filename,
+            file_record.file_type,
+            file_record.sha256,
+            file_record.uploaded_at,
+            encoding,
+            file_record.file_size,
+        )
+    elif file_path is None:
+        url = await storage.download_url(
+            file_record.path, file_record.filename, file_record.file_type, encoding
+        )
+        response = redirect_download(
+            request, url, file_record.sha256, file_record.uploaded_at, encoding
+        )
+    elif offload:
+        if DOWNLOAD_OFFLOAD == "x-accel-redirect":
+            target = DOWNLOAD_OFFLOAD_PREFIX + quote(file_record.path)
+        else:
+            target = os.path.abspath(file_path)
+        response = offload_download(
+            request,
+            target,
+            file_record.filename,
+            file_record.file_type,
+            file_record.sha256,
+            file_record.uploaded_at,
+            encoding,
+        )
+    elif body is not None:
+        response = memory_download(
+            request,
+            body,
+            file_record.filename,
+            file_record.file_type,
+            file_record.sha256,
+            file_record.uploaded_at,
+            encoding,
+        )
+    else:
+        response = file_download(
+            request,
+            file_path,
+            file_record.filename,
+            file_record.file_type,
+            file_record.sha256,
+            file_record.uploaded_at,
+            encoding,
+        )
 
-@router.delete("/delete/{filename}", status_code=status.HTTP_200_OK)
-async def delete_file(
-    filename: str, db: db_dependency, current_user: Users = Depends(get_current_user)
+    # Revalidations and follow-up range segments are not new downloads
+    if (
+        request.method == "GET"
+        and response.status_code != status.HTTP_304_NOT_MODIFIED
+        and wants_full_body(request)
+    ):
+        download_counts.add(file_record.id)
+
+    return response
+
+
+@router.api_route(
+    "/download/{filename}", methods=["GET", "HEAD"], status_code=status.HTTP_200_OK
+)
+async def download_file(
+    filename: str,
+    request: Request,
+    db: read_db_dependency,
+    current_user: Principal = Depends(get_current_user),
 ):
-    file_record = (
-        db.query(FileManage)
-        .filter(FileManage.filename == filename, FileManage.user_id == current_user.id)
-        .first()
+    file_record = await get_file_meta(db, current_user.id, filename)
+    if file_record is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="File not found"
+        )
+    return await _send_file(request, file_record)
+
+
+@router.post("/links/{filename}", status_code=status.HTTP_201_CREATED)
+async def create_download_link(
+    filename: str,
+    request: Request,
+    db: read_db_dependency,
+    current_user: Principal = Depends(get_current_user),
+    expires_in: int = Query(default=DOWNLOAD_LINK_TTL, ge=1, le=DOWNLOAD_LINK_MAX_TTL),
+):
+    """A URL anyone can download the file from for `expires_in` seconds."""
+    file_record = await get_file_meta(db, current_user.id, filename)
+    if file_record is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND, detail="File not found"
+        )
+
+    expires_at = int(time.time()) + expires_in
+    url = request.url_for(
+        "signed_download",
+        token=sign_link(current_user.id, file_record, expires_at),
+        filename=quote(file_record.filename, safe=""),
     )
+    return {
+        "url": str(url),
+        "expires_at": datetime.fromtimestamp(expires_at, timezone.utc),
+    }
 
-    if not file_record:
+
+@router.api_route(
+    "/signed/{token}/{filename}",
+    methods=["GET", "HEAD"],
+    status_code=status.HTTP_200_OK,
+    name="signed_download",
+)
+async def signed_download(token: str, filename: str, request: Request):
+    """Serves a link from /files/links, without authentication.
+
+    A link works until it expires or its file is deleted or replaced.
+    """
+    verified = verify_link(token)
+    if verified is None or verified[1].filename != filename:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Invalid or expired link"
+        )
+    user_id, file_record, expires_at = verified
+    if not await link_is_current(user_id, file_record):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN, detail="Invalid or expired link"
+        )
+
+    response = await _send_file(request, file_record, offload=True)
+    # Caches may keep the response for as long as the link is valid; a
+    # redirect's presigned URL has its own, possibly shorter, expiry.
+    if response.status_code != status.HTTP_307_TEMPORARY_REDIRECT:
+        response.headers["cache-control"] = (
+            f"public, max-age={max(0, expires_at - int(time.time()))}"
+        )
+    return response
+
+
+@router.get("/archive", status_code=status.HTTP_200_OK)
+async def download_archive(
+    db: db_dependency,
+    current_user: Principal = Depends(get_current_user),
+    filename: list[str] = Query(),
+):
+    filenames = list(dict.fromkeys(filename))
+    if len(filenames) > BATCH_MAX_FILES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {BATCH_MAX_FILES} files can be archived at once",
+        )
+
+    found = await _get_files(
+        db,
+        filenames,
+        current_user.id,
+        FileManage.sha256,
+        FileManage.path,
+        FileManage.content_encoding,
+        FileManage.uploaded_at,
+    )
+    await db.close()
+    if not found:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, detail="File not found"
         )
 
+    names = set()
+    entries = []
+    for name in filenames:
+        row = found.get(name)
+        if row is None:
+            continue
+        if row.sha256 is None:
+            open_source = partial(open, row.path, "rb")
+        else:
+            open_source = partial(_open_blob, row.path, row.content_encoding)
+        entries.append((archive_name(name, names), open_source, row.uploaded_at))
+        download_counts.add(row.id)
+
+    headers = {"Content-Disposition": 'attachment; filename="files.zip"'}
+    missing = [name for name in filenames if name not in found]
+    if missing:
+        headers["X-Missing-Files"] = ",".join(quote(name) for name in missing)
+    return StreamingResponse(
+        stream_zip(entries), media_type="application/zip", headers=headers
+    )
+
+
+@router.delete("/delete/{filename}", status_code=status.HTTP_200_OK)
+async def delete_file(
+    filename: str,
+    db: db_dependency,
+    current_user: Principal = Depends(get_current_user),
+):
+    file_record = await _get_file(db, filename, current_user.id)
+
+    sha256 = file_record.sha256
     file_path = file_record.path
-    if os.path.exists(file_path):
-        os.remove(file_path)
 
-    db.delete(file_record)
-    db.commit()
+    await db.delete(file_record)
+    await forget_file_jobs(db, [file_record.id])
+    await release_usage(db, current_user.id, file_record.file_size, 1)
+    if sha256 is None:
+        # Stored before content addressing; the file is not shared.
+        await db.commit()
+        if await run_in_threadpool(os.path.exists, file_path):
+            await run_in_threadpool(os.remove, file_path)
+    else:
+        removed_key = await release_blob(db, sha256)
+        await db.commit()
+        if removed_key:
+            await unlink_blob(db, sha256, removed_key)
+    await invalidate_files(current_user.id, [filename])
 
     return {"message": f"File '{filename}' deleted successfully"}
+
+
+@router.post(
+    "/delete/batch",
+    status_code=status.HTTP_200_OK,
+    response_model=BatchResult,
+    response_model_exclude_none=True,
+)
+async def delete_files(
+    batch: FileBatch,
+    db: db_dependency,
+    current_user: Principal = Depends(get_current_user),
+):
+    filenames = list(dict.fromkeys(batch.filenames))
+    found = await _get_files(
+        db,
+        filenames,
+        current_user.id,
+        FileManage.sha256,
+        FileManage.path,
+        FileManage.file_size,
+    )
+
+    references = {}
+    legacy_paths = []
+    for row in found.values():
+        if row.sha256 is None:
+            legacy_paths.append(row.path)
+        else:
+            references[row.sha256] = references.get(row.sha256, 0) + 1
+
+    file_ids = [row.id for row in found.values()]
+    await forget_file_jobs(db, file_ids)
+    await db.execute(delete(FileManage).where(FileManage.id.in_(file_ids)))
+    await release_usage(
+        db,
+        current_user.id,
+        sum(row.file_size for row in found.values()),
+        len(found),
+    )
+    removed = {}
+    for sha256, count in references.items():
+        key = await release_blob(db, sha256, count)
+        if key:
+            removed[sha256] = key
+    await db.commit()
+    await invalidate_files(current_user.id, found)
+
+    for sha256, key in removed.items():
+        await unlink_blob(db, sha256, key)
+    for path in legacy_paths:
+        if await run_in_threadpool(os.path.exists, path):
+            await run_in_threadpool(os.remove, path)
+
+    return _batch_result(
+        [
+            (
+                BatchItemResult(filename=name, status=status.HTTP_200_OK)
+                if name in found
+                else BatchItemResult(
+                    filename=name,
+                    status=status.HTTP_404_NOT_FOUND,
+                    detail="File not found",
+                )
+            )
+            for name in filenames
+        ]
+    )
@@ -0,0 +1,159 @@
+import argparse
+import asyncio
+
+from app.core.database import engine
+
+
+async def _create_schema():
+    from app.models.schema import create_schema
+
+    try:
+        changes = await create_schema()
+    except RuntimeError as exc:
+        raise SystemExit(f"schema not upgraded: {exc}")
+    finally:
+        await engine.dispose()
+    for change in changes:
+        print(change)
+    if not changes:
+        print("schema up to date")
+
+
+async def _migrate_storage(source_root):
+    from app.services.blobs import relocate_blobs
+
+    try:
+        moved, missing = await relocate_blobs(source_root)
+    finally:
+        await engine.dispose()
+    print(f"moved {moved} blobs, {missing} missing")
+
+
+async def _repair_usage(batch_size):
+    from app.services.usage import repair_usage
+
+    try:
+        checked, drifted = await repair_usage(batch_size)
+    finally:
+        await engine.dispose()
+    print(f"checked {checked} users, corrected {drifted}")
+
+
+async def _reconcile(args):
+    from app.services.reconcile import reconcile_storage
+
+    def report(kind, detail):
+        print(f"{kind}: {detail}", flush=True)
+
+    try:
+        counts = await reconcile_storage(
+            report,
+            repair=args.repair,
+            checkpoint_path=args.checkpoint,
+            rate=args.rate,
+            grace=args.grace,
+            parallel=args.parallel,
+            batch_size=args.batch_size,
+            max_missing=args.max_missing,
+            force=args.force,
+        )
+    except RuntimeError as exc:
+        raise SystemExit(f"repair aborted: {exc}")
+    finally:
+        await engine.dispose()
+    print(", ".join(f"{count} {name}" for name, count in counts.items()) or "done")
+
+
+async def _file_worker():
+    from app.services.file_jobs import run_file_jobs
+
+    try:
+        await run_file_jobs()
+    finally:
+        await engine.dispose()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser(
+        "create-schema",
+        help="create missing tables and add missing columns and indexes to "
+        "existing ones; run before starting the server",
+    )
+    migrate = commands.add_parser(
+        "migrate-storage",
+        help="move blobs into the configured storage backend and layout",
+    )
+    migrate.add_argument(
+        "--from-local",
+        metavar="DIR",
+        help="also move blobs already keyed correctly from this local root",
+    )
+    repair = commands.add_parser(
+        "repair-usage",
+        help="recompute every user's storage usage from their files",
+    )
+    repair.add_argument("--batch-size", type=int, default=500)
+    reconcile = commands.add_parser(
+        "reconcile",
+        help="find stored contents without rows and rows without contents",
+    )
+    reconcile.add_argument(
+        "--repair",
+        action="store_true",
+        help="delete what is found instead of only reporting it",
+    )
+    reconcile.add_argument(
+        "--checkpoint",
+        metavar="FILE",
+        help="save progress here and resume from it after an interruption",
+    )
+    reconcile.add_argument(
+        "--rate",
+        type=float,
+        default=1000,
+        help="objects checked per second, 0 for no limit",
+    )
+    reconcile.add_argument(
+        "--grace",
+        type=float,
+        default=3600,
+        help="seconds a stored file is left alone, as its upload may be committing",
+    )
+    reconcile.add_argument(
+        "--parallel", type=int, default=8, help="directories scanned at once"
+    )
+    reconcile.add_argument(
+        "--max-missing",
+        type=float,
+        default=0.05,
+        help="fraction of files without contents above which --repair deletes "
+        "nothing",
+    )
+    reconcile.add_argument(
+        "--force",
+        action="store_true",
+        help="repair however many files are missing their contents",
+    )
+    reconcile.add_argument("--batch-size", type=int, default=1000)
+    commands.add_parser(
+        "file-worker",
+        help="run post-upload file jobs; start several for a worker pool",
+    )
+    args = parser.parse_args(argv)
+
+    if args.command == "create-schema":
+        asyncio.run(_create_schema())
+    elif args.command == "migrate-storage":
+        asyncio.run(_migrate_storage(args.from_local))
+    elif args.command == "repair-usage":
+        asyncio.run(_repair_usage(args.batch_size))
+    elif args.command == "reconcile":
+        asyncio.run(_reconcile(args))
+    elif args.command == "file-worker":
+        asyncio.run(_file_worker())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,355 @@
+import logging
+import math
+import re
+import time
+import uuid
+from collections import OrderedDict, defaultdict
+from typing import NamedTuple
+
+from jose import JWTError, jwt
+from starlette.responses import JSONResponse
+
+from app.core.config import (
+    ADMISSION_BACKEND_URL,
+    ADMISSION_LEASE,
+    ADMISSION_MAX_KEYS,
+    ALGORITHM,
+    RATE_LIMITS,
+    ROUTE_CONCURRENCY,
+    SECRET_KEY,
+    UPLOAD_INFLIGHT_BYTES,
+    UPLOAD_UNKNOWN_LENGTH_BYTES,
+)
+from app.core.metrics import ADMISSION_IN_USE, ADMISSION_REJECTED
+
+logger = logging.getLogger(__name__)
+
+# (group, methods, path); the first match is the request's group.
+ROUTE_GROUPS = (
+    ("auth", ("POST",), re.compile(r"/auth/(login|token|register|reset_password)")),
+    (
+        "upload",
+        ("POST", "PUT"),
+        re.compile(r"/files/(upload(/[^/]+)?|sessions(/[^/]+/chunks/[^/]+)?)"),
+    ),
+    ("archive", ("GET",), re.compile(r"/files/archive")),
+    ("download", ("GET", "HEAD"), re.compile(r"/files/(download|signed)/.+")),
+)
+
+
+def route_group(method: str, path: str) -> str | None:
+    for group, methods, pattern in ROUTE_GROUPS:
+        if method in methods and pattern.fullmatch(path):
+            return group
+    return None
+
+
+class RateLimit(NamedTuple):
+    group: str
+    scope: str  # "ip" or "user"
+    rate: float  # tokens per second
+    burst: int
+
+
+def parse_rate_limit(spec: str) -> RateLimit:
+    match = re.fullmatch(r"(\w+):(ip|user)=(\d+)/(\d+(?:\.\d+)?)", spec)
+    if match is None:
+        raise RuntimeError(
+            f"Invalid rate limit {spec!r}, expected e.g. 'auth:ip=30/60'"
+        )
+    group, scope, requests, seconds = match.groups()
+    return RateLimit(group, scope, int(requests) / float(seconds), int(requests))
+
+
+class LocalAdmission:
+    """Token buckets and in-flight counters held in this process.
+
+    Only used from the event loop, so no locking is needed. Buckets beyond
+    `max_keys` are dropped least recently used first, which refills them.
+    """
+
+    def __init__(self, max_keys: int):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()  # key -> (tokens, updated)
+        self._in_use = defaultdict(int)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        """Takes a token; returns 0, or the seconds until one is available."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+    async def acquire(self, key: str, token: str, amount: int, limit: int) -> bool:
+        # A request bigger than the limit on its own still gets in when
+        # nothing else holds any, or it could never be admitted.
+        used = self._in_use[key]
+        if used and used + amount > limit:
+            return False
+        self._in_use[key] += amount
+        return True
+
+    async def settle(self, key: str, token: str, held: int, amount: int):
+        """Changes what a holder holds from `held` to `amount`, unchecked."""
+        self._in_use[key] += amount - held
+
+    async def release(self, key: str, token: str, amount: int):
+        self._in_use[key] -= amount
+
+    async def stop(self):
+        pass
+
+
+# Redis TIME keeps every worker on one clock.
+_TAKE = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local t = redis.call("TIME")
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+local state = redis.call("HMGET", KEYS[1], "tokens", "updated")
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local wait = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+else
+    wait = (1 - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tokens, "updated", now)
+redis.call("PEXPIRE", KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+# KEYS[1] is a sorted set of holders by lease expiry, KEYS[2] their amounts.
+_ACQUIRE = """
+local t = redis.call("TIME")
+local now = tonumber(t[1]) + tonumber(t[2]) / 1000000
+for _, holder in ipairs(redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", now)) do
+    redis.call("HDEL", KEYS[2], holder)
+end
+redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", now)
+local used = 0
+for _, held in ipairs(redis.call("HVALS", KEYS[2])) do
+    used = used + tonumber(held)
+end
+local amount = tonumber(ARGV[2])
+if used > 0 and used + amount > tonumber(ARGV[3]) then
+    return 0
+end
+local expires = now + tonumber(ARGV[4])
+redis.call("ZADD", KEYS[1], expires, ARGV[1])
+redis.call("HSET", KEYS[2], ARGV[1], amount)
+redis.call("EXPIRE", KEYS[1], ARGV[4])
+redis.call("EXPIRE", KEYS[2], ARGV[4])
+return 1
+"""
+
+# Only holders whose lease hasn't run out are resized.
+_SETTLE = """
+if redis.call("HEXISTS", KEYS[1], ARGV[1]) == 1 then
+    redis.call("HSET", KEYS[1], ARGV[1], ARGV[2])
+end
+"""
+
+
+class RedisAdmission:
+    """Shares buckets and in-flight counters between workers through Redis.
+
+    Each in-flight holder is a lease, so a worker that dies without
+    releasing only holds its slots until ADMISSION_LEASE runs out.
+    """
+
+    prefix = "file-management:admission:"
+
+    def __init__(self, url: str, lease: int):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError(
+                "ADMISSION_BACKEND_URL needs the 'redis' package installed"
+            )
+        self.lease = lease
+        self._redis = redis.from_url(url)
+        self._take = self._redis.register_script(_TAKE)
+        self._acquire = self._redis.register_script(_ACQUIRE)
+        self._settle = self._redis.register_script(_SETTLE)
+
+    async def take(self, key: str, rate: float, burst: int) -> float:
+        return float(await self._take(keys=[self.prefix + key], args=[rate, burst]))
+
+    async def acquire(self, key: str, token: str, amount: int, limit: int) -> bool:
+        keys = [self.prefix + key, self.prefix + key + ":amounts"]
+        return bool(
+            await self._acquire(keys=keys, args=[token, amount, limit, self.lease])
+        )
+
+    async def settle(self, key: str, token: str, held: int, amount: int):
+        await self._settle(keys=[self.prefix + key + ":amounts"], args=[token, amount])
+
+    async def release(self, key: str, token: str, amount: int):
+        async with self._redis.pipeline() as pipe:
+            pipe.zrem(self.prefix + key, token)
+            pipe.hdel(self.prefix + key + ":amounts", token)
+            await pipe.execute()
+
+    async def stop(self):
+        await self._redis.aclose()
+
+
+def create_admission_backend(url: str):
+    if url:
+        return RedisAdmission(url, ADMISSION_LEASE)
+    return LocalAdmission(ADMISSION_MAX_KEYS)
+
+
+admission = create_admission_backend(ADMISSION_BACKEND_URL)
+
+
+def _header(scope, name: bytes) -> str | None:
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _user_id(scope) -> str | None:
+    # Verified, so a forged token can't drain someone else's bucket; an
+    # invalid one is left for the endpoint to reject.
+    scheme, _, token = (_header(scope, b"authorization") or "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return None
+    user_id = payload.get("id")
+    return None if user_id is None else str(user_id)
+
+
+def _refuse(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        {"detail": detail},
+        status_code=status_code,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+    )
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware refusing requests over their limits up front.
+
+    Rate limits answer 429 and full concurrency or upload byte budgets
+    answer 503, both with Retry-After and before the body is read. If the
+    shared backend is unreachable requests are let through rather than
+    refused.
+    """
+
+    def __init__(self, app, backend=None):
+        self.app = app
+        self.backend = backend or admission
+        self.rate_limits = [parse_rate_limit(spec) for spec in RATE_LIMITS]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        group = route_group(scope["method"], scope["path"])
+        held = []
+        try:
+            try:
+                refusal = await self._admit(scope, group, held)
+            except Exception:
+                logger.exception("admission check failed, admitting")
+                refusal = None
+            if refusal is not None:
+                ADMISSION_REJECTED.labels(group or "other", refusal[0]).inc()
+                return await refusal[1](scope, receive, send)
+            for hold in held:
+                if hold[0] == "upload_bytes" and hold[4]:
+                    receive = self._settling_receive(receive, hold)
+            await self.app(scope, receive, send)
+        finally:
+            for resource, key, token, amount, _ in held:
+                ADMISSION_IN_USE.labels(resource).dec(amount)
+                try:
+                    await self.backend.release(key, token, amount)
+                except Exception:
+                    logger.exception("admission release failed")
+
+    async def _admit(self, scope, group: str | None, held: list):
+        client = scope.get("client")
+        ip = client[0] if client else "unknown"
+        for limit in self.rate_limits:
+            if limit.group not in (group, "all"):
+                continue
+            who = f"ip:{ip}"
+            if limit.scope == "user":
+                user_id = _user_id(scope)
+                who = f"user:{user_id}" if user_id else who
+            wait = await self.backend.take(
+                f"rate:{limit.group}:{who}", limit.rate, limit.burst
+            )
+            if wait > 0:
+                return "rate", _refuse(429, "Too many requests", wait)
+
+        token = uuid.uuid4().hex
+        concurrency = ROUTE_CONCURRENCY.get(group, 0)
+        if concurrency > 0:
+            key = f"concurrency:{group}"
+            if not await self.backend.acquire(key, token, 1, concurrency):
+                return "concurrency", _refuse(503, "Server busy, retry shortly", 1)
+            held.append([f"concurrency:{group}", key, token, 1, False])
+            ADMISSION_IN_USE.labels(f"concurrency:{group}").inc()
+
+        if group == "upload" and UPLOAD_INFLIGHT_BYTES > 0:
+            declared = _header(scope, b"content-length")
+            unknown = declared is None
+            size = UPLOAD_UNKNOWN_LENGTH_BYTES if unknown else int(declared)
+            if not await self.backend.acquire(
+                "upload-bytes", token, size, UPLOAD_INFLIGHT_BYTES
+            ):
+                return "upload_bytes", _refuse(
+                    503, "Too many uploads in progress, retry shortly", 1
+                )
+            held.append(["upload_bytes", "upload-bytes", token, size, unknown])
+            ADMISSION_IN_USE.labels("upload_bytes").inc(size)
+        return None
+
+    def _settling_receive(self, receive, hold: list):
+        """Keeps the bytes held for a body of unknown length up to date.
+
+        The hold grows by UPLOAD_UNKNOWN_LENGTH_BYTES whenever the body
+        passes it, and shrinks to the body's size once it has been read.
+        """
+        received = 0
+
+        async def settling_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if not message.get("more_body", False):
+                    await self._settle(hold, received)
+                elif received > hold[3]:
+                    await self._settle(hold, received + UPLOAD_UNKNOWN_LENGTH_BYTES)
+            return message
+
+        return settling_receive
+
+    async def _settle(self, hold: list, amount: int):
+        resource, key, token, held, _ = hold
+        try:
+            await self.backend.settle(key, token, held, amount)
+        except Exception:
+            logger.exception("admission settle failed")
+            return
+        ADMISSION_IN_USE.labels(resource).inc(amount - held)
+        hold[3] = amount
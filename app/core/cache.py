@@ -0,0 +1,205 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+
+from app.core.config import CACHE_INVALIDATION_URL
+
+
+class TTLCache:
+    """Bounded in-process LRU cache whose entries also expire.
+
+    Entries expire after `ttl` seconds or at an explicit `expires_at` epoch
+    time, whichever comes first. Only used from the event loop, so no
+    locking is needed.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at <= time.time():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value, expires_at: float | None = None):
+        if self.maxsize <= 0:
+            return
+        deadline = time.time() + self.ttl
+        if expires_at is not None:
+            deadline = min(deadline, expires_at)
+        self._data[key] = (value, deadline)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        entry = self._data.pop(key, None)
+        return None if entry is None else entry[0]
+
+    def clear(self):
+        self._data.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+
+class ByteLRUCache:
+    """In-process LRU cache of bytes values, bounded by their total size.
+
+    Values larger than `max_item` are never stored, so one big file can't
+    flush everything else. Like TTLCache, only used from the event loop.
+    """
+
+    def __init__(self, maxbytes: int, max_item: int):
+        self.maxbytes = maxbytes
+        self.max_item = min(max_item, maxbytes)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    def get(self, key) -> bytes | None:
+        value = self._data.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value: bytes):
+        if self.maxbytes <= 0 or len(value) > self.max_item:
+            return
+        self.pop(key)
+        self._data[key] = value
+        self.bytes += len(value)
+        while self.bytes > self.maxbytes:
+            _, evicted = self._data.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+
+    def pop(self, key):
+        value = self._data.pop(key, None)
+        if value is not None:
+            self.bytes -= len(value)
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._data),
+            "bytes": self.bytes,
+            "maxbytes": self.maxbytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+
+class InvalidationBus:
+    """Delivers cache invalidations to every subscriber in this process.
+
+    Subclasses fan the same messages out to other workers.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+
+    def subscribe(self, topic: str, callback):
+        self._subscribers.setdefault(topic, []).append(callback)
+
+    async def publish(self, topic: str, key):
+        self._deliver(topic, key)
+
+    def _deliver(self, topic: str, key):
+        for callback in self._subscribers.get(topic, []):
+            callback(key)
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+
+class RedisInvalidationBus(InvalidationBus):
+    """Shares invalidations between workers through Redis pub/sub."""
+
+    channel = "file-management:invalidate"
+
+    def __init__(self, url: str):
+        super().__init__()
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError(
+                "CACHE_INVALIDATION_URL needs the 'redis' package installed"
+            )
+        self._redis = redis.from_url(url)
+        self._listener = None
+
+    async def publish(self, topic: str, key):
+        # Delivered locally through our own subscription, like everyone else.
+        await self._redis.publish(
+            self.channel, json.dumps({"topic": topic, "key": key})
+        )
+
+    async def start(self):
+        pubsub = self._redis.pubsub()
+        await pubsub.subscribe(self.channel)
+        self._listener = asyncio.create_task(self._listen(pubsub))
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+        await self._redis.aclose()
+
+    async def _listen(self, pubsub):
+        async for message in pubsub.listen():
+            if message["type"] != "message":
+                continue
+            payload = json.loads(message["data"])
+            key = payload["key"]
+            self._deliver(
+                payload["topic"], tuple(key) if isinstance(key, list) else key
+            )
+
+
+def create_invalidation_bus(url: str) -> InvalidationBus:
+    if url:
+        return RedisInvalidationBus(url)
+    return InvalidationBus()
+
+
+invalidation_bus = create_invalidation_bus(CACHE_INVALIDATION_URL)
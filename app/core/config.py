@@ -3,9 +3,187 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-print(f"DATABASE_URL from env: {os.getenv('DATABASE_URL')}")
-
 SECRET_KEY = os.getenv("SECRET_KEY")
 ALGORITHM = os.getenv("ALGORITHM")
 ACCESS_TOKEN_EXPIRES_AT = int(os.getenv("ACCESS_TOKEN_EXPIRES_AT", 30))
 DATABASE_URL = os.getenv("DATABASE_URL")
+
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploaded_files")
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+# "user" only lets a caller claim blobs they already own by hash. "global"
+# lets anyone claim any stored blob, so knowing a file's hash and size is
+# enough to download it; only enable it when every user may read every
+# file. Stored content is deduplicated across users either way.
+INSTANT_UPLOAD_SCOPE = os.getenv("INSTANT_UPLOAD_SCOPE", "user")
+# Contents written less than this many seconds ago are not deleted when
+# their last reference goes, as an upload of the same content may have just
+# stored them again and not yet committed; `reconcile --repair` removes them.
+BLOB_UNLINK_GRACE = int(os.getenv("BLOB_UNLINK_GRACE", 600))
+
+# "local" keeps blobs under STORAGE_ROOT sharded by hash prefix; "s3" stores
+# them in S3_BUCKET on AWS or any S3-compatible endpoint (MinIO, moto, ...).
+# AWS credentials come from the usual AWS_* environment variables.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local")
+STORAGE_ROOT = os.getenv("STORAGE_ROOT", os.path.join(UPLOAD_DIR, "blobs"))
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION") or None
+S3_PRESIGN_TTL = int(os.getenv("S3_PRESIGN_TTL", 300))
+
+# At-rest compression: "gzip", "zstd" (needs the zstandard package) or ""
+# to store uploads as-is. Only COMPRESS_TYPES are compressed; a trailing
+# "*" matches a prefix. Already-compressed formats are always skipped.
+COMPRESSION_ENCODING = os.getenv("COMPRESSION_ENCODING", "")
+COMPRESSION_LEVEL = int(os.getenv("COMPRESSION_LEVEL")) if os.getenv("COMPRESSION_LEVEL") else None
+COMPRESS_TYPES = [t.strip() for t in os.getenv(
+    "COMPRESS_TYPES",
+    "text/*,application/json,application/x-ndjson,application/xml,application/javascript,"
+    "application/csv,application/yaml,application/x-yaml,application/sql,image/svg+xml",
+).lower().split(",") if t.strip()]
+
+# Default per-user storage quota in bytes, 0 for unlimited; a user's
+# user_usage.quota_bytes overrides it.
+STORAGE_QUOTA_BYTES = int(os.getenv("STORAGE_QUOTA_BYTES", 0))
+
+# Upper bound on filenames per batch delete or ZIP download request
+BATCH_MAX_FILES = int(os.getenv("BATCH_MAX_FILES", 1000))
+# Rows fetched from the cursor and sent per chunk by /files/export
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", 1000))
+# "stored" streams ZIP downloads without spending CPU on compression
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "stored")
+
+# Post-upload processors, by built-in name or "package.module:attr" for
+# plugins, and how many jobs of each type run at once ("name=n,...").
+# "checksum" reads every stored byte back to verify the upload's SHA-256,
+# which the upload already computed, so it is only run when listed here.
+FILE_PROCESSORS = [p.strip() for p in os.getenv("FILE_PROCESSORS", "mime").split(",") if p.strip()]
+FILE_PROCESSOR_CONCURRENCY = {
+    name.strip(): int(n)
+    for name, _, n in (p.partition("=") for p in os.getenv("FILE_PROCESSOR_CONCURRENCY", "").split(",") if p.strip())
+}
+FILE_JOB_CONCURRENCY = int(os.getenv("FILE_JOB_CONCURRENCY", 2))
+# false leaves file jobs to `python -m app.cli file-worker` processes
+FILE_JOBS_IN_APP = os.getenv("FILE_JOBS_IN_APP", "true").lower() in ("1", "true", "yes")
+FILE_JOB_POLL_INTERVAL = float(os.getenv("FILE_JOB_POLL_INTERVAL", 5))
+FILE_JOB_LEASE = int(os.getenv("FILE_JOB_LEASE", 600))
+FILE_JOB_MAX_ATTEMPTS = int(os.getenv("FILE_JOB_MAX_ATTEMPTS", 5))
+FILE_JOB_RETRY_BASE = int(os.getenv("FILE_JOB_RETRY_BASE", 10))
+FILE_JOB_RETRY_MAX = int(os.getenv("FILE_JOB_RETRY_MAX", 3600))
+
+UPLOAD_SESSION_CHUNK_SIZE = int(os.getenv("UPLOAD_SESSION_CHUNK_SIZE", 8 * 1024 * 1024))
+UPLOAD_SESSION_MAX_CHUNK_SIZE = int(os.getenv("UPLOAD_SESSION_MAX_CHUNK_SIZE", 64 * 1024 * 1024))
+UPLOAD_SESSION_TTL = int(os.getenv("UPLOAD_SESSION_TTL", 24 * 60 * 60))
+UPLOAD_SESSION_SWEEP_INTERVAL = int(os.getenv("UPLOAD_SESSION_SWEEP_INTERVAL", 300))
+
+# Read replicas for read-only endpoints, comma separated; each gets its own
+# pool. For local testing a copy of the SQLite file works as a replica.
+# Users read from the primary for REPLICA_STICKY_SECONDS after changing
+# their files or account (all workers, with CACHE_INVALIDATION_URL), and a
+# replica that can't be reached is skipped for REPLICA_RETRY_SECONDS.
+DATABASE_REPLICA_URLS = [u.strip() for u in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if u.strip()]
+REPLICA_STICKY_SECONDS = float(os.getenv("REPLICA_STICKY_SECONDS", 5))
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", 30))
+REPLICA_CONNECT_TIMEOUT = float(os.getenv("REPLICA_CONNECT_TIMEOUT", 2))
+
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# 0 disables the server-side timeout (Postgres only)
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 0))
+
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", 10000))
+PRINCIPAL_CACHE_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", 60))
+# Download lookups by owner and filename
+FILE_CACHE_SIZE = int(os.getenv("FILE_CACHE_SIZE", 10000))
+FILE_CACHE_TTL = int(os.getenv("FILE_CACHE_TTL", 60))
+# Bytes of small stored files kept in memory per worker (0 disables), and
+# the largest file that is cached
+CONTENT_CACHE_BYTES = int(os.getenv("CONTENT_CACHE_BYTES", 64 * 1024 * 1024))
+CONTENT_CACHE_MAX_FILE = int(os.getenv("CONTENT_CACHE_MAX_FILE", 256 * 1024))
+# Signed download links: default and longest lifetime (seconds), and the key
+# they are signed with. Changing the key revokes every outstanding link.
+DOWNLOAD_LINK_TTL = int(os.getenv("DOWNLOAD_LINK_TTL", 300))
+DOWNLOAD_LINK_MAX_TTL = int(os.getenv("DOWNLOAD_LINK_MAX_TTL", 24 * 60 * 60))
+DOWNLOAD_LINK_SECRET = os.getenv("DOWNLOAD_LINK_SECRET") or SECRET_KEY
+# Let the reverse proxy send locally stored files for signed links:
+# "x-accel-redirect" (nginx; DOWNLOAD_OFFLOAD_PREFIX is an `internal`
+# location aliased to STORAGE_ROOT) or "x-sendfile" (Apache, lighttpd; the
+# absolute path is sent). "" streams the bytes from Python.
+DOWNLOAD_OFFLOAD = os.getenv("DOWNLOAD_OFFLOAD", "")
+DOWNLOAD_OFFLOAD_PREFIX = os.getenv("DOWNLOAD_OFFLOAD_PREFIX", "/protected-blobs/")
+# e.g. redis://localhost:6379/0 to share cache invalidations between workers
+CACHE_INVALIDATION_URL = os.getenv("CACHE_INVALIDATION_URL", "")
+# Download counts are buffered in memory and written this often (seconds).
+DOWNLOAD_COUNT_FLUSH_INTERVAL = float(os.getenv("DOWNLOAD_COUNT_FLUSH_INTERVAL", 5))
+
+# Admission control, applied before a request body is read. Token buckets
+# per client as "group:ip=requests/seconds" or "group:user=requests/seconds"
+# (the burst is the request count); groups are auth, upload, download,
+# archive or all. User buckets key unauthenticated requests by IP. Off by
+# default: IP buckets key on the client address uvicorn reports, which comes
+# from X-Forwarded-For only for proxies in SERVER_FORWARDED_ALLOW_IPS, so
+# behind any other proxy every client would share one bucket.
+RATE_LIMITS = [r.strip() for r in os.getenv("RATE_LIMITS", "").split(",") if r.strip()]
+# Requests of a group handled at once, as "group=n,..."
+ROUTE_CONCURRENCY = {
+    name.strip(): int(n)
+    for name, _, n in (p.partition("=") for p in os.getenv("ROUTE_CONCURRENCY", "upload=64,archive=8").split(",") if p.strip())
+}
+# Declared body bytes of uploads in progress, 0 for no cap. Uploads without
+# a Content-Length are charged UPLOAD_UNKNOWN_LENGTH_BYTES up front, more as
+# they grow past it, and their real size once the body has been read.
+UPLOAD_INFLIGHT_BYTES = int(os.getenv("UPLOAD_INFLIGHT_BYTES", 1024 * 1024 * 1024))
+UPLOAD_UNKNOWN_LENGTH_BYTES = int(os.getenv("UPLOAD_UNKNOWN_LENGTH_BYTES", 64 * 1024 * 1024))
+# e.g. redis://localhost:6379/0 to share the limits between workers; slots
+# of a worker that dies are freed after ADMISSION_LEASE seconds.
+ADMISSION_BACKEND_URL = os.getenv("ADMISSION_BACKEND_URL", "")
+ADMISSION_LEASE = int(os.getenv("ADMISSION_LEASE", 3600))
+ADMISSION_MAX_KEYS = int(os.getenv("ADMISSION_MAX_KEYS", 100000))
+
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", os.cpu_count() or 1))
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", PASSWORD_HASH_WORKERS))
+PASSWORD_HASH_QUEUE = int(os.getenv("PASSWORD_HASH_QUEUE", 64))
+
+DOMAIN = os.getenv("DOMAIN", "localhost:8000")
+
+# `python -m app.server`. SERVER_WORKERS=0 starts one worker per CPU; each
+# worker has its own PASSWORD_HASH_WORKERS processes and DB pool. Backlog is
+# the listen queue, keep-alive the idle connection timeout and the graceful
+# timeout how long shutdown waits for in-flight requests (seconds).
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", 8000))
+SERVER_WORKERS = int(os.getenv("SERVER_WORKERS", 1))
+SERVER_BACKLOG = int(os.getenv("SERVER_BACKLOG", 2048))
+SERVER_KEEPALIVE = int(os.getenv("SERVER_KEEPALIVE", 5))
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", 30))
+# "asyncio" / "h11" if uvloop or httptools can't be installed
+SERVER_LOOP = os.getenv("SERVER_LOOP", "uvloop")
+SERVER_HTTP = os.getenv("SERVER_HTTP", "httptools")
+SERVER_ACCESS_LOG = os.getenv("SERVER_ACCESS_LOG", "false").lower() in ("1", "true", "yes")
+# Comma separated addresses of reverse proxies whose X-Forwarded-For is
+# trusted for the client address, "*" for any
+SERVER_FORWARDED_ALLOW_IPS = os.getenv("SERVER_FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+MAIL_USERNAME = os.getenv("MAIL_USERNAME")
+MAIL_PASSWORD = os.getenv("MAIL_PASSWORD")
+MAIL_FROM = os.getenv("MAIL_FROM")
+MAIL_SERVER = os.getenv("MAIL_SERVER")
+MAIL_PORT = int(os.getenv("MAIL_PORT", 465))
+MAIL_SSL_TLS = os.getenv("MAIL_SSL_TLS", "true").lower() in ("1", "true", "yes")
+MAIL_STARTTLS = os.getenv("MAIL_STARTTLS", "false").lower() in ("1", "true", "yes")
+MAIL_USE_CREDENTIALS = os.getenv("MAIL_USE_CREDENTIALS", "true").lower() in ("1", "true", "yes")
+MAIL_VALIDATE_CERTS = os.getenv("MAIL_VALIDATE_CERTS", "true").lower() in ("1", "true", "yes")
+# Outbox sender: SMTP connections kept open, rows claimed per batch, and
+# exponential retry backoff between MAIL_RETRY_BASE and MAIL_RETRY_MAX seconds.
+MAIL_POOL_SIZE = int(os.getenv("MAIL_POOL_SIZE", 2))
+MAIL_IDLE_TIMEOUT = int(os.getenv("MAIL_IDLE_TIMEOUT", 60))
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", 50))
+MAIL_POLL_INTERVAL = float(os.getenv("MAIL_POLL_INTERVAL", 5))
+MAIL_SEND_LEASE = int(os.getenv("MAIL_SEND_LEASE", 300))
+MAIL_MAX_ATTEMPTS = int(os.getenv("MAIL_MAX_ATTEMPTS", 8))
+MAIL_RETRY_BASE = int(os.getenv("MAIL_RETRY_BASE", 30))
+MAIL_RETRY_MAX = int(os.getenv("MAIL_RETRY_MAX", 3600))
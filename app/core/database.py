@@ -1,8 +1,215 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import logging
+import time
+
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
-from app.core.config import DATABASE_URL
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
+from app.core.cache import invalidation_bus
+from app.core.config import (
+    DATABASE_URL,
+    DATABASE_REPLICA_URLS,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_TIMEOUT,
+    DB_POOL_RECYCLE,
+    DB_POOL_PRE_PING,
+    DB_STATEMENT_TIMEOUT_MS,
+    REPLICA_CONNECT_TIMEOUT,
+    REPLICA_RETRY_SECONDS,
+    REPLICA_STICKY_SECONDS,
+)
+from app.core.metrics import DB_POOL_WAIT, DB_READ_SESSIONS, instrument_engine
+
+logger = logging.getLogger(__name__)
+
+
+def async_database_url(url: str) -> str:
+    scheme, _, rest = url.partition("://")
+    driver = scheme.split("+")[0]
+    if driver in ("postgres", "postgresql"):
+        return f"postgresql+asyncpg://{rest}"
+    if driver == "sqlite":
+        return f"sqlite+aiosqlite://{rest}"
+    return url
+
+
+class PoolStats:
+    def __init__(self):
+        self.checkouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def observe(self, seconds: float):
+        DB_POOL_WAIT.observe(seconds)
+        self.checkouts += 1
+        self.wait_seconds += seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+
+
+pool_stats = PoolStats()
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # Records how long each checkout waited for a free (or new) connection.
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_stats.observe(time.perf_counter() - start)
+
+
+def engine_options(url: str) -> dict:
+    if url.startswith("sqlite") and (":memory:" in url or url.endswith("://")):
+        return {"poolclass": StaticPool}
+
+    options = {
+        "poolclass": TimedQueuePool,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if url.startswith("postgresql") and DB_STATEMENT_TIMEOUT_MS:
+        options["connect_args"] = {
+            "server_settings": {"statement_timeout": str(DB_STATEMENT_TIMEOUT_MS)}
+        }
+    return options
+
+
+def pool_status(engine) -> dict:
+    pool = engine.pool
+    status = {"checkouts": pool_stats.checkouts}
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        status.update(
+            size=pool.size(),
+            checked_out=pool.checkedout(),
+            overflow=pool.overflow(),
+            capacity=pool.size() + DB_MAX_OVERFLOW,
+            wait_seconds_total=round(pool_stats.wait_seconds, 6),
+            wait_seconds_max=round(pool_stats.max_wait_seconds, 6),
+        )
+    return status
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def create_replica_engine(url: str):
+    url = async_database_url(url)
+    options = engine_options(url)
+    if url.startswith("postgresql"):
+        # Fail over quickly instead of waiting on an unreachable host.
+        options.setdefault("connect_args", {})["timeout"] = REPLICA_CONNECT_TIMEOUT
+    replica = create_async_engine(url, **options)
+    instrument_engine(replica)
+    return replica
+
+
+class ReplicaRouter:
+    """Chooses where read-only sessions go.
+
+    Replicas are used in turn. A user whose files or account changed in
+    the last `sticky_seconds` reads from the primary, which has the change
+    even if the replicas don't yet, and a replica that fails to connect is
+    left out for `retry_seconds`.
+    """
+
+    def __init__(self, replicas: list, sticky_seconds: float, retry_seconds: float):
+        self.replicas = replicas
+        self.sticky_seconds = sticky_seconds
+        self.retry_seconds = retry_seconds
+        self._next = 0
+        self._down_until = {}
+        self._wrote_at = {}
+
+    def note_write(self, user_id: int):
+        now = time.monotonic()
+        self._wrote_at[user_id] = now
+        if len(self._wrote_at) > 1024:
+            for stale in [
+                uid
+                for uid, at in self._wrote_at.items()
+                if at < now - self.sticky_seconds
+            ]:
+                del self._wrote_at[stale]
+
+    def wrote_recently(self, user_id: int | None) -> bool:
+        wrote_at = self._wrote_at.get(user_id)
+        return wrote_at is not None and wrote_at > time.monotonic() - self.sticky_seconds
+
+    def candidates(self, user_id: int | None = None) -> list:
+        """Replicas to try in order; empty means use the primary."""
+        if not self.replicas or self.wrote_recently(user_id):
+            return []
+        start = self._next
+        self._next = (start + 1) % len(self.replicas)
+        now = time.monotonic()
+        return [
+            replica
+            for replica in self.replicas[start:] + self.replicas[:start]
+            if self._down_until.get(replica, 0) <= now
+        ]
+
+    def mark_down(self, replica, exc: Exception):
+        logger.warning("replica %s unavailable: %s", replica.url.host or replica.url.database, exc)
+        self._down_until[replica] = time.monotonic() + self.retry_seconds
+
+    def status(self) -> list:
+        # Checkout and wait totals are shared by every pool, so only the
+        # replica's own pool sizes are shown.
+        now = time.monotonic()
+        shared = ("checkouts", "wait_seconds_total", "wait_seconds_max")
+        return [
+            {
+                "url": replica.url.render_as_string(hide_password=True),
+                "available": self._down_until.get(replica, 0) <= now,
+                **{
+                    key: value
+                    for key, value in pool_status(replica).items()
+                    if key not in shared
+                },
+            }
+            for replica in self.replicas
+        ]
+
+
+ASYNC_DATABASE_URL = async_database_url(DATABASE_URL)
+engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+instrument_engine(engine)
+SessionLocal = async_sessionmaker(
+    bind=engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+)
 Base = declarative_base()
+
+replica_engines = [create_replica_engine(url) for url in DATABASE_REPLICA_URLS]
+replica_router = ReplicaRouter(
+    replica_engines, REPLICA_STICKY_SECONDS, REPLICA_RETRY_SECONDS
+)
+# Both are published after the change commits, in every worker.
+invalidation_bus.subscribe("file", lambda key: replica_router.note_write(key[0]))
+invalidation_bus.subscribe("user", replica_router.note_write)
+
+
+async def read_session(user_id: int | None = None) -> AsyncSession:
+    """A session for reads that may lag the primary slightly.
+
+    Opens on a replica when one is usable for `user_id`, otherwise on the
+    primary; db.info["replica"] tells which. Never write through it.
+    """
+    for replica in replica_router.candidates(user_id):
+        db = SessionLocal(bind=replica)
+        try:
+            # Connect now, so a dead replica falls back before any query.
+            await db.connection()
+        except (DBAPIError, OSError) as exc:
+            await db.close()
+            replica_router.mark_down(replica, exc)
+            continue
+        db.info["replica"] = True
+        DB_READ_SESSIONS.labels("replica").inc()
+        return db
+    if replica_router.replicas and not replica_router.wrote_recently(user_id):
+        DB_READ_SESSIONS.labels("fallback").inc()
+    else:
+        DB_READ_SESSIONS.labels("primary").inc()
+    return SessionLocal()
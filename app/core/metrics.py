@@ -0,0 +1,288 @@
+import time
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram
+from prometheus_client import generate_latest
+
+# Buckets shared by the latency histograms, from sub-millisecond to a minute.
+LATENCY_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+)
+THROUGHPUT_BUCKETS = tuple(2**n * 64 * 1024 for n in range(14))  # 64 KiB/s .. 512 MiB/s
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "Time to complete a request, including streaming the body",
+    ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS,
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "Requests currently being handled", ["method"]
+)
+REQUEST_BYTES = Counter(
+    "http_request_body_bytes_total", "Request body bytes received", ["route"]
+)
+RESPONSE_BYTES = Counter(
+    "http_response_body_bytes_total", "Response body bytes sent", ["route"]
+)
+RESPONSE_THROUGHPUT = Histogram(
+    "http_response_throughput_bytes_per_second",
+    "Send rate of responses of at least 64 KiB",
+    ["route"],
+    buckets=THROUGHPUT_BUCKETS,
+)
+
+UPLOAD_BYTES = Counter(
+    "file_upload_bytes_total", "File bytes received, before compression"
+)
+UPLOAD_STORED_BYTES = Counter(
+    "file_upload_stored_bytes_total", "File bytes written to staging after compression"
+)
+UPLOAD_THROUGHPUT = Histogram(
+    "file_upload_throughput_bytes_per_second",
+    "Receive rate of each uploaded file",
+    buckets=THROUGHPUT_BUCKETS,
+)
+STORAGE_LATENCY = Histogram(
+    "storage_operation_duration_seconds",
+    "Time spent in the storage backend",
+    ["backend", "operation"],
+    buckets=LATENCY_BUCKETS,
+)
+
+DB_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds", "Time per SQL statement", buckets=LATENCY_BUCKETS
+)
+DB_QUERIES_PER_REQUEST = Histogram(
+    "db_queries_per_request",
+    "SQL statements executed while handling a request",
+    ["route"],
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+DB_TIME_PER_REQUEST = Histogram(
+    "db_time_per_request_seconds",
+    "Time spent in SQL statements while handling a request",
+    ["route"],
+    buckets=LATENCY_BUCKETS,
+)
+DB_POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds",
+    "Time spent waiting for a pooled connection",
+    buckets=LATENCY_BUCKETS,
+)
+DB_POOL = Gauge("db_pool_connections", "Connection pool state", ["state"])
+DB_READ_SESSIONS = Counter(
+    "db_read_sessions_total",
+    "Read-only sessions by where they went: replica, primary or fallback",
+    ["target"],
+)
+
+PASSWORD_HASH_LATENCY = Histogram(
+    "password_hash_duration_seconds",
+    "bcrypt time in the worker pool",
+    ["operation"],
+    buckets=LATENCY_BUCKETS,
+)
+PASSWORD_HASH_WAIT = Histogram(
+    "password_hash_wait_seconds",
+    "Time waiting for a password hashing slot",
+    buckets=LATENCY_BUCKETS,
+)
+PASSWORD_HASH_PENDING = Gauge(
+    "password_hash_pending", "Password hashing operations running or queued"
+)
+PASSWORD_HASH_REJECTED = Counter(
+    "password_hash_rejected_total", "Password hashing requests refused with 503"
+)
+
+ADMISSION_REJECTED = Counter(
+    "admission_rejected_total",
+    "Requests refused before their body was read",
+    ["group", "reason"],
+)
+ADMISSION_IN_USE = Gauge(
+    "admission_in_use",
+    "Concurrency slots and upload bytes held by this worker's requests",
+    ["resource"],
+)
+
+EMAIL_SEND_LATENCY = Histogram(
+    "email_send_duration_seconds",
+    "Time to hand one email to the SMTP server",
+    buckets=LATENCY_BUCKETS,
+)
+EMAILS = Counter("emails_total", "Outbox delivery attempts", ["result"])
+
+FILE_JOB_LATENCY = Histogram(
+    "file_job_duration_seconds",
+    "Time a post-upload processor spent on one file",
+    ["processor"],
+    buckets=LATENCY_BUCKETS,
+)
+FILE_JOBS = Counter(
+    "file_jobs_total", "Post-upload job runs, by outcome", ["processor", "result"]
+)
+
+APP_STARTUP = Gauge(
+    "app_startup_seconds",
+    "Time this worker spent importing the app and running lifespan startup",
+    ["phase"],
+)
+
+CACHE_ENTRIES = Gauge("cache_entries", "Entries in in-process caches", ["cache"])
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total", "Cache lookups, by result", ["cache", "result"]
+)
+CACHE_EVICTIONS = Counter(
+    "cache_evictions_total", "Entries evicted for space", ["cache"]
+)
+CACHE_BYTES = Gauge("cache_bytes", "Bytes held by size-bounded caches", ["cache"])
+
+
+class RequestStats:
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+# Set by MetricsMiddleware for the duration of each request.
+request_stats: ContextVar[RequestStats | None] = ContextVar(
+    "request_stats", default=None
+)
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    DB_QUERY_LATENCY.observe(elapsed)
+    stats = request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.db_seconds += elapsed
+
+
+def instrument_engine(engine):
+    from sqlalchemy import event
+
+    event.listen(engine.sync_engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine.sync_engine, "after_cursor_execute", _after_cursor_execute)
+
+
+def _route(scope) -> str:
+    # The matched route's template keeps label cardinality bounded.
+    route = scope.get("route")
+    return getattr(route, "path_format", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording latency, in-flight and body sizes.
+
+    Latency runs until the last body chunk is sent, so streamed downloads
+    and ZIP archives are measured in full.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        method = scope["method"]
+        stats = RequestStats()
+        token = request_stats.set(stats)
+        status = 500
+        received = sent = 0
+        start = time.perf_counter()
+
+        async def counting_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+            return message
+
+        async def counting_send(message):
+            nonlocal status, sent
+            kind = message["type"]
+            if kind == "http.response.start":
+                status = message["status"]
+            elif kind == "http.response.body":
+                sent += len(message.get("body", b""))
+            elif kind == "http.response.zerocopysend":
+                sent += message.get("count") or 0
+            await send(message)
+
+        in_flight = REQUESTS_IN_FLIGHT.labels(method)
+        in_flight.inc()
+        try:
+            await self.app(scope, counting_receive, counting_send)
+        finally:
+            in_flight.dec()
+            request_stats.reset(token)
+            elapsed = time.perf_counter() - start
+            route = _route(scope)
+            REQUEST_LATENCY.labels(method, route, str(status)).observe(elapsed)
+            DB_QUERIES_PER_REQUEST.labels(route).observe(stats.queries)
+            DB_TIME_PER_REQUEST.labels(route).observe(stats.db_seconds)
+            if received:
+                REQUEST_BYTES.labels(route).inc(received)
+            if sent:
+                RESPONSE_BYTES.labels(route).inc(sent)
+                if sent >= 64 * 1024 and elapsed > 0:
+                    RESPONSE_THROUGHPUT.labels(route).observe(sent / elapsed)
+
+
+# What the caches had counted at the last scrape, per (cache, counter).
+_cache_counted: dict[tuple[str, str], int] = {}
+
+
+def _count_since_scrape(counter, name: str, field: str, total: int):
+    # The caches keep running totals; counters only ever move by the increase.
+    seen = _cache_counted.get((name, field), 0)
+    if total > seen:
+        counter.inc(total - seen)
+    _cache_counted[(name, field)] = total
+
+
+def render_metrics(pool: dict, caches: dict) -> tuple[bytes, str]:
+    """Exposition for /metrics; state owned elsewhere is sampled at scrape time.
+
+    `pool` is database.pool_status() and `caches` maps names to cache stats.
+    """
+    for state in ("size", "checked_out", "overflow", "capacity"):
+        if state in pool:
+            DB_POOL.labels(state).set(pool[state])
+    for name, cache in caches.items():
+        CACHE_ENTRIES.labels(name).set(cache["size"])
+        _count_since_scrape(
+            CACHE_LOOKUPS.labels(name, "hit"), name, "hits", cache["hits"]
+        )
+        _count_since_scrape(
+            CACHE_LOOKUPS.labels(name, "miss"), name, "misses", cache["misses"]
+        )
+        _count_since_scrape(
+            CACHE_EVICTIONS.labels(name), name, "evictions", cache["evictions"]
+        )
+        if "bytes" in cache:
+            CACHE_BYTES.labels(name).set(cache["bytes"])
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -0,0 +1,105 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from app.core.config import (
+    BCRYPT_ROUNDS,
+    PASSWORD_HASH_WORKERS,
+    PASSWORD_HASH_CONCURRENCY,
+    PASSWORD_HASH_QUEUE,
+)
+from app.core.metrics import (
+    PASSWORD_HASH_LATENCY,
+    PASSWORD_HASH_PENDING,
+    PASSWORD_HASH_REJECTED,
+    PASSWORD_HASH_WAIT,
+)
+
+# Pinning min and max to the configured cost makes verify_and_update flag
+# hashes made with any other cost, so they are upgraded on the next login.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify_and_update(password: str, hashed: str) -> tuple[bool, str | None]:
+    return pwd_context.verify_and_update(password, hashed)
+
+
+class PasswordHasher:
+    """Runs bcrypt in a process pool with bounded concurrency and queueing.
+
+    At most `concurrency` hashes run at once and `queue` more may wait;
+    anything beyond that is rejected straight away with a 503.
+    """
+
+    def __init__(self, workers: int, concurrency: int, queue: int):
+        self.workers = workers
+        self.concurrency = concurrency
+        self.queue = queue
+        self.pending = 0
+        self._slots = None
+        self._executor = None
+
+    def _ensure_started(self):
+        if self._executor is None:
+            # spawn avoids forking the event loop and open connections
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+            self._slots = asyncio.Semaphore(self.concurrency)
+
+    async def run(self, func, *args):
+        if self.pending >= self.concurrency + self.queue:
+            PASSWORD_HASH_REJECTED.inc()
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many authentication requests, please retry shortly",
+                headers={"Retry-After": "1"},
+            )
+        self._ensure_started()
+        self.pending += 1
+        PASSWORD_HASH_PENDING.inc()
+        queued = time.perf_counter()
+        try:
+            async with self._slots:
+                PASSWORD_HASH_WAIT.observe(time.perf_counter() - queued)
+                loop = asyncio.get_running_loop()
+                with PASSWORD_HASH_LATENCY.labels(func.__name__.strip("_")).time():
+                    return await loop.run_in_executor(self._executor, func, *args)
+        finally:
+            self.pending -= 1
+            PASSWORD_HASH_PENDING.dec()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+password_hasher = PasswordHasher(
+    PASSWORD_HASH_WORKERS, PASSWORD_HASH_CONCURRENCY, PASSWORD_HASH_QUEUE
+)
+
+
+async def hash_password(password: str) -> str:
+    return await password_hasher.run(_hash, password)
+
+
+async def verify_password(password: str, hashed: str) -> tuple[bool, str | None]:
+    """Returns whether the password matches and, if the stored hash uses an
+    outdated cost, a replacement hash to store."""
+    return await password_hasher.run(_verify_and_update, password, hashed)
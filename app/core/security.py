@@ -1,3 +1,4 @@
+import time
 from datetime import datetime, timedelta
 from jose import jwt, JWTError
 from fastapi.security import OAuth2PasswordBearer
@@ -9,7 +10,9 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 def create_access_token(data: dict):
     expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRES_AT)
     to_encode = data.copy()
-    to_encode.update({"exp": expire})
+    # iat keeps its fraction, so a token issued right after a password
+    # change isn't taken for one issued before it.
+    to_encode.update({"exp": expire, "iat": time.time()})
     token = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return token
 
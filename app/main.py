@@ -1,13 +1,98 @@
-from fastapi import FastAPI, Request
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import os
+import time
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-import uvicorn
-from app.core.database import engine
-from app.models import models
+from app import IMPORT_STARTED
+from app.core.admission import AdmissionMiddleware, admission
+from app.core.cache import invalidation_bus
+from app.core.config import (
+    DOWNLOAD_COUNT_FLUSH_INTERVAL,
+    FILE_JOBS_IN_APP,
+    UPLOAD_SESSION_SWEEP_INTERVAL,
+)
+from app.core.database import engine, pool_status, replica_engines, replica_router
+from app.core.metrics import APP_STARTUP, MetricsMiddleware, render_metrics
+from app.core.passwords import password_hasher
 from app.api.v1.endpoints import auth, files
+from app.services.counters import download_counts
+from app.services.file_jobs import run_file_jobs
+from app.services.outbox import outbox_status, run_outbox_sender, smtp_pool
+from app.services.file_cache import content_cache, file_cache
+from app.services.principals import principal_cache
+from app.services.processors import enabled_processors
+from app.services.upload_sessions import purge_expired_sessions
+
+logger = logging.getLogger(__name__)
+
+
+async def sweep_upload_sessions():
+    while True:
+        try:
+            await purge_expired_sessions()
+        except Exception:
+            logger.exception("upload session sweep failed")
+        await asyncio.sleep(UPLOAD_SESSION_SWEEP_INTERVAL)
+
+
+async def flush_download_counts():
+    while True:
+        await asyncio.sleep(DOWNLOAD_COUNT_FLUSH_INTERVAL)
+        try:
+            await download_counts.flush()
+        except Exception:
+            logger.exception("download count flush failed")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # The schema is created by `python -m app.cli create-schema`, not here:
+    # every worker running DDL at once slows startup and races.
+    started = time.perf_counter()
+    # Opens the first pooled connection, so a bad DATABASE_URL fails the
+    # start instead of the first request.
+    async with engine.connect():
+        pass
+    # Imports processor plugins now rather than on the first upload.
+    enabled_processors()
+    await invalidation_bus.start()
+    tasks = [
+        asyncio.create_task(sweep_upload_sessions()),
+        asyncio.create_task(run_outbox_sender()),
+        asyncio.create_task(flush_download_counts()),
+    ]
+    if FILE_JOBS_IN_APP:
+        tasks.append(asyncio.create_task(run_file_jobs()))
+    startup_times["lifespan_seconds"] = time.perf_counter() - started
+    APP_STARTUP.labels("lifespan").set(startup_times["lifespan_seconds"])
+    yield
+    # The server has finished in-flight requests by now. Stop the background
+    # loops and wait for them: an interrupted flush puts its increments back
+    # and claimed emails and file jobs fall back to their leases.
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    try:
+        await download_counts.flush()
+    except Exception:
+        logger.exception("download count flush failed")
+    await smtp_pool.close()
+    await invalidation_bus.stop()
+    await admission.stop()
+    password_hasher.shutdown()
+    await engine.dispose()
+    for replica in replica_engines:
+        await replica.dispose()
+
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Middleware
+# Innermost, so refusals still carry CORS headers; nothing outside it
+# reads the request body.
+app.add_middleware(AdmissionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -16,16 +101,56 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-@app.middleware("http")
-async def log_requests(request: Request, call_next):
-    print("incoming request:", request.url)
-    response = await call_next(request)
-    return response
+class RequestLogMiddleware:
+    # Pure ASGI rather than @app.middleware("http"): BaseHTTPMiddleware only
+    # passes http.response.body messages on, which breaks zero-copy sends.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            print("incoming request:", Request(scope).url)
+        await self.app(scope, receive, send)
+
+app.add_middleware(RequestLogMiddleware)
+
+# Added last so it is outermost and times the whole stack.
+app.add_middleware(MetricsMiddleware)
+
+def cache_stats():
+    return {
+        "principals": principal_cache.stats(),
+        "files": file_cache.stats(),
+        "file_content": content_cache.stats(),
+    }
+
+@app.get("/health/db")
+async def database_health():
+    status = pool_status(engine)
+    if replica_engines:
+        status["replicas"] = replica_router.status()
+    return status
+
+@app.get("/health/startup")
+async def startup_health():
+    return {"pid": os.getpid(), **startup_times}
+
+@app.get("/health/outbox")
+async def outbox_health():
+    return await outbox_status()
+
+@app.get("/health/cache")
+async def cache_health():
+    return cache_stats()
 
-models.Base.metadata.create_all(bind=engine)
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    body, content_type = render_metrics(pool_status(engine), cache_stats())
+    return Response(body, media_type=content_type)
 
 app.include_router(auth.router)
 app.include_router(files.router)
 
-if __name__ == "__main__":
-    uvicorn.run("app.main:app", host="0.0.0.0", port=8000, reload=True)
+# Per worker; the benchmark suite reads these from /health/startup.
+startup_times = {"import_seconds": time.perf_counter() - IMPORT_STARTED}
+APP_STARTUP.labels("import").set(startup_times["import_seconds"])
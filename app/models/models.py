@@ -1,6 +1,7 @@
-from sqlalchemy import Boolean, String, Integer, Column, ForeignKey, DateTime
+from sqlalchemy import Boolean, String, Integer, BigInteger, Column, ForeignKey, DateTime, Index, JSON
 from sqlalchemy.orm import relationship
 from sqlalchemy import func
+from sqlalchemy.dialects import sqlite
 from app.core.database import Base
 
 class Users(Base):
@@ -18,6 +19,8 @@ class Users(Base):
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
     password_reset_token = Column(String, nullable=True)
     password_reset_expires = Column(DateTime, nullable=True)
+    # Access tokens issued before this are rejected
+    password_changed_at = Column(DateTime(timezone=True), nullable=True)
 
     files = relationship("FileManage", back_populates="owner")
 
@@ -30,9 +33,115 @@ class FileManage(Base):
     filename = Column(String, nullable=False)
     stored_filename = Column(String, nullable=False)
     file_type = Column(String, nullable=False)
-    file_size = Column(Integer, nullable=False)
+    file_size = Column(BigInteger, nullable=False)
     path = Column(String, nullable=False)
-    uploaded_at = Column(DateTime(timezone=True), server_default=func.now())
+    sha256 = Column(String(64), ForeignKey("blobs.sha256"), nullable=True, index=True)
+    # Copied from the blob: how the stored bytes are encoded (NULL = as-is).
+    # file_size is always the decoded size.
+    content_encoding = Column(String(16), nullable=True)
+    # SQLite's CURRENT_TIMESTAMP has no microseconds; bind values the same
+    # way so keyset comparisons on uploaded_at line up.
+    uploaded_at = Column(
+        DateTime(timezone=True).with_variant(
+            sqlite.DATETIME(truncate_microseconds=True), "sqlite"
+        ),
+        server_default=func.now(),
+    )
     download_count = Column(Integer, default=0)
+    # pending while post-upload jobs run, then done or failed; NULL if none
+    processing_status = Column(String(16), nullable=True)
 
     owner = relationship("Users", back_populates="files")
+
+    # Keyset pagination walks (user_id, sort column, id); the filename index
+    # also serves the per-user lookups done by download and delete. Filename
+    # search uses the trigram index on Postgres and the files_fts table on
+    # SQLite, both added by create_schema.
+    __table_args__ = (
+        Index("ix_files_user_uploaded_at", "user_id", "uploaded_at", "id"),
+        Index("ix_files_user_filename", "user_id", "filename", "id"),
+        Index("ix_files_user_file_size", "user_id", "file_size", "id"),
+    )
+
+
+class Blob(Base):
+    __tablename__ = "blobs"
+
+    sha256 = Column(String(64), primary_key=True)
+    size = Column(BigInteger, nullable=False)
+    path = Column(String, nullable=False)
+    content_encoding = Column(String(16), nullable=True)
+    # Bytes actually stored when content_encoding is set
+    stored_size = Column(BigInteger, nullable=True)
+    ref_count = Column(Integer, nullable=False, default=0)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class UserUsage(Base):
+    # Kept in step with files in the same transactions; see services/usage.py
+    __tablename__ = "user_usage"
+
+    user_id = Column(Integer, ForeignKey("user.id"), primary_key=True)
+    bytes_used = Column(BigInteger, nullable=False, default=0)
+    file_count = Column(Integer, nullable=False, default=0)
+    # NULL falls back to STORAGE_QUOTA_BYTES
+    quota_bytes = Column(BigInteger, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+
+    id = Column(String(36), primary_key=True)
+    user_id = Column(Integer, ForeignKey("user.id"), nullable=False, index=True)
+    filename = Column(String, nullable=False)
+    file_type = Column(String, nullable=False)
+    file_size = Column(BigInteger, nullable=False)
+    chunk_size = Column(Integer, nullable=False)
+    chunk_count = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, default="open")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+
+class FileJob(Base):
+    # One post-upload processor run for one file; see services/file_jobs.py
+    __tablename__ = "file_jobs"
+
+    id = Column(Integer, primary_key=True)
+    file_id = Column(Integer, ForeignKey("files.id", ondelete="CASCADE"), nullable=False, index=True)
+    processor = Column(String(64), nullable=False)
+    # pending -> done, or failed once FILE_JOB_MAX_ATTEMPTS is used up
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False)
+    last_error = Column(String, nullable=True)
+    result = Column(JSON, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    finished_at = Column(DateTime(timezone=True), nullable=True)
+
+    file = relationship("FileManage")
+
+    __table_args__ = (
+        Index("ix_file_jobs_due", "processor", "status", "next_attempt_at"),
+    )
+
+
+class EmailOutbox(Base):
+    __tablename__ = "email_outbox"
+
+    id = Column(Integer, primary_key=True)
+    recipient = Column(String, nullable=False)
+    template = Column(String, nullable=False)
+    context = Column(JSON, nullable=False)
+    # pending -> sent, or failed once MAIL_MAX_ATTEMPTS is used up
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False)
+    last_error = Column(String, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    sent_at = Column(DateTime(timezone=True), nullable=True)
+
+    __table_args__ = (
+        Index("ix_email_outbox_due", "status", "next_attempt_at"),
+    )
@@ -0,0 +1,135 @@
+from sqlalchemy import BigInteger, inspect, text
+from sqlalchemy.schema import AddConstraint, CreateColumn, CreateIndex
+
+from app.core.database import engine
+from app.models.models import Base
+
+# Filename search on SQLite: an external-content FTS5 table over files,
+# kept in step by triggers. The trigram tokenizer matches any substring of
+# three or more characters.
+SQLITE_SEARCH = (
+    "CREATE VIRTUAL TABLE files_fts USING fts5("
+    "filename, content='files', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS files_fts_insert AFTER INSERT ON files BEGIN"
+    " INSERT INTO files_fts(rowid, filename) VALUES (new.id, new.filename); END",
+    "CREATE TRIGGER IF NOT EXISTS files_fts_delete AFTER DELETE ON files BEGIN"
+    " INSERT INTO files_fts(files_fts, rowid, filename)"
+    " VALUES ('delete', old.id, old.filename); END",
+    "CREATE TRIGGER IF NOT EXISTS files_fts_update AFTER UPDATE OF filename ON files"
+    " BEGIN"
+    " INSERT INTO files_fts(files_fts, rowid, filename)"
+    " VALUES ('delete', old.id, old.filename);"
+    " INSERT INTO files_fts(rowid, filename) VALUES (new.id, new.filename); END",
+)
+
+
+# Filename search on Postgres: a trigram index serving ILIKE '%term%'. Not
+# in the models, so it is also added to files tables that already exist.
+POSTGRES_SEARCH = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_files_filename_trgm"
+    " ON files USING gin (filename gin_trgm_ops)",
+)
+
+
+async def _create_sqlite_search(conn):
+    exists = await conn.scalar(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'files_fts'")
+    )
+    if exists:
+        return
+    for statement in SQLITE_SEARCH:
+        await conn.execute(text(statement))
+    # Index the files that were there before the table.
+    await conn.execute(text("INSERT INTO files_fts(files_fts) VALUES ('rebuild')"))
+
+
+def _upgrade_tables(conn, tables: set) -> list[str]:
+    """Adds the columns and indexes existing `tables` lack next to the models.
+
+    create_all never alters a table that exists, so databases made by an
+    earlier release are brought up to date here. Only nullable columns or
+    ones with a server default can be added to a table that has rows;
+    anything else needs a hand-written migration and stops the upgrade.
+    """
+    inspector = inspect(conn)
+    preparer = conn.dialect.identifier_preparer
+    changes = []
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        present = {
+            column["name"]: column for column in inspector.get_columns(table.name)
+        }
+        for column in table.columns:
+            found = present.get(column.name)
+            if found is None:
+                if not column.nullable and column.server_default is None:
+                    raise RuntimeError(
+                        f"{table.name}.{column.name} is missing and can't be "
+                        "added automatically; migrate it by hand"
+                    )
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN "
+                        f"{CreateColumn(column).compile(dialect=conn.dialect)}"
+                    )
+                )
+                # SQLite can't add constraints later, nor does it enforce them.
+                if conn.dialect.name != "sqlite":
+                    for foreign_key in column.foreign_keys:
+                        conn.execute(AddConstraint(foreign_key.constraint))
+                changes.append(f"added column {table.name}.{column.name}")
+            elif (
+                conn.dialect.name == "postgresql"
+                and isinstance(column.type, BigInteger)
+                and not isinstance(found["type"], BigInteger)
+            ):
+                # SQLite integers are 64-bit already.
+                conn.execute(
+                    text(
+                        f"ALTER TABLE {preparer.format_table(table)} ALTER COLUMN "
+                        f"{preparer.format_column(column)} TYPE BIGINT"
+                    )
+                )
+                changes.append(f"widened column {table.name}.{column.name}")
+
+        # After the columns, which new indexes may cover.
+        indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name not in indexes:
+                conn.execute(CreateIndex(index, if_not_exists=True))
+                changes.append(f"added index {index.name}")
+    return changes
+
+
+async def create_schema(drop: bool = False, bind=None) -> list[str]:
+    """Creates missing tables, and missing columns and indexes of existing ones.
+
+    Run once per deploy (`python -m app.cli create-schema`), not from every
+    worker at startup. `drop` empties the database first. Returns the
+    tables, columns and indexes that were added or changed, and raises
+    RuntimeError if an existing table can't be upgraded automatically.
+    """
+    bind = bind or engine
+    dialect = bind.dialect.name
+    async with bind.begin() as conn:
+        if drop:
+            if dialect == "sqlite":
+                # Not in the metadata, and its rowids would outlive the files.
+                await conn.execute(text("DROP TABLE IF EXISTS files_fts"))
+            await conn.run_sync(Base.metadata.drop_all)
+        tables = set(await conn.run_sync(lambda sync: inspect(sync).get_table_names()))
+        await conn.run_sync(Base.metadata.create_all)
+        changes = [
+            f"created table {table.name}"
+            for table in Base.metadata.sorted_tables
+            if table.name not in tables
+        ]
+        changes += await conn.run_sync(_upgrade_tables, tables)
+        if dialect == "sqlite":
+            await _create_sqlite_search(conn)
+        elif dialect == "postgresql":
+            for statement in POSTGRES_SEARCH:
+                await conn.execute(text(statement))
+    return changes
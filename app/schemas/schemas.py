@@ -1,6 +1,8 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from datetime import datetime
 
+from app.core.config import BATCH_MAX_FILES
+
 # Registration schema
 class RegisterUser(BaseModel):
     first_name: str
@@ -40,7 +42,59 @@ class NewPassword(BaseModel):
 class TokenData(BaseModel):
     username: str | None = None
 
+class BlobClaim(BaseModel):
+    filename: str
+    file_type: str = "application/octet-stream"
+    file_size: int
+    sha256: str = Field(pattern="^[0-9a-f]{64}$")
+
 class FileDetail(BaseModel):
     filename: str
     file_type: str
+    file_size: int | None = None
     uploaded_at: datetime | None = None
+    processing_status: str | None = None
+
+class FileJobDetail(BaseModel):
+    processor: str
+    status: str
+    attempts: int
+    last_error: str | None = None
+    result: dict | None = None
+    finished_at: datetime | None = None
+
+class UsageDetail(BaseModel):
+    bytes_used: int
+    file_count: int
+    quota_bytes: int | None = None
+    bytes_available: int | None = None
+
+class UploadSessionCreate(BaseModel):
+    filename: str
+    file_type: str = "application/octet-stream"
+    file_size: int = Field(gt=0)
+    chunk_size: int | None = Field(default=None, gt=0)
+
+class UploadSessionDetail(BaseModel):
+    session_id: str
+    filename: str
+    file_size: int
+    chunk_size: int
+    chunk_count: int
+    received: list[int]
+    expires_at: datetime
+
+class FileBatch(BaseModel):
+    filenames: list[str] = Field(min_length=1, max_length=BATCH_MAX_FILES)
+
+class BatchItemResult(BaseModel):
+    filename: str
+    status: int
+    detail: str | None = None
+    file_size: int | None = None
+    sha256: str | None = None
+
+class BatchResult(BaseModel):
+    succeeded: int
+    failed: int
+    results: list[BatchItemResult]
@@ -0,0 +1,109 @@
+"""Production entry point: uvicorn on uvloop and httptools, with workers.
+
+    python -m app.cli create-schema
+    python -m app.server --workers 4
+
+Defaults come from the SERVER_* settings. Workers are separate processes,
+so each has its own connection pool, caches and background loops.
+"""
+
+import argparse
+import asyncio
+import os
+
+import uvicorn
+
+from app.core.config import (
+    SERVER_ACCESS_LOG,
+    SERVER_BACKLOG,
+    SERVER_FORWARDED_ALLOW_IPS,
+    SERVER_GRACEFUL_TIMEOUT,
+    SERVER_HOST,
+    SERVER_HTTP,
+    SERVER_KEEPALIVE,
+    SERVER_LOOP,
+    SERVER_PORT,
+    SERVER_WORKERS,
+)
+
+
+async def _create_schema():
+    from app.core.database import engine
+    from app.models.schema import create_schema
+
+    try:
+        for change in await create_schema():
+            print(change)
+    finally:
+        # Workers are spawned afresh and open their own connections.
+        await engine.dispose()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.server")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=SERVER_WORKERS,
+        help="worker processes, 0 for one per CPU",
+    )
+    parser.add_argument(
+        "--backlog",
+        type=int,
+        default=SERVER_BACKLOG,
+        help="connections the listening socket queues before refusing",
+    )
+    parser.add_argument(
+        "--keep-alive",
+        type=int,
+        default=SERVER_KEEPALIVE,
+        help="seconds an idle keep-alive connection stays open",
+    )
+    parser.add_argument(
+        "--graceful-timeout",
+        type=int,
+        default=SERVER_GRACEFUL_TIMEOUT,
+        help="seconds shutdown waits for in-flight requests",
+    )
+    parser.add_argument(
+        "--forwarded-allow-ips",
+        default=SERVER_FORWARDED_ALLOW_IPS,
+        help="proxies trusted to set X-Forwarded-For, comma separated",
+    )
+    parser.add_argument(
+        "--create-schema",
+        action="store_true",
+        help="create or upgrade the schema once before the workers start",
+    )
+    parser.add_argument(
+        "--reload",
+        action="store_true",
+        help="restart on code changes; development only, single worker",
+    )
+    args = parser.parse_args(argv)
+
+    if args.create_schema:
+        asyncio.run(_create_schema())
+    workers = args.workers or os.cpu_count() or 1
+    uvicorn.run(
+        "app.main:app",
+        host=args.host,
+        port=args.port,
+        workers=None if args.reload else workers,
+        reload=args.reload,
+        backlog=args.backlog,
+        timeout_keep_alive=args.keep_alive,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        loop=SERVER_LOOP,
+        http=SERVER_HTTP,
+        access_log=SERVER_ACCESS_LOG,
+        proxy_headers=True,
+        forwarded_allow_ips=args.forwarded_allow_ips,
+        lifespan="on",
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import io
+import posixpath
+import zipfile
+from datetime import datetime
+
+from starlette.concurrency import iterate_in_threadpool
+
+from app.core.config import ARCHIVE_COMPRESSION, UPLOAD_CHUNK_SIZE
+
+COMPRESSION = {"stored": zipfile.ZIP_STORED, "deflated": zipfile.ZIP_DEFLATED}
+
+
+class _Pipe(io.RawIOBase):
+    """Unseekable sink that zipfile writes into and the generator drains.
+
+    Being unseekable makes zipfile emit data descriptors after each entry, so
+    nothing has to be rewritten and the archive can be sent as it is built.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self.buffered = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self.buffered += len(data)
+        return len(data)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        self.buffered = 0
+        return data
+
+
+def archive_name(filename: str, taken: set) -> str:
+    # Never let an entry escape the extraction directory.
+    name = posixpath.normpath("/" + filename.replace("\\", "/")).lstrip("/")
+    name = name or "file"
+    stem, ext = posixpath.splitext(name)
+    candidate, n = name, 1
+    while candidate in taken:
+        candidate = f"{stem} ({n}){ext}"
+        n += 1
+    taken.add(candidate)
+    return candidate
+
+
+def _zip_entries(entries):
+    pipe = _Pipe()
+    failed = []
+    with zipfile.ZipFile(
+        pipe, mode="w", compression=COMPRESSION[ARCHIVE_COMPRESSION], allowZip64=True
+    ) as archive:
+        for name, open_source, modified in entries:
+            try:
+                source = open_source()
+            except Exception:
+                failed.append(name)
+                continue
+            info = zipfile.ZipInfo(name, _zip_time(modified))
+            info.compress_type = archive.compression
+            with source, archive.open(info, mode="w", force_zip64=True) as dest:
+                while block := source.read(UPLOAD_CHUNK_SIZE):
+                    dest.write(block)
+                    if pipe.buffered >= UPLOAD_CHUNK_SIZE:
+                        yield pipe.drain()
+            if pipe.buffered:
+                yield pipe.drain()
+        if failed:
+            archive.writestr(
+                "_unavailable.txt",
+                "These files could not be read and were left out:\n"
+                + "\n".join(failed)
+                + "\n",
+            )
+    yield pipe.drain()
+
+
+def _zip_time(modified: datetime | None):
+    if modified is None or modified.year < 1980:
+        return (1980, 1, 1, 0, 0, 0)
+    return modified.timetuple()[:6]
+
+
+def stream_zip(entries):
+    """Streams a ZIP of `entries` without holding more than a chunk in memory.
+
+    `entries` are (name, open_source, modified) tuples where `open_source()`
+    returns a readable binary file; it is called from a worker thread. Files
+    that can't be opened are skipped and listed in `_unavailable.txt`.
+    """
+    return iterate_in_threadpool(_zip_entries(entries))
@@ -0,0 +1,303 @@
+import os
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import update, delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import BLOB_UNLINK_GRACE, STORAGE_ROOT, UPLOAD_DIR
+from app.core.database import SessionLocal
+from app.models.models import Blob, FileManage
+from app.services.file_jobs import queue_file_jobs
+from app.services.storage import storage
+from app.services.usage import charge_usage, check_rows_quota
+
+# Uploads are staged here before being handed to the storage backend.
+TEMP_DIR = os.path.join(UPLOAD_DIR, "tmp")
+
+
+def _remove(path: str):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+@dataclass
+class StagedBlob:
+    """Content waiting in TEMP_DIR to be stored; FileSink has the same shape.
+
+    size and sha256 describe the original bytes, stored_size the encoded ones.
+    """
+
+    path: str
+    sha256: str
+    size: int
+    encoding: str | None = None
+    stored_size: int | None = None
+
+
+def _new_blob(staged, key: str, ref_count: int) -> Blob:
+    return Blob(
+        sha256=staged.sha256,
+        size=staged.size,
+        path=key,
+        content_encoding=staged.encoding,
+        stored_size=staged.stored_size,
+        ref_count=ref_count,
+    )
+
+
+async def add_files(db: AsyncSession, rows: list):
+    """Adds new file rows with their usage charge and post-upload jobs."""
+    db.add_all(rows)
+    await charge_usage(db, rows)
+    queue_file_jobs(db, rows)
+
+
+def _set_blob(rows, key: str, encoding: str | None):
+    for row in rows:
+        row.path = key
+        row.content_encoding = encoding
+
+
+async def acquire_blob(db: AsyncSession, sha256: str, count: int = 1):
+    """Adds references to an existing blob.
+
+    Returns a row with the blob's path and content_encoding, or None if
+    there is no such blob.
+    """
+    result = await db.execute(
+        update(Blob)
+        .where(Blob.sha256 == sha256)
+        .values(ref_count=Blob.ref_count + count)
+        .returning(Blob.path, Blob.content_encoding)
+    )
+    return result.first()
+
+
+async def store_blob(db: AsyncSession, staged, rows: list):
+    """Commits `rows` together with a reference to the blob for `staged`.
+
+    The staged temp file becomes the blob if this content is new and is
+    dropped otherwise. New content is put into storage before its row is
+    committed, so a committed blob row always has its contents behind it.
+    The rows count towards their owners' usage and quota.
+    """
+    try:
+        await check_rows_quota(db, rows)
+        existing = await acquire_blob(db, staged.sha256)
+        if existing:
+            _set_blob(rows, existing.path, existing.content_encoding)
+            await add_files(db, rows)
+            await db.commit()
+            await run_in_threadpool(_remove, staged.path)
+            return
+        # Don't hold the write transaction open during the transfer.
+        await db.rollback()
+
+        key = storage.key_for(staged.sha256, staged.encoding)
+        await storage.put(staged.path, key)
+        await _commit_blob(db, staged, key, rows)
+    except Exception:
+        await db.rollback()
+        await run_in_threadpool(_remove, staged.path)
+        raise
+
+
+async def _commit_blob(db: AsyncSession, staged, key: str, rows: list):
+    db.add(_new_blob(staged, key, 1))
+    _set_blob(rows, key, staged.encoding)
+    await add_files(db, rows)
+    try:
+        await db.commit()
+        return
+    except IntegrityError as exc:
+        await db.rollback()
+        # Someone stored the same content concurrently; reference theirs.
+        existing = await acquire_blob(db, staged.sha256)
+        if not existing:
+            raise exc
+    _set_blob(rows, existing.path, existing.content_encoding)
+    await add_files(db, rows)
+    await db.commit()
+    if existing.path != key:
+        # Theirs was stored with another encoding; ours is referenced by nothing.
+        await unlink_blob(db, staged.sha256, key, grace=0)
+
+
+async def store_blobs(db: AsyncSession, items: list) -> list:
+    """Batch form of store_blob committing every row in one transaction.
+
+    `items` are (staged, row) pairs; content shared by several items is
+    stored once. Returns one exception or None per item: an item fails on
+    its own if its content can't be stored, while a database error fails
+    the whole batch.
+    """
+    errors = [None] * len(items)
+    by_sha = {}
+    for index, (staged, _) in enumerate(items):
+        by_sha.setdefault(staged.sha256, []).append(index)
+
+    try:
+        await check_rows_quota(db, [row for _, row in items])
+        existing = set(
+            await db.scalars(select(Blob.sha256).where(Blob.sha256.in_(by_sha)))
+        )
+        await db.rollback()
+
+        stored = {}
+
+        async def put(sha256):
+            staged = items[by_sha[sha256][0]][0]
+            key = storage.key_for(sha256, staged.encoding)
+            try:
+                await storage.put(staged.path, key)
+            except Exception as exc:
+                for index in by_sha[sha256]:
+                    errors[index] = exc
+                return
+            stored[sha256] = key
+
+        # Transfer new content before the transaction, as store_blob does.
+        for sha256 in by_sha:
+            if sha256 not in existing:
+                await put(sha256)
+
+        for _ in range(3):
+            try:
+                rows = []
+                unreferenced = []
+                for sha256, indexes in by_sha.items():
+                    if errors[indexes[0]] is not None:
+                        continue
+                    staged = items[indexes[0]][0]
+                    shared = [items[index][1] for index in indexes]
+                    blob = await acquire_blob(db, sha256, len(indexes))
+                    if blob:
+                        _set_blob(shared, blob.path, blob.content_encoding)
+                        if stored.get(sha256, blob.path) != blob.path:
+                            # Stored concurrently under another encoding.
+                            unreferenced.append((sha256, stored[sha256]))
+                    else:
+                        if sha256 not in stored:
+                            # Deleted since we looked; store our copy after all.
+                            await put(sha256)
+                            if sha256 not in stored:
+                                continue
+                        db.add(_new_blob(staged, stored[sha256], len(indexes)))
+                        _set_blob(shared, stored[sha256], staged.encoding)
+                    rows.extend(shared)
+                await add_files(db, rows)
+                await db.commit()
+                for sha256, key in unreferenced:
+                    await unlink_blob(db, sha256, key, grace=0)
+                break
+            except IntegrityError:
+                # Someone stored some of this content concurrently; the next
+                # attempt references their blob instead.
+                await db.rollback()
+        else:
+            raise RuntimeError("Could not store the batch, please retry")
+    except Exception:
+        await db.rollback()
+        raise
+    finally:
+        for staged, _ in items:
+            await run_in_threadpool(_remove, staged.path)
+    return errors
+
+
+async def release_blob(db: AsyncSession, sha256: str, count: int = 1) -> str | None:
+    """Drops references, returning the blob's key if its row was removed.
+
+    The contents themselves must only be deleted by the caller after commit,
+    see unlink_blob.
+    """
+    await db.execute(
+        update(Blob)
+        .where(Blob.sha256 == sha256)
+        .values(ref_count=Blob.ref_count - count)
+    )
+    result = await db.execute(
+        delete(Blob)
+        .where(Blob.sha256 == sha256, Blob.ref_count <= 0)
+        .returning(Blob.path)
+    )
+    return result.scalar()
+
+
+async def unlink_blob(
+    db: AsyncSession, sha256: str, key: str, grace: float = BLOB_UNLINK_GRACE
+) -> bool:
+    """Deletes contents no blob row points at any more, after commit.
+
+    An upload that found no blob row stores the contents again before
+    committing its own row, so contents written in the last `grace` seconds
+    are left for the reconciler. Returns whether they were deleted.
+    """
+    # A concurrent upload may have re-created the blob after our commit.
+    if await db.scalar(
+        select(Blob.sha256).where(Blob.sha256 == sha256, Blob.path == key)
+    ):
+        return False
+    return await storage.delete_older(key, time.time() - grace)
+
+
+def _local_source(path: str, root: str) -> str | None:
+    # Older rows stored a filesystem path; newer ones a key under a root.
+    for candidate in (path, os.path.join(root, *path.split("/"))):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+async def relocate_blobs(
+    source_root: str | None = None, batch_size: int = 500
+) -> tuple[int, int]:
+    """Moves blobs into the configured backend under its current keys.
+
+    Sources must be local files: blobs stored under an outdated key (such as
+    the old flat layout) are always moved, and with `source_root` every blob
+    found below that directory is, e.g. to upload a local store to S3. Safe
+    to re-run after an interruption. Returns the number of blobs moved and
+    the number whose contents could not be found.
+    """
+    moved = missing = 0
+    last = ""
+    while True:
+        async with SessionLocal() as db:
+            blobs = (
+                await db.execute(
+                    select(Blob.sha256, Blob.path, Blob.content_encoding)
+                    .where(Blob.sha256 > last)
+                    .order_by(Blob.sha256)
+                    .limit(batch_size)
+                )
+            ).all()
+            if not blobs:
+                return moved, missing
+            last = blobs[-1].sha256
+
+            for sha256, path, encoding in blobs:
+                key = storage.key_for(sha256, encoding)
+                if path == key and source_root is None:
+                    continue
+                source = await run_in_threadpool(
+                    _local_source, path, source_root or STORAGE_ROOT
+                )
+                if source is not None:
+                    await storage.put(source, key)
+                elif not await storage.exists(key):
+                    missing += 1
+                    continue
+                await db.execute(
+                    update(Blob).where(Blob.sha256 == sha256).values(path=key)
+                )
+                await db.execute(
+                    update(FileManage)
+                    .where(FileManage.sha256 == sha256)
+                    .values(path=key)
+                )
+                moved += 1
+            await db.commit()
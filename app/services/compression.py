@@ -0,0 +1,136 @@
+import gzip
+import zlib
+
+from fastapi import Request
+
+from app.core.config import COMPRESS_TYPES, COMPRESSION_ENCODING, COMPRESSION_LEVEL
+
+# Never worth recompressing, whatever COMPRESS_TYPES says.
+PRECOMPRESSED_TYPES = (
+    "image/",
+    "video/",
+    "audio/",
+    "font/woff",
+    "application/zip",
+    "application/gzip",
+    "application/x-gzip",
+    "application/zstd",
+    "application/x-bzip2",
+    "application/x-xz",
+    "application/x-7z-compressed",
+    "application/x-rar-compressed",
+    "application/vnd.rar",
+    "application/pdf",
+    "application/vnd.openxmlformats-officedocument.",
+)
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError("zstd content encoding needs the 'zstandard' package")
+    return zstandard
+
+
+if COMPRESSION_ENCODING == "zstd":
+    _zstd()
+elif COMPRESSION_ENCODING not in ("", "gzip"):
+    raise RuntimeError(f"Unknown COMPRESSION_ENCODING {COMPRESSION_ENCODING!r}")
+
+
+def _matches(content_type: str, patterns) -> bool:
+    return any(
+        (
+            content_type.startswith(pattern[:-1])
+            if pattern.endswith(("*", "/", "."))
+            else content_type == pattern
+        )
+        for pattern in patterns
+    )
+
+
+def choose_encoding(content_type: str | None) -> str | None:
+    """Returns the encoding to store an upload of this type with, if any."""
+    if not COMPRESSION_ENCODING or not content_type:
+        return None
+    content_type = content_type.split(";")[0].strip().lower()
+    if content_type != "image/svg+xml" and _matches(content_type, PRECOMPRESSED_TYPES):
+        return None
+    if not _matches(content_type, COMPRESS_TYPES):
+        return None
+    return COMPRESSION_ENCODING
+
+
+class Compressor:
+    """Incremental compressor producing a complete gzip or zstd stream."""
+
+    def __init__(self, encoding: str):
+        if encoding == "gzip":
+            level = COMPRESSION_LEVEL if COMPRESSION_LEVEL is not None else 6
+            # wbits 31 writes the gzip header and trailer
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        else:
+            level = COMPRESSION_LEVEL if COMPRESSION_LEVEL is not None else 3
+            self._compressor = _zstd().ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+class DecodedReader:
+    """Readable file object yielding the decoded bytes of a compressed one."""
+
+    def __init__(self, raw, encoding: str):
+        self._raw = raw
+        if encoding == "gzip":
+            self._reader = gzip.GzipFile(fileobj=raw, mode="rb")
+        elif encoding == "zstd":
+            self._reader = _zstd().ZstdDecompressor().stream_reader(raw)
+        else:
+            raise ValueError(f"Unsupported content encoding {encoding!r}")
+
+    def read(self, size: int = -1) -> bytes:
+        return self._reader.read(size)
+
+    def close(self):
+        try:
+            self._reader.close()
+        finally:
+            self._raw.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def open_decoded(raw, encoding: str | None):
+    return DecodedReader(raw, encoding) if encoding else raw
+
+
+def accepts_encoding(request: Request, encoding: str) -> bool:
+    header = request.headers.get("accept-encoding")
+    if not header:
+        return False
+    wildcard = None
+    for part in header.split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if coding == encoding or (encoding == "gzip" and coding == "x-gzip"):
+            return q > 0
+        if coding == "*":
+            wildcard = q > 0
+    return bool(wildcard)
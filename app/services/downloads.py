@@ -0,0 +1,333 @@
+from datetime import datetime, timezone
+from email.utils import formatdate, parsedate_to_datetime
+from secrets import token_hex
+from urllib.parse import quote
+
+from fastapi import Request
+from fastapi.responses import (
+    FileResponse,
+    RedirectResponse,
+    Response,
+    StreamingResponse,
+)
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+
+from app.core.config import DOWNLOAD_OFFLOAD, UPLOAD_CHUNK_SIZE
+
+if DOWNLOAD_OFFLOAD not in ("", "x-accel-redirect", "x-sendfile"):
+    raise RuntimeError(f"Unknown DOWNLOAD_OFFLOAD {DOWNLOAD_OFFLOAD!r}")
+
+
+def make_etag(sha256: str, encoding: str | None = None) -> str:
+    # Each stored encoding is its own representation with its own ETag.
+    return f'"{sha256}-{encoding}"' if encoding else f'"{sha256}"'
+
+
+def content_disposition(filename: str) -> str:
+    quoted = quote(filename)
+    if quoted != filename:
+        return f"attachment; filename*=utf-8''{quoted}"
+    return f'attachment; filename="{filename}"'
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    # If-None-Match uses the weak comparison, so W/ prefixes are ignored.
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or any(tag.removeprefix("W/") == etag for tag in tags)
+
+
+def is_not_modified(
+    request: Request, etag: str | None, last_modified: datetime | None
+) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return etag is not None and _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+def wants_full_body(request: Request) -> bool:
+    http_range = request.headers.get("range", "").replace(" ", "")
+    return not http_range or http_range.startswith("bytes=0-")
+
+
+class ContentFileResponse(FileResponse):
+    """FileResponse that hands the file to the server for zero-copy sending.
+
+    When the ASGI server advertises the `http.response.zerocopysend`
+    extension, full and single-range bodies are sent with the kernel's
+    sendfile instead of being read into Python. Servers that only offer
+    `http.response.pathsend` are handled by Starlette itself. uvicorn, which
+    `app.server` runs, offers neither, so there files are read in chunks;
+    DOWNLOAD_OFFLOAD lets the proxy send signed links instead.
+    """
+
+    async def __call__(self, scope, receive, send):
+        self.zerocopy = "http.response.zerocopysend" in scope.get("extensions", {})
+        await super().__call__(scope, receive, send)
+
+    async def _handle_simple(self, send, send_header_only, send_pathsend):
+        if not self.zerocopy or send_header_only:
+            return await super()._handle_simple(send, send_header_only, send_pathsend)
+        await send(
+            {
+                "type": "http.response.start",
+                "status": self.status_code,
+                "headers": self.raw_headers,
+            }
+        )
+        await self._zerocopy_send(send, 0, None)
+
+    async def _handle_single_range(self, send, start, end, file_size, send_header_only):
+        if not self.zerocopy or send_header_only:
+            return await super()._handle_single_range(
+                send, start, end, file_size, send_header_only
+            )
+        self.headers["content-range"] = f"bytes {start}-{end - 1}/{file_size}"
+        self.headers["content-length"] = str(end - start)
+        await send(
+            {"type": "http.response.start", "status": 206, "headers": self.raw_headers}
+        )
+        await self._zerocopy_send(send, start, end - start)
+
+    async def _handle_multiple_ranges(self, send, ranges, file_size, send_header_only):
+        # Starlette labels multipart bodies with Content-Range; clients expect
+        # a multipart/byteranges Content-Type, so build the body here.
+        boundary = token_hex(13)
+        content_type = self.headers["content-type"]
+        _, header_generator = self.generate_multipart(
+            ranges, boundary, file_size, content_type
+        )
+        # The length is counted from the bytes actually sent: the one from
+        # generate_multipart is a byte short. Each part is followed by "\n",
+        # which with the next boundary makes the delimiter, so the closing
+        # one needs no newline of its own or the last part gains a byte.
+        part_headers = [header_generator(start, end) for start, end in ranges]
+        closing = f"--{boundary}--\n".encode("latin-1")
+        content_length = len(closing) + sum(
+            len(headers) + (end - start) + 1
+            for headers, (start, end) in zip(part_headers, ranges)
+        )
+        self.headers["content-type"] = f"multipart/byteranges; boundary={boundary}"
+        self.headers["content-length"] = str(content_length)
+        await send(
+            {"type": "http.response.start", "status": 206, "headers": self.raw_headers}
+        )
+        if send_header_only:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+            return
+        file = await run_in_threadpool(open, self.path, "rb")
+        try:
+            for headers, (start, end) in zip(part_headers, ranges):
+                await send(
+                    {"type": "http.response.body", "body": headers, "more_body": True}
+                )
+                if self.zerocopy:
+                    await send(
+                        {
+                            "type": "http.response.zerocopysend",
+                            "file": file,
+                            "offset": start,
+                            "count": end - start,
+                            "more_body": True,
+                        }
+                    )
+                else:
+                    await self._send_range(send, file, start, end)
+                await send(
+                    {"type": "http.response.body", "body": b"\n", "more_body": True}
+                )
+        finally:
+            file.close()
+        await send({"type": "http.response.body", "body": closing, "more_body": False})
+
+    async def _send_range(self, send, file, start, end):
+        await run_in_threadpool(file.seek, start)
+        while start < end:
+            chunk = await run_in_threadpool(
+                file.read, min(self.chunk_size, end - start)
+            )
+            if not chunk:
+                break
+            start += len(chunk)
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+
+    async def _zerocopy_send(self, send, offset, count):
+        with open(self.path, "rb") as file:
+            message = {
+                "type": "http.response.zerocopysend",
+                "file": file,
+                "offset": offset,
+                "more_body": False,
+            }
+            if count is not None:
+                message["count"] = count
+            await send(message)
+
+
+def _validators(
+    sha256: str | None,
+    last_modified: datetime | None,
+    stored_encoding: str | None = None,
+    encoding: str | None = None,
+):
+    etag = make_etag(sha256, encoding) if sha256 else None
+    headers = {}
+    if etag:
+        headers["etag"] = etag
+    if last_modified is not None:
+        if last_modified.tzinfo is None:
+            last_modified = last_modified.replace(tzinfo=timezone.utc)
+        headers["last-modified"] = formatdate(last_modified.timestamp(), usegmt=True)
+    if stored_encoding:
+        # The body depends on Accept-Encoding whichever representation is sent
+        headers["vary"] = "Accept-Encoding"
+    if encoding:
+        headers["content-encoding"] = encoding
+    return etag, last_modified, headers
+
+
+def file_download(
+    request: Request,
+    path: str,
+    filename: str,
+    media_type: str,
+    sha256: str | None,
+    last_modified: datetime | None,
+    encoding: str | None = None,
+) -> Response:
+    """Serves a stored file with validators, conditional GET and ranges.
+
+    Content-addressed files get their SHA-256 as a strong ETag, which also
+    drives If-Range; Starlette handles Range parsing and 416 responses.
+    Compressed files are sent as stored, labelled with `encoding`.
+    """
+    etag, last_modified, headers = _validators(
+        sha256, last_modified, encoding, encoding
+    )
+
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    return ContentFileResponse(
+        path=path, filename=filename, media_type=media_type, headers=headers
+    )
+
+
+def memory_download(
+    request: Request,
+    body: bytes,
+    filename: str,
+    media_type: str,
+    sha256: str | None,
+    last_modified: datetime | None,
+    encoding: str | None = None,
+) -> Response:
+    """Like file_download, for a full GET of a file already held in memory."""
+    etag, last_modified, headers = _validators(
+        sha256, last_modified, encoding, encoding
+    )
+
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    headers["content-disposition"] = content_disposition(filename)
+    headers["accept-ranges"] = "bytes"
+    return Response(body, media_type=media_type, headers=headers)
+
+
+def offload_download(
+    request: Request,
+    target: str,
+    filename: str,
+    media_type: str,
+    sha256: str | None,
+    last_modified: datetime | None,
+    encoding: str | None = None,
+) -> Response:
+    """Hands sending the file at `target` to the reverse proxy.
+
+    Only the headers are produced here, with the DOWNLOAD_OFFLOAD header
+    naming the file; the proxy sends the body and handles ranges itself.
+    """
+    etag, last_modified, headers = _validators(
+        sha256, last_modified, encoding, encoding
+    )
+
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    headers["content-disposition"] = content_disposition(filename)
+    headers[DOWNLOAD_OFFLOAD] = target
+    response = Response(headers=headers, media_type=media_type)
+    # The proxy sets the length of the body it sends.
+    del response.headers["content-length"]
+    return response
+
+
+def _decoded_chunks(open_source):
+    with open_source() as source:
+        while chunk := source.read(UPLOAD_CHUNK_SIZE):
+            yield chunk
+
+
+def decoded_download(
+    request: Request,
+    open_source,
+    filename: str,
+    media_type: str,
+    sha256: str | None,
+    last_modified: datetime | None,
+    stored_encoding: str,
+    size: int,
+) -> Response:
+    """Streams a compressed file decoded, for clients that can't accept it.
+
+    `open_source()` must return a reader of the decoded bytes. Ranges are
+    not supported on this path, so the whole file is always sent.
+    """
+    etag, last_modified, headers = _validators(sha256, last_modified, stored_encoding)
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    headers["content-disposition"] = content_disposition(filename)
+    headers["content-length"] = str(size)
+    headers["accept-ranges"] = "none"
+    if request.method == "HEAD":
+        return Response(headers=headers, media_type=media_type)
+    return StreamingResponse(
+        iterate_in_threadpool(_decoded_chunks(open_source)),
+        media_type=media_type,
+        headers=headers,
+    )
+
+
+def redirect_download(
+    request: Request,
+    url: str,
+    sha256: str | None,
+    last_modified: datetime | None,
+    encoding: str | None = None,
+) -> Response:
+    """Answers conditional requests locally and sends everything else to `url`.
+
+    Used for remote storage; the object store serves the body and ranges.
+    """
+    etag, last_modified, headers = _validators(
+        sha256, last_modified, encoding, encoding
+    )
+    headers.pop("content-encoding", None)
+
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+
+    return RedirectResponse(url, status_code=307, headers=headers)
@@ -1,216 +1,64 @@
 import os
-from fastapi_mail import FastMail, MessageSchema, ConnectionConfig, MessageType
+from datetime import datetime, timezone
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
 from pydantic import EmailStr
-from dotenv import load_dotenv
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import DOMAIN
 from app.core.security import create_verification_token
+from app.models.models import EmailOutbox
+
+TEMPLATE_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "templates", "email"
+)
 
-load_dotenv()
+# Subject and template for each kind of email the outbox can send.
+EMAILS = {
+    "verification": (
+        "File Management System Account Verification Email",
+        "verification.html",
+    ),
+    "password_reset": ("Password Reset Request", "password_reset.html"),
+}
 
-conf = ConnectionConfig(
-    MAIL_USERNAME=os.getenv("MAIL_USERNAME"),
-    MAIL_PASSWORD=os.getenv("MAIL_PASSWORD"),
-    MAIL_FROM=os.getenv("MAIL_FROM"),
-    MAIL_PORT=int(os.getenv("MAIL_PORT", 465)),
-    MAIL_SERVER=os.getenv("MAIL_SERVER"),
-    MAIL_STARTTLS=False,
-    MAIL_SSL_TLS=True,
-    USE_CREDENTIALS=True,
-    VALIDATE_CERTS=True,
+_env = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=select_autoescape(["html"]),
 )
+# Compiled once at import; rendering only fills in the variables.
+_templates = {kind: _env.get_template(name) for kind, (_, name) in EMAILS.items()}
 
-async def send_verification_email(email: EmailStr, user_name: str):
-    token = create_verification_token(email)
 
-    domain = os.getenv("DOMAIN", "localhost:8000")
-    verification_link = f"http://{domain}/auth/verify?token={token}"
+def render_email(kind: str, recipient: str, context: dict) -> tuple[str, str]:
+    """Returns the subject and HTML body for an outbox row."""
+    subject = EMAILS[kind][0]
+    if kind == "verification":
+        # Minted at send time so a retried message still carries a live token.
+        token = create_verification_token(recipient)
+        context = {
+            **context,
+            "verification_link": f"http://{DOMAIN}/auth/verify?token={token}",
+        }
+    return subject, _templates[kind].render(**context)
 
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Email Verification</title>
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                background-color: #f4f4f4;
-                margin: 0;
-                padding: 0;
-            }}
-            .container {{
-                max-width: 600px;
-                margin: 0 auto;
-                background-color: #ffffff;
-                padding: 20px;
-                border-radius: 8px;
-                box-shadow: 0 0 10px rgba(0, 0, 0, 0.1);
-            }}
-            .header {{
-                text-align: center;
-                padding: 10px 0;
-                border-bottom: 1px solid #eeeeee;
-            }}
-            .header h2 {{
-                color: #333333;
-                margin: 0;
-            }}
-            .content {{
-                padding: 20px;
-                text-align: center;
-                color: #555555;
-            }}
-            .content p {{
-                line-height: 1.6;
-                margin-bottom: 20px;
-            }}
-            .btn {{
-                display: inline-block;
-                padding: 12px 24px;
-                background-color: #0275d8;
-                color: #ffffff;
-                text-decoration: none;
-                border-radius: 5px;
-                font-weight: bold;
-                margin-top: 10px;
-            }}
-            .btn:hover {{
-                background-color: #025aa5;
-            }}
-            .footer {{
-                text-align: center;
-                padding-top: 20px;
-                font-size: 12px;
-                color: #999999;
-                border-top: 1px solid #eeeeee;
-                margin-top: 20px;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h2>File Management System</h2>
-            </div>
-            <div class="content">
-                <h3>Account Verification</h3>
-                <p>Hi {user_name},</p>
-                <p>Thanks for choosing File Management System. To complete your registration, please verify your email address by clicking the link below:</p>
-                <a href="{verification_link}" class="btn">Click Link</a>
-                <p style="margin-top: 20px; font-size: 14px;">If the button above doesn't work, copy and paste the following link into your browser:</p>
-                <p style="font-size: 12px; color: #0275d8; word-break: break-all;">{verification_link}</p>
-            </div>
-            <div class="footer">
-                <p>Please ignore this email if you did not register for File Management System.</p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
 
-    message = MessageSchema(
-        subject="File Management System Account Verification Email",
-        recipients=[email],
-        body=html,
-        subtype=MessageType.html,
+def queue_email(db: AsyncSession, recipient: str, kind: str, **context):
+    # Added to the caller's transaction, so the email is only sent if the
+    # change that triggered it is committed.
+    db.add(
+        EmailOutbox(
+            recipient=recipient,
+            template=kind,
+            context=context,
+            next_attempt_at=datetime.now(timezone.utc),
+        )
     )
 
-    fm = FastMail(conf)
-    await fm.send_message(message)
-
 
-async def send_password_reset_email(email: EmailStr, link: str):
-    html = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Password Reset</title>
-        <style>
-            body {{
-                font-family: Arial, sans-serif;
-                background-color: #f4f4f4;
-                margin: 0;
-                padding: 0;
-            }}
-            .container {{
-                max-width: 600px;
-                margin: 0 auto;
-                background-color: #ffffff;
-                padding: 20px;
-                border-radius: 8px;
-                box-shadow: 0 0 10px rgba(0, 0, 0, 0.1);
-            }}
-            .header {{
-                text-align: center;
-                padding: 10px 0;
-                border-bottom: 1px solid #eeeeee;
-            }}
-            .header h2 {{
-                color: #333333;
-                margin: 0;
-            }}
-            .content {{
-                padding: 20px;
-                text-align: center;
-                color: #555555;
-            }}
-            .content p {{
-                line-height: 1.6;
-                margin-bottom: 20px;
-            }}
-            .btn {{
-                display: inline-block;
-                padding: 12px 24px;
-                background-color: #0275d8;
-                color: #ffffff;
-                text-decoration: none;
-                border-radius: 5px;
-                font-weight: bold;
-                margin-top: 10px;
-            }}
-            .btn:hover {{
-                background-color: #025aa5;
-            }}
-            .footer {{
-                text-align: center;
-                padding-top: 20px;
-                font-size: 12px;
-                color: #999999;
-                border-top: 1px solid #eeeeee;
-                margin-top: 20px;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h2>File Management System</h2>
-            </div>
-            <div class="content">
-                <h3>Password Reset Request</h3>
-                <p>Hi,</p>
-                <p>We received a request to reset your password. Click the button below to reset it:</p>
-                <a href="{link}" class="btn">Reset Password</a>
-                <p style="margin-top: 20px; font-size: 14px;">If the button above doesn't work, copy and paste the following link into your browser:</p>
-                <p style="font-size: 12px; color: #0275d8; word-break: break-all;">{link}</p>
-                <p>If you didn't request a password reset, please ignore this email.</p>
-            </div>
-            <div class="footer">
-                <p>File Management System</p>
-            </div>
-        </div>
-    </body>
-    </html>
-    """
+def queue_verification_email(db: AsyncSession, email: EmailStr, user_name: str):
+    queue_email(db, email, "verification", user_name=user_name)
 
-    message = MessageSchema(
-        subject="Password Reset Request",
-        recipients=[email],
-        body=html,
-        subtype=MessageType.html,
-    )
 
-    fm = FastMail(conf)
-    await fm.send_message(message)
+def queue_password_reset_email(db: AsyncSession, email: EmailStr, link: str):
+    queue_email(db, email, "password_reset", link=link)
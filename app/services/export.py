@@ -0,0 +1,35 @@
+import orjson
+
+from app.core.config import EXPORT_BATCH_SIZE
+from app.core.database import read_session
+from app.models.models import FileManage
+
+EXPORT_COLUMNS = (
+    FileManage.id,
+    FileManage.filename,
+    FileManage.file_type,
+    FileManage.file_size,
+    FileManage.sha256,
+    FileManage.uploaded_at,
+    FileManage.download_count,
+    FileManage.processing_status,
+)
+
+
+async def stream_ndjson(
+    stmt, batch_size: int = EXPORT_BATCH_SIZE, user_id: int | None = None
+):
+    """Yields the rows of `stmt` as newline-delimited JSON, a batch per chunk.
+
+    Rows are read through a server-side cursor on Postgres (batched
+    fetches on SQLite), so memory stays flat however many there are. The
+    generator has its own read session for `user_id`, held only while the
+    body streams.
+    """
+    async with await read_session(user_id) as db:
+        result = await db.stream(stmt.execution_options(yield_per=batch_size))
+        async for rows in result.partitions():
+            yield b"".join(
+                orjson.dumps(row._asdict(), option=orjson.OPT_APPEND_NEWLINE)
+                for row in rows
+            )
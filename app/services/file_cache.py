@@ -0,0 +1,145 @@
+import time
+from dataclasses import dataclass
+from datetime import datetime
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from app.core.cache import ByteLRUCache, TTLCache, invalidation_bus
+from app.core.config import (
+    CONTENT_CACHE_BYTES,
+    CONTENT_CACHE_MAX_FILE,
+    FILE_CACHE_SIZE,
+    FILE_CACHE_TTL,
+)
+from app.core.database import read_session
+from app.models.models import FileManage
+
+
+@dataclass(frozen=True)
+class FileMeta:
+    id: int
+    filename: str
+    file_type: str
+    file_size: int
+    sha256: str | None
+    path: str
+    content_encoding: str | None
+    uploaded_at: datetime
+
+
+META_COLUMNS = (
+    FileManage.id,
+    FileManage.filename,
+    FileManage.file_type,
+    FileManage.file_size,
+    FileManage.sha256,
+    FileManage.path,
+    FileManage.content_encoding,
+    FileManage.uploaded_at,
+)
+
+# (user id, filename) -> FileMeta
+file_cache = TTLCache(FILE_CACHE_SIZE, FILE_CACHE_TTL)
+# storage key -> stored bytes. Keys are content addressed, so an entry is
+# never stale; it is dropped with the last cached name pointing at it.
+content_cache = ByteLRUCache(CONTENT_CACHE_BYTES, CONTENT_CACHE_MAX_FILE)
+
+# (user id, filename) -> when it last changed
+_invalidated_at = {}
+
+
+async def get_file_meta(
+    db: AsyncSession, user_id: int, filename: str
+) -> FileMeta | None:
+    """The row a download of `filename` serves, read through file_cache.
+
+    Like the other lookups by name, the first upload of a name wins.
+    """
+    meta = file_cache.get((user_id, filename))
+    if meta is not None:
+        return meta
+    return await _read_file_meta(db, user_id, filename)
+
+
+async def lookup_file_meta(user_id: int, filename: str) -> FileMeta | None:
+    """Like get_file_meta, but only opens a read session on a cache miss."""
+    meta = file_cache.get((user_id, filename))
+    if meta is not None:
+        return meta
+    async with await read_session(user_id) as db:
+        return await _read_file_meta(db, user_id, filename)
+
+
+async def _read_file_meta(
+    db: AsyncSession, user_id: int, filename: str
+) -> FileMeta | None:
+    key = (user_id, filename)
+    started = time.time()
+    row = (
+        await db.execute(
+            select(*META_COLUMNS)
+            .where(FileManage.user_id == user_id, FileManage.filename == filename)
+            .order_by(FileManage.id)
+            .limit(1)
+        )
+    ).first()
+    if row is None:
+        return None
+    meta = FileMeta(**row._asdict())
+    # A change committed while we were reading may not be in the row.
+    if _invalidated_at.get(key, 0) < started:
+        file_cache.set(key, meta)
+    return meta
+
+
+def _read(path: str) -> bytes:
+    with open(path, "rb") as source:
+        return source.read()
+
+
+async def cached_body(meta: FileMeta, file_path: str) -> bytes | None:
+    """The stored bytes of a small content-addressed file, or None.
+
+    None also means the file is missing from storage.
+    """
+    if meta.sha256 is None or meta.file_size > content_cache.max_item:
+        return None
+    body = content_cache.get(meta.path)
+    if body is None:
+        try:
+            body = await run_in_threadpool(_read, file_path)
+        except FileNotFoundError:
+            return None
+        content_cache.set(meta.path, body)
+    return body
+
+
+def _forget_files(key):
+    user_id, *filenames = key
+    now = time.time()
+    for filename in filenames:
+        _invalidated_at[(user_id, filename)] = now
+        meta = file_cache.pop((user_id, filename))
+        if meta is not None:
+            content_cache.pop(meta.path)
+    # Reads started before the TTL window have finished by now.
+    if len(_invalidated_at) > 1024:
+        for stale in [
+            name for name, at in _invalidated_at.items() if at < now - FILE_CACHE_TTL
+        ]:
+            del _invalidated_at[stale]
+
+
+invalidation_bus.subscribe("file", _forget_files)
+
+
+async def invalidate_files(user_id: int, filenames):
+    """Drops cached lookups of a user's files in every worker.
+
+    Call after committing an upload, delete or change under those names.
+    """
+    filenames = list(filenames)
+    if filenames:
+        await invalidation_bus.publish("file", (user_id, *filenames))
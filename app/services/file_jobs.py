@@ -0,0 +1,253 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import (
+    FILE_JOB_LEASE,
+    FILE_JOB_MAX_ATTEMPTS,
+    FILE_JOB_POLL_INTERVAL,
+    FILE_JOB_RETRY_BASE,
+    FILE_JOB_RETRY_MAX,
+)
+from app.core.database import SessionLocal
+from app.core.metrics import FILE_JOB_LATENCY, FILE_JOBS
+from app.models.models import FileJob, FileManage
+from app.services.file_cache import invalidate_files
+from app.services.processors import FileContext, ProcessingFailed, enabled_processors
+
+logger = logging.getLogger(__name__)
+
+# One event per running processor loop, so a wake-up reaches all of them.
+_listeners = set()
+
+
+def queue_file_jobs(db: AsyncSession, rows):
+    """Adds a job per enabled processor for each new file row.
+
+    The jobs commit with the rows, so the upload returns as soon as its
+    bytes are stored and no "file uploaded" event can be lost.
+    """
+    processors = enabled_processors()
+    if not processors:
+        return
+    now = datetime.now(timezone.utc)
+    for row in rows:
+        row.processing_status = "pending"
+        for name in processors:
+            db.add(FileJob(file=row, processor=name, next_attempt_at=now))
+
+
+def wake_file_jobs():
+    """Tells the in-app workers that jobs were committed, skipping the poll wait."""
+    for event in _listeners:
+        event.set()
+
+
+async def forget_file_jobs(db: AsyncSession, file_ids: list):
+    # Postgres cascades this itself, SQLite doesn't enforce foreign keys.
+    await db.execute(delete(FileJob).where(FileJob.file_id.in_(file_ids)))
+
+
+def _backoff(attempts: int) -> timedelta:
+    delay = FILE_JOB_RETRY_BASE * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, FILE_JOB_RETRY_MAX))
+
+
+async def _claim(processor: str, limit: int):
+    # Same lease scheme as the email outbox: a worker that dies mid-job
+    # leaves it to be claimed again once the lease runs out.
+    now = datetime.now(timezone.utc)
+    due = (
+        select(FileJob.id)
+        .where(
+            FileJob.processor == processor,
+            FileJob.status == "pending",
+            FileJob.next_attempt_at <= now,
+        )
+        .order_by(FileJob.next_attempt_at)
+        .limit(limit)
+        .with_for_update(skip_locked=True)
+    )
+    async with SessionLocal() as db:
+        result = await db.execute(
+            update(FileJob)
+            .where(FileJob.id.in_(due))
+            .values(
+                attempts=FileJob.attempts + 1,
+                next_attempt_at=now + timedelta(seconds=FILE_JOB_LEASE),
+            )
+            .returning(FileJob.id, FileJob.file_id, FileJob.attempts)
+            .execution_options(synchronize_session=False)
+        )
+        jobs = result.all()
+        await db.commit()
+    return jobs
+
+
+async def _load_file(file_id: int) -> FileContext | None:
+    async with SessionLocal() as db:
+        row = (
+            await db.execute(
+                select(
+                    FileManage.id,
+                    FileManage.filename,
+                    FileManage.file_type,
+                    FileManage.file_size,
+                    FileManage.sha256,
+                    FileManage.path,
+                    FileManage.content_encoding,
+                    FileManage.user_id,
+                ).where(FileManage.id == file_id)
+            )
+        ).first()
+    if row is None:
+        return None
+    return FileContext(
+        file_id=row.id,
+        filename=row.filename,
+        file_type=row.file_type,
+        file_size=row.file_size,
+        sha256=row.sha256,
+        path=row.path,
+        content_encoding=row.content_encoding,
+        user_id=row.user_id,
+    )
+
+
+async def _finish(job, file: FileContext, result, error: Exception | None) -> str:
+    now = datetime.now(timezone.utc)
+    if error is None:
+        values = {"status": "done", "result": result, "last_error": None}
+    else:
+        values = {"last_error": f"{type(error).__name__}: {error}"[:1000]}
+        if isinstance(error, ProcessingFailed) or job.attempts >= FILE_JOB_MAX_ATTEMPTS:
+            values["status"] = "failed"
+        else:
+            values["next_attempt_at"] = now + _backoff(job.attempts)
+    if values.get("status"):
+        values["finished_at"] = now
+
+    async with SessionLocal() as db:
+        # Writing the file row first serializes sibling jobs finishing at
+        # the same time, so the last of them sees the others' outcome.
+        touched = await db.execute(
+            update(FileManage)
+            .where(FileManage.id == file.file_id)
+            .values(
+                **(file.changes if error is None else {}), processing_status="pending"
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if not touched.rowcount:
+            await db.execute(delete(FileJob).where(FileJob.id == job.id))
+            await db.commit()
+            return "deleted"
+        await db.execute(
+            update(FileJob)
+            .where(FileJob.id == job.id)
+            .values(**values)
+            .execution_options(synchronize_session=False)
+        )
+        statuses = set(
+            await db.scalars(
+                select(FileJob.status).where(FileJob.file_id == file.file_id).distinct()
+            )
+        )
+        if "pending" not in statuses:
+            await db.execute(
+                update(FileManage)
+                .where(FileManage.id == file.file_id)
+                .values(processing_status="failed" if "failed" in statuses else "done")
+                .execution_options(synchronize_session=False)
+            )
+        await db.commit()
+    if error is None and file.changes and file.user_id is not None:
+        await invalidate_files(file.user_id, [file.filename])
+    return values.get("status", "retried")
+
+
+async def _run_job(processor, job):
+    file = await _load_file(job.file_id)
+    if file is None:
+        # The file was deleted after the job was claimed.
+        async with SessionLocal() as db:
+            await db.execute(delete(FileJob).where(FileJob.id == job.id))
+            await db.commit()
+        return
+
+    result = error = None
+    start = time.perf_counter()
+    try:
+        result = await run_in_threadpool(processor.run, file)
+    except Exception as exc:
+        error = exc
+    FILE_JOB_LATENCY.labels(processor.name).observe(time.perf_counter() - start)
+    outcome = await _finish(job, file, result, error)
+    FILE_JOBS.labels(processor.name, outcome).inc()
+
+
+async def _run_processor(processor):
+    """Keeps up to processor.concurrency of its jobs running."""
+    running = set()
+    wakeup = asyncio.Event()
+    _listeners.add(wakeup)
+    try:
+        await _process(processor, running, wakeup)
+    finally:
+        _listeners.discard(wakeup)
+        for task in running:
+            task.cancel()
+        # Interrupted jobs are claimed again once their lease runs out.
+        await asyncio.gather(*running, return_exceptions=True)
+
+
+async def _process(processor, running: set, wakeup: asyncio.Event):
+    while True:
+        free = processor.concurrency - len(running)
+        claimed = []
+        if free > 0:
+            try:
+                claimed = await _claim(processor.name, free)
+            except Exception:
+                logger.exception("claiming %s jobs failed", processor.name)
+        for job in claimed:
+            task = asyncio.create_task(_guarded(processor, job))
+            running.add(task)
+            task.add_done_callback(running.discard)
+
+        if running and len(claimed) == free:
+            # Full: more may be due, so claim again as soon as a slot frees.
+            await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            continue
+        try:
+            await asyncio.wait_for(wakeup.wait(), FILE_JOB_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        wakeup.clear()
+
+
+async def _guarded(processor, job):
+    try:
+        await _run_job(processor, job)
+    except Exception:
+        # The lease brings the job back if its outcome couldn't be saved.
+        logger.exception("%s job %s failed", processor.name, job.id)
+
+
+async def run_file_jobs():
+    """Runs every enabled processor's jobs until cancelled."""
+    processors = enabled_processors().values()
+    if not processors:
+        return
+    tasks = [asyncio.create_task(_run_processor(p)) for p in processors]
+    try:
+        await asyncio.gather(*tasks)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,87 @@
+import base64
+import json
+from datetime import datetime
+
+from fastapi import HTTPException, status
+from sqlalchemy import Integer, func, literal, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models.models import FileManage
+
+SORT_COLUMNS = {
+    "uploaded_at": FileManage.uploaded_at,
+    "filename": FileManage.filename,
+    "file_size": FileManage.file_size,
+}
+
+# Only the columns FileDetail needs are fetched, never whole entities.
+LIST_COLUMNS = (
+    FileManage.id,
+    FileManage.filename,
+    FileManage.file_type,
+    FileManage.file_size,
+    FileManage.uploaded_at,
+    FileManage.processing_status,
+)
+
+
+def encode_cursor(sort: str, row) -> str:
+    value = getattr(row, sort)
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([value, row.id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(sort: str, cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, last_id = json.loads(raw)
+        if sort == "uploaded_at":
+            value = datetime.fromisoformat(value)
+        elif sort == "file_size":
+            value = int(value)
+        else:
+            value = str(value)
+        return value, int(last_id)
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+
+
+async def page_files(
+    db: AsyncSession,
+    stmt,
+    sort: str,
+    descending: bool,
+    limit: int,
+    cursor: str | None,
+):
+    """Returns one keyset page of `stmt` and the cursor for the next one.
+
+    Rows are ordered by (sort column, id) so the order is stable across
+    duplicates and each page is a single index range scan on the composite
+    (user_id, sort column, id) indexes.
+    """
+    column = SORT_COLUMNS[sort]
+    key = tuple_(column, FileManage.id)
+    if cursor:
+        value, last_id = decode_cursor(sort, cursor)
+        after = tuple_(literal(value, column.type), literal(last_id, Integer))
+        stmt = stmt.where(key < after if descending else key > after)
+
+    if descending:
+        stmt = stmt.order_by(column.desc(), FileManage.id.desc())
+    else:
+        stmt = stmt.order_by(column.asc(), FileManage.id.asc())
+
+    rows = (await db.execute(stmt.limit(limit + 1))).all()
+    next_cursor = encode_cursor(sort, rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+
+async def count_files(db: AsyncSession, stmt) -> int:
+    return await db.scalar(
+        stmt.with_only_columns(func.count(FileManage.id)).order_by(None)
+    )
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+
+import aiosmtplib
+from sqlalchemy import func, select, update
+
+from app.core.config import (
+    MAIL_BATCH_SIZE,
+    MAIL_FROM,
+    MAIL_IDLE_TIMEOUT,
+    MAIL_MAX_ATTEMPTS,
+    MAIL_PASSWORD,
+    MAIL_POLL_INTERVAL,
+    MAIL_POOL_SIZE,
+    MAIL_PORT,
+    MAIL_RETRY_BASE,
+    MAIL_RETRY_MAX,
+    MAIL_SEND_LEASE,
+    MAIL_SERVER,
+    MAIL_SSL_TLS,
+    MAIL_STARTTLS,
+    MAIL_USE_CREDENTIALS,
+    MAIL_USERNAME,
+    MAIL_VALIDATE_CERTS,
+)
+from app.core.database import SessionLocal
+from app.core.metrics import EMAIL_SEND_LATENCY, EMAILS
+from app.models.models import EmailOutbox
+from app.services.email import render_email
+
+logger = logging.getLogger(__name__)
+
+
+class SMTPPool:
+    """Keeps up to `size` authenticated SMTP connections open for reuse.
+
+    Each connection sends many messages, so the TCP/TLS handshake and login
+    are paid once per connection rather than once per email.
+    """
+
+    def __init__(self, size: int, idle_timeout: float):
+        self.size = size
+        self.idle_timeout = idle_timeout
+        self._idle = []
+        self._slots = None
+
+    def _connect_args(self):
+        args = {
+            "hostname": MAIL_SERVER,
+            "port": MAIL_PORT,
+            "use_tls": MAIL_SSL_TLS,
+            "start_tls": MAIL_STARTTLS,
+            "validate_certs": MAIL_VALIDATE_CERTS,
+        }
+        if MAIL_USE_CREDENTIALS:
+            args["username"] = MAIL_USERNAME
+            args["password"] = MAIL_PASSWORD
+        return args
+
+    async def _checkout(self):
+        while self._idle:
+            client, idle_since = self._idle.pop()
+            if (
+                time.monotonic() - idle_since < self.idle_timeout
+                and client.is_connected
+            ):
+                return client, True
+            await _quit(client)
+        client = aiosmtplib.SMTP(**self._connect_args())
+        await client.connect()
+        return client, False
+
+    async def send(self, message: EmailMessage):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.size)
+        async with self._slots:
+            client, reused = await self._checkout()
+            try:
+                try:
+                    await client.send_message(message)
+                except aiosmtplib.SMTPServerDisconnected:
+                    if not reused:
+                        raise
+                    # The server dropped a pooled connection; retry once on a
+                    # fresh one.
+                    client.close()
+                    client = aiosmtplib.SMTP(**self._connect_args())
+                    await client.connect()
+                    await client.send_message(message)
+            except BaseException:
+                await _quit(client)
+                raise
+            self._idle.append((client, time.monotonic()))
+
+    async def close(self):
+        while self._idle:
+            client, _ = self._idle.pop()
+            await _quit(client)
+
+
+async def _quit(client):
+    try:
+        await client.quit()
+    except Exception:
+        client.close()
+
+
+smtp_pool = SMTPPool(MAIL_POOL_SIZE, MAIL_IDLE_TIMEOUT)
+_wakeup = asyncio.Event()
+stats = {"sent": 0, "retried": 0, "failed": 0}
+
+
+def wake_outbox():
+    """Tells the sender that new rows were committed, so it skips the poll wait."""
+    _wakeup.set()
+
+
+def _backoff(attempts: int) -> timedelta:
+    delay = MAIL_RETRY_BASE * 2 ** (attempts - 1)
+    return timedelta(seconds=min(delay, MAIL_RETRY_MAX))
+
+
+def _build_message(row) -> EmailMessage:
+    subject, html = render_email(row.template, row.recipient, row.context)
+    message = EmailMessage()
+    message["From"] = MAIL_FROM
+    message["To"] = row.recipient
+    message["Subject"] = subject
+    message.set_content(html, subtype="html")
+    return message
+
+
+async def _claim_batch(db):
+    # Claiming pushes next_attempt_at out by the lease, so a worker that dies
+    # mid-send leaves its rows to be picked up again once the lease ends.
+    # SKIP LOCKED lets several workers claim disjoint batches on Postgres.
+    now = datetime.now(timezone.utc)
+    due = (
+        select(EmailOutbox.id)
+        .where(EmailOutbox.status == "pending", EmailOutbox.next_attempt_at <= now)
+        .order_by(EmailOutbox.next_attempt_at)
+        .limit(MAIL_BATCH_SIZE)
+        .with_for_update(skip_locked=True)
+    )
+    result = await db.execute(
+        update(EmailOutbox)
+        .where(EmailOutbox.id.in_(due))
+        .values(
+            attempts=EmailOutbox.attempts + 1,
+            next_attempt_at=now + timedelta(seconds=MAIL_SEND_LEASE),
+        )
+        .returning(
+            EmailOutbox.id,
+            EmailOutbox.recipient,
+            EmailOutbox.template,
+            EmailOutbox.context,
+            EmailOutbox.attempts,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    rows = result.all()
+    await db.commit()
+    return rows
+
+
+async def _send(row):
+    try:
+        with EMAIL_SEND_LATENCY.time():
+            await smtp_pool.send(_build_message(row))
+    except Exception as exc:
+        return row, exc
+    return row, None
+
+
+async def deliver_due() -> int:
+    """Sends one batch of due messages and returns how many were claimed."""
+    async with SessionLocal() as db:
+        rows = await _claim_batch(db)
+        if not rows:
+            return 0
+
+        results = await asyncio.gather(*(_send(row) for row in rows))
+
+        now = datetime.now(timezone.utc)
+        sent = [row.id for row, error in results if error is None]
+        if sent:
+            await db.execute(
+                update(EmailOutbox)
+                .where(EmailOutbox.id.in_(sent))
+                .values(status="sent", sent_at=now, last_error=None)
+                .execution_options(synchronize_session=False)
+            )
+            stats["sent"] += len(sent)
+            EMAILS.labels("sent").inc(len(sent))
+        for row, error in results:
+            if error is None:
+                continue
+            values = {"last_error": f"{type(error).__name__}: {error}"[:1000]}
+            if row.attempts >= MAIL_MAX_ATTEMPTS:
+                values["status"] = "failed"
+                stats["failed"] += 1
+                EMAILS.labels("failed").inc()
+            else:
+                values["next_attempt_at"] = now + _backoff(row.attempts)
+                stats["retried"] += 1
+                EMAILS.labels("retried").inc()
+            await db.execute(
+                update(EmailOutbox)
+                .where(EmailOutbox.id == row.id)
+                .values(**values)
+                .execution_options(synchronize_session=False)
+            )
+        await db.commit()
+        return len(rows)
+
+
+async def run_outbox_sender():
+    while True:
+        try:
+            claimed = await deliver_due()
+        except Exception:
+            logger.exception("email outbox delivery failed")
+            claimed = 0
+        if claimed >= MAIL_BATCH_SIZE:
+            continue
+        try:
+            await asyncio.wait_for(_wakeup.wait(), MAIL_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+
+
+async def outbox_status() -> dict:
+    async with SessionLocal() as db:
+        counts = dict(
+            (
+                await db.execute(
+                    select(EmailOutbox.status, func.count(EmailOutbox.id)).group_by(
+                        EmailOutbox.status
+                    )
+                )
+            ).all()
+        )
+        oldest = await db.scalar(
+            select(func.min(EmailOutbox.created_at)).where(
+                EmailOutbox.status == "pending"
+            )
+        )
+    return {
+        "pending": counts.get("pending", 0),
+        "failed": counts.get("failed", 0),
+        "sent": counts.get("sent", 0),
+        "oldest_pending": oldest,
+        "delivered_since_start": stats["sent"],
+        "retried_since_start": stats["retried"],
+        "failed_since_start": stats["failed"],
+    }
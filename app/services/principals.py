@@ -0,0 +1,73 @@
+import time
+from dataclasses import dataclass
+
+from app.core.cache import TTLCache, invalidation_bus
+from app.core.config import PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL
+from app.models.models import Users
+
+
+@dataclass(frozen=True)
+class Principal:
+    id: int
+    email: str
+    first_name: str
+    last_name: str
+    middle_name: str | None
+    is_active: bool
+    is_verified: bool
+
+    @classmethod
+    def from_user(cls, user: Users) -> "Principal":
+        return cls(
+            id=user.id,
+            email=user.email,
+            first_name=user.first_name,
+            last_name=user.last_name,
+            middle_name=user.middle_name,
+            is_active=user.is_active,
+            is_verified=user.is_verified,
+        )
+
+
+# token -> (Principal, cached_at)
+principal_cache = TTLCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL)
+
+# user id -> when their cached principals stopped being valid
+_invalidated_at = {}
+
+
+def get_principal(token: str) -> Principal | None:
+    entry = principal_cache.get(token)
+    if entry is None:
+        return None
+    principal, cached_at = entry
+    if cached_at <= _invalidated_at.get(principal.id, 0):
+        principal_cache.pop(token)
+        return None
+    return principal
+
+
+def cache_principal(token: str, principal: Principal, expires_at: float):
+    principal_cache.set(token, (principal, time.time()), expires_at=expires_at)
+
+
+def _forget_user(user_id: int):
+    now = time.time()
+    _invalidated_at[user_id] = now
+    # Anything cached before the TTL window has expired on its own.
+    if len(_invalidated_at) > 1024:
+        for stale in [
+            uid for uid, at in _invalidated_at.items() if at < now - PRINCIPAL_CACHE_TTL
+        ]:
+            del _invalidated_at[stale]
+
+
+invalidation_bus.subscribe("user", _forget_user)
+
+
+async def invalidate_user(user_id: int):
+    """Drops cached principals for a user in every worker.
+
+    Call after changing credentials or deactivating the account.
+    """
+    await invalidation_bus.publish("user", user_id)
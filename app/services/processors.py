@@ -0,0 +1,204 @@
+import hashlib
+import importlib
+import mimetypes
+from dataclasses import dataclass, field
+from functools import cache
+
+from app.core.config import (
+    FILE_JOB_CONCURRENCY,
+    FILE_PROCESSOR_CONCURRENCY,
+    FILE_PROCESSORS,
+    UPLOAD_CHUNK_SIZE,
+)
+from app.services.compression import open_decoded
+from app.services.storage import storage
+
+
+class ProcessingFailed(Exception):
+    """Raised by a processor for failures that retrying won't fix."""
+
+
+@dataclass
+class FileContext:
+    """What a processor sees of one uploaded file.
+
+    Processors record changes to the file's row in `changes`, e.g.
+    {"file_type": "image/png"}; they are applied when the job finishes.
+    """
+
+    file_id: int
+    filename: str
+    file_type: str
+    file_size: int
+    sha256: str | None
+    path: str
+    content_encoding: str | None
+    user_id: int | None = None
+    changes: dict = field(default_factory=dict)
+
+    def open(self):
+        """Opens the original (decoded) bytes. Blocking."""
+        if self.sha256 is None:
+            # Stored before content addressing, under a plain filesystem path.
+            return open(self.path, "rb")
+        return open_decoded(storage.open_read(self.path), self.content_encoding)
+
+
+class FileProcessor:
+    """A post-upload step, run by the file job workers off the request path.
+
+    Subclasses set `name` and implement run(), which is called in a worker
+    thread and returns a JSON-serializable result to keep on the job, or
+    None. Thumbnailing or text extraction plug in the same way, listed in
+    FILE_PROCESSORS as "package.module:ProcessorClass".
+    """
+
+    name = ""
+
+    @property
+    def concurrency(self) -> int:
+        return FILE_PROCESSOR_CONCURRENCY.get(self.name, FILE_JOB_CONCURRENCY)
+
+    def run(self, file: FileContext) -> dict | None:
+        raise NotImplementedError
+
+
+class ChecksumProcessor(FileProcessor):
+    """Re-reads stored content and checks it against the recorded SHA-256.
+
+    Costs a full read of every upload, so it is off unless listed in
+    FILE_PROCESSORS; use it to catch storage that corrupts or loses data.
+    """
+
+    name = "checksum"
+
+    def run(self, file: FileContext) -> dict | None:
+        if file.sha256 is None:
+            return {"skipped": "no checksum recorded"}
+        digest = hashlib.sha256()
+        size = 0
+        with file.open() as source:
+            while block := source.read(UPLOAD_CHUNK_SIZE):
+                digest.update(block)
+                size += len(block)
+        if digest.hexdigest() != file.sha256 or size != file.file_size:
+            raise ProcessingFailed(
+                f"stored content does not match: sha256 {digest.hexdigest()},"
+                f" {size} bytes"
+            )
+        return {"verified": True}
+
+
+# (offset, magic bytes, media type), checked in order.
+SIGNATURES = (
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (8, b"WEBP", "image/webp"),
+    (0, b"BM", "image/bmp"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"\x1f\x8b", "application/gzip"),
+    (0, b"(\xb5/\xfd", "application/zstd"),
+    (0, b"BZh", "application/x-bzip2"),
+    (0, b"\xfd7zXZ\x00", "application/x-xz"),
+    (0, b"7z\xbc\xaf'\x1c", "application/x-7z-compressed"),
+    (0, b"Rar!\x1a\x07", "application/vnd.rar"),
+    (0, b"PK\x03\x04", "application/zip"),
+    (0, b"OggS", "audio/ogg"),
+    (0, b"fLaC", "audio/flac"),
+    (0, b"ID3", "audio/mpeg"),
+    (8, b"WAVE", "audio/wav"),
+    (0, b"\x1aE\xdf\xa3", "video/webm"),
+    (4, b"ftypavif", "image/avif"),
+    (4, b"ftypheic", "image/heic"),
+    (4, b"ftypqt", "video/quicktime"),
+    (4, b"ftyp", "video/mp4"),
+    (0, b"\x00asm", "application/wasm"),
+    (0, b"SQLite format 3\x00", "application/vnd.sqlite3"),
+)
+# Formats that are ZIP containers underneath; a client claiming one of
+# these for a ZIP-signed file is believed.
+ZIP_BASED = (
+    "application/vnd.openxmlformats-officedocument.",
+    "application/vnd.oasis.opendocument.",
+    "application/epub+zip",
+    "application/java-archive",
+    "application/vnd.android.package-archive",
+)
+GENERIC_TYPES = ("", "application/octet-stream", "binary/octet-stream")
+
+
+def sniff(head: bytes) -> str | None:
+    for offset, magic, media_type in SIGNATURES:
+        if head[offset : offset + len(magic)] == magic:
+            return media_type
+    return None
+
+
+def _is_text(head: bytes) -> bool:
+    if b"\x00" in head:
+        return False
+    try:
+        # The sample may end in the middle of a character.
+        head.decode("utf-8")
+    except UnicodeDecodeError as exc:
+        return exc.start >= len(head) - 3
+    return True
+
+
+class MimeProcessor(FileProcessor):
+    """Replaces the client-supplied content type with one sniffed from the bytes."""
+
+    name = "mime"
+
+    def detect(self, file: FileContext, head: bytes) -> str:
+        claimed = file.file_type.split(";")[0].strip().lower()
+        sniffed = sniff(head)
+        if sniffed == "application/zip" and claimed.startswith(ZIP_BASED):
+            return file.file_type
+        if sniffed:
+            return sniffed
+        if claimed not in GENERIC_TYPES:
+            return file.file_type
+        guessed, _ = mimetypes.guess_type(file.filename)
+        if guessed:
+            return guessed
+        if head and _is_text(head):
+            return "text/plain"
+        return file.file_type
+
+    def run(self, file: FileContext) -> dict | None:
+        with file.open() as source:
+            head = source.read(4096)
+        detected = self.detect(file, head)
+        if detected != file.file_type:
+            file.changes["file_type"] = detected
+        return {"claimed": file.file_type, "detected": detected}
+
+
+BUILTIN = {
+    processor.name: processor for processor in (ChecksumProcessor, MimeProcessor)
+}
+
+
+def _load(spec: str) -> FileProcessor:
+    if spec in BUILTIN:
+        return BUILTIN[spec]()
+    module, _, attr = spec.partition(":")
+    if not attr:
+        raise RuntimeError(f"Unknown file processor {spec!r}")
+    processor = getattr(importlib.import_module(module), attr)
+    return processor() if isinstance(processor, type) else processor
+
+
+@cache
+def enabled_processors() -> dict:
+    """The processors named in FILE_PROCESSORS, by name."""
+    processors = {}
+    for spec in FILE_PROCESSORS:
+        processor = _load(spec)
+        processors[processor.name] = processor
+    return processors
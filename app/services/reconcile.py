@@ -0,0 +1,331 @@
+import asyncio
+import json
+import os
+import re
+import time
+from collections import defaultdict
+
+from sqlalchemy import delete, func, select
+from starlette.concurrency import run_in_threadpool
+
+from app.core.database import SessionLocal
+from app.models.models import Blob, FileManage
+from app.services.blobs import release_blob, unlink_blob
+from app.services.file_cache import invalidate_files
+from app.services.file_jobs import forget_file_jobs
+from app.services.storage import LocalStorage, storage
+from app.services.usage import release_usage
+
+# A blob's file name: its hash, then its encoding if stored compressed.
+BLOB_NAME = re.compile(r"([0-9a-f]{64})(?:\.(?:gzip|zstd))?")
+# Left behind by a copy into storage or a delete that was interrupted, see
+# LocalStorage.
+PART_NAME = re.compile(
+    r"[0-9a-f]{64}(?:\.(?:gzip|zstd))?\.[0-9a-f-]{36}\.(?:part|deleting)"
+)
+
+
+class Throttle:
+    """Paces work to `rate` objects per second on average; 0 for no limit."""
+
+    def __init__(self, rate: float):
+        self.rate = rate
+        self.started = time.monotonic()
+        self.done = 0
+
+    async def __call__(self, count: int):
+        if self.rate <= 0:
+            return
+        self.done += count
+        ahead = self.done / self.rate - (time.monotonic() - self.started)
+        if ahead > 0:
+            await asyncio.sleep(ahead)
+
+
+class Checkpoint:
+    """Progress saved to a JSON file after every batch, so a run can resume.
+
+    With no path nothing is saved and every run starts over.
+    """
+
+    def __init__(self, path: str | None):
+        self.path = path
+        self.state = {}
+        if path and os.path.exists(path):
+            with open(path) as source:
+                self.state = json.load(source)
+
+    def save(self):
+        if not self.path:
+            return
+        part = f"{self.path}.part"
+        with open(part, "w") as target:
+            json.dump(self.state, target)
+        os.replace(part, self.path)
+
+    def finish(self):
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _scan(root: str, directory: str):
+    """Files (key, mtime) and subdirectories of one storage directory."""
+    files = []
+    subdirs = []
+    with os.scandir(os.path.join(root, *directory.split("/"))) as entries:
+        for entry in entries:
+            key = f"{directory}/{entry.name}" if directory else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(key)
+            elif entry.is_file(follow_symlinks=False):
+                files.append((key, entry.stat(follow_symlinks=False).st_mtime))
+    return files, subdirs
+
+
+async def _scan_batch(root: str, directories: list):
+    scanned = await asyncio.gather(
+        *(run_in_threadpool(_scan, root, directory) for directory in directories),
+        return_exceptions=True,
+    )
+    files = []
+    subdirs = []
+    for directory, result in zip(directories, scanned):
+        if isinstance(result, FileNotFoundError):
+            continue
+        if isinstance(result, Exception):
+            raise result
+        files.extend(result[0])
+        subdirs.extend(result[1])
+    return files, subdirs
+
+
+async def _known_keys(sha256s: list) -> set:
+    """The keys blob rows for these hashes point at."""
+    async with SessionLocal() as db:
+        return set(await db.scalars(select(Blob.path).where(Blob.sha256.in_(sha256s))))
+
+
+async def find_orphans(
+    checkpoint: Checkpoint,
+    throttle: Throttle,
+    report,
+    repair: bool = False,
+    grace: float = 3600,
+    parallel: int = 8,
+    batch_size: int = 1000,
+) -> dict:
+    """Walks local storage for contents no blob row refers to.
+
+    Uploads store their contents before committing the row, so only files
+    older than `grace` seconds are reported. Files named like a blob that no
+    blob row points at are "orphan"; anything else is "stray". Repairing
+    deletes orphans, unless their row has appeared or they were written
+    again meanwhile, and the .part files of interrupted copies; other
+    strays are only reported.
+    """
+    counts = defaultdict(int)
+    if not isinstance(storage, LocalStorage):
+        report("skipped", "orphan scan needs local storage")
+        return counts
+
+    # Directories still to scan, deepest last; sorted so runs are repeatable.
+    pending = checkpoint.state.get("pending_dirs", [""])
+    while pending:
+        directories = [pending.pop() for _ in range(min(parallel, len(pending)))]
+        files, subdirs = await _scan_batch(storage.root, directories)
+        pending.extend(sorted(subdirs, reverse=True))
+
+        cutoff = time.time() - grace
+        for start in range(0, len(files), batch_size):
+            batch = files[start : start + batch_size]
+            names = [key.rsplit("/", 1)[-1] for key, _ in batch]
+            matches = [BLOB_NAME.fullmatch(name) for name in names]
+            known = await _known_keys({match.group(1) for match in matches if match})
+            for (key, mtime), name, blob_name in zip(batch, names, matches):
+                counts["stored"] += 1
+                if key in known or mtime > cutoff:
+                    continue
+                kind = "orphan" if blob_name else "stray"
+                counts[kind] += 1
+                report(kind, key)
+                if not repair:
+                    continue
+                # Checked again as it is deleted: the batch may have waited on
+                # the throttle, and an upload may have stored this meanwhile.
+                if kind == "orphan":
+                    async with SessionLocal() as db:
+                        removed = await unlink_blob(db, blob_name.group(1), key, grace)
+                elif PART_NAME.fullmatch(name):
+                    removed = await storage.delete_older(key, time.time() - grace)
+                else:
+                    continue
+                counts["removed" if removed else "spared"] += 1
+            await throttle(len(batch))
+
+        checkpoint.state["pending_dirs"] = pending
+        checkpoint.save()
+    return counts
+
+
+def _content_key(row):
+    # Stored before content addressing, under a plain filesystem path.
+    return ("path", row.path) if row.sha256 is None else ("key", row.path)
+
+
+async def _content_exists(kind: str, location: str) -> bool:
+    if kind == "path":
+        return await run_in_threadpool(os.path.exists, location)
+    return await storage.exists(location)
+
+
+async def _drop_files(file_ids: list) -> int:
+    """Deletes dangling file rows with their jobs, usage and blob references."""
+    async with SessionLocal() as db:
+        await forget_file_jobs(db, file_ids)
+        deleted = (
+            await db.execute(
+                delete(FileManage)
+                .where(FileManage.id.in_(file_ids))
+                .returning(
+                    FileManage.user_id,
+                    FileManage.filename,
+                    FileManage.file_size,
+                    FileManage.sha256,
+                )
+            )
+        ).all()
+        by_user = defaultdict(list)
+        references = defaultdict(int)
+        for row in deleted:
+            by_user[row.user_id].append(row)
+            if row.sha256 is not None:
+                references[row.sha256] += 1
+        for user_id, user_rows in by_user.items():
+            await release_usage(
+                db, user_id, sum(row.file_size for row in user_rows), len(user_rows)
+            )
+        removed = {}
+        for sha256, count in references.items():
+            key = await release_blob(db, sha256, count)
+            if key:
+                removed[sha256] = key
+        await db.commit()
+
+        for sha256, key in removed.items():
+            await unlink_blob(db, sha256, key)
+    for user_id, user_rows in by_user.items():
+        await invalidate_files(user_id, {row.filename for row in user_rows})
+    return len(deleted)
+
+
+async def find_dangling(
+    checkpoint: Checkpoint,
+    throttle: Throttle,
+    report,
+    repair: bool = False,
+    batch_size: int = 1000,
+    max_missing: float = 0.05,
+    force: bool = False,
+) -> dict:
+    """Pages through the files table for rows whose contents are missing.
+
+    Every dangling row is reported before any is deleted. Repairing then
+    deletes them as a delete request would, so their owners' usage and the
+    blob references stay correct. When more than `max_missing` of all files
+    are dangling, storage is more likely unmounted or misconfigured than
+    the files lost, so the repair raises RuntimeError instead unless
+    `force` is set.
+    """
+    counts = defaultdict(int)
+    last = checkpoint.state.get("last_file_id", 0)
+    dangling_ids = checkpoint.state.setdefault("dangling_ids", [])
+    async with SessionLocal() as db:
+        total = await db.scalar(select(func.count()).select_from(FileManage))
+    while True:
+        async with SessionLocal() as db:
+            rows = (
+                await db.execute(
+                    select(
+                        FileManage.id,
+                        FileManage.user_id,
+                        FileManage.filename,
+                        FileManage.path,
+                        FileManage.sha256,
+                    )
+                    .where(FileManage.id > last)
+                    .order_by(FileManage.id)
+                    .limit(batch_size)
+                )
+            ).all()
+        if not rows:
+            break
+        last = rows[-1].id
+
+        # Files sharing content are checked once.
+        locations = list({_content_key(row) for row in rows})
+        found = await asyncio.gather(
+            *(_content_exists(kind, location) for kind, location in locations)
+        )
+        missing = {location for location, exists in zip(locations, found) if not exists}
+        dangling = [row for row in rows if _content_key(row) in missing]
+        counts["files"] += len(rows)
+        counts["dangling"] += len(dangling)
+        for row in dangling:
+            report("dangling", f"file {row.id} of user {row.user_id}: {row.path}")
+        if repair:
+            dangling_ids.extend(row.id for row in dangling)
+        await throttle(len(locations))
+
+        checkpoint.state["last_file_id"] = last
+        checkpoint.save()
+        if repair and not force and len(dangling_ids) > max_missing * total:
+            raise RuntimeError(
+                f"{len(dangling_ids)} of {total} files have no contents, more than"
+                f" {max_missing:.0%}; check the storage configuration, or force"
+                " the repair to delete them"
+            )
+
+    if repair:
+        while dangling_ids:
+            counts["deleted"] += await _drop_files(dangling_ids[:batch_size])
+            del dangling_ids[:batch_size]
+            checkpoint.save()
+    return counts
+
+
+async def reconcile_storage(
+    report=print,
+    repair: bool = False,
+    checkpoint_path: str | None = None,
+    rate: float = 0,
+    grace: float = 3600,
+    parallel: int = 8,
+    batch_size: int = 1000,
+    max_missing: float = 0.05,
+    force: bool = False,
+) -> dict:
+    """Compares storage with the database, reporting (or repairing) mismatches.
+
+    Runs the orphan scan, then the dangling row scan. With a checkpoint
+    path an interrupted run resumes where it stopped; the file is removed
+    once both scans complete. `rate` limits objects checked per second
+    across both scans; `max_missing` and `force` are find_dangling's.
+    """
+    checkpoint = Checkpoint(checkpoint_path)
+    throttle = Throttle(rate)
+    counts = {}
+    if not checkpoint.state.get("orphans_done"):
+        counts.update(
+            await find_orphans(
+                checkpoint, throttle, report, repair, grace, parallel, batch_size
+            )
+        )
+        checkpoint.state["orphans_done"] = True
+        checkpoint.save()
+    counts.update(
+        await find_dangling(
+            checkpoint, throttle, report, repair, batch_size, max_missing, force
+        )
+    )
+    checkpoint.finish()
+    return counts
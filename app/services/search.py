@@ -0,0 +1,138 @@
+import re
+from dataclasses import dataclass
+from datetime import datetime
+
+from fastapi import Query
+from sqlalchemy import and_, case, column, func, or_, select, table
+
+from app.core.database import engine
+from app.models.models import FileManage
+
+# Trigram indexes only help with terms this long; shorter ones are matched
+# with LIKE over the user's own rows.
+MIN_INDEXED_TERM = 3
+
+files_fts = table("files_fts", column("rowid"), column("files_fts"))
+
+
+def escape_like(term: str) -> str:
+    """Escapes LIKE wildcards so they match themselves (ESCAPE '\\')."""
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def tokenize(query: str) -> list[str]:
+    # Filenames split on separators as well as spaces: "q3-report_final.pdf"
+    return [token for token in re.split(r"[\s._\-]+", query) if token]
+
+
+def _fts_phrase(term: str) -> str:
+    return '"' + term.replace('"', '""') + '"'
+
+
+def match_filename(query: str, mode: str = "substring"):
+    """WHERE clause for filenames matching `query`, case-insensitively.
+
+    "substring" matches the query anywhere in the name, "prefix" only at
+    the start and "tokens" matches each word of the query anywhere, in any
+    order. Postgres serves the ILIKEs from the trigram index; on SQLite the
+    FTS5 table narrows the rows and the ILIKEs check them.
+
+    Neither index is per user: the trigram or FTS lookup finds matching
+    names across all users before the caller's user_id filter applies, so
+    its cost grows with matches site-wide, not with the user's own files.
+    Terms shorter than MIN_INDEXED_TERM can't use either index and are
+    matched over the user's own rows only.
+    """
+    terms = (tokenize(query) if mode == "tokens" else None) or [query]
+    conditions = []
+    for term in terms:
+        pattern = escape_like(term)
+        pattern = f"{pattern}%" if mode == "prefix" else f"%{pattern}%"
+        conditions.append(FileManage.filename.ilike(pattern, escape="\\"))
+
+    indexed = [term for term in terms if len(term) >= MIN_INDEXED_TERM]
+    if engine.dialect.name == "sqlite" and indexed:
+        conditions.append(
+            FileManage.id.in_(
+                select(files_fts.c.rowid).where(
+                    files_fts.c.files_fts.op("MATCH")(
+                        " AND ".join(_fts_phrase(term) for term in indexed)
+                    )
+                )
+            )
+        )
+    return and_(*conditions)
+
+
+def relevance(query: str):
+    """ORDER BY terms putting the best matches for `query` first.
+
+    Exact names rank above names starting with the query, then names
+    containing it, then names only matching its words. Within a tier,
+    shorter names rank higher: more of the name is the query.
+    """
+    escaped = escape_like(query)
+    tier = case(
+        (func.lower(FileManage.filename) == query.lower(), 3),
+        (FileManage.filename.ilike(f"{escaped}%", escape="\\"), 2),
+        (FileManage.filename.ilike(f"%{escaped}%", escape="\\"), 1),
+        else_=0,
+    )
+    return (
+        tier.desc(),
+        func.length(FileManage.filename),
+        FileManage.uploaded_at.desc(),
+        FileManage.id.desc(),
+    )
+
+
+@dataclass
+class FileFilters:
+    """Query parameters narrowing a listing or search; all optional."""
+
+    file_type: str | None = Query(
+        default=None, description='A media type, or "image/*" for a family'
+    )
+    min_size: int | None = Query(default=None, ge=0)
+    max_size: int | None = Query(default=None, ge=0)
+    uploaded_after: datetime | None = None
+    uploaded_before: datetime | None = None
+
+    def active(self) -> bool:
+        return any(
+            value is not None
+            for value in (
+                self.file_type,
+                self.min_size,
+                self.max_size,
+                self.uploaded_after,
+                self.uploaded_before,
+            )
+        )
+
+    def apply(self, stmt):
+        if self.file_type:
+            file_type = self.file_type.lower()
+            if file_type.endswith("/*"):
+                stmt = stmt.where(
+                    FileManage.file_type.istartswith(file_type[:-1], autoescape=True)
+                )
+            else:
+                # Also matches types with parameters, e.g. "; charset=utf-8"
+                stmt = stmt.where(
+                    or_(
+                        func.lower(FileManage.file_type) == file_type,
+                        FileManage.file_type.istartswith(
+                            f"{file_type};", autoescape=True
+                        ),
+                    )
+                )
+        if self.min_size is not None:
+            stmt = stmt.where(FileManage.file_size >= self.min_size)
+        if self.max_size is not None:
+            stmt = stmt.where(FileManage.file_size <= self.max_size)
+        if self.uploaded_after is not None:
+            stmt = stmt.where(FileManage.uploaded_at >= self.uploaded_after)
+        if self.uploaded_before is not None:
+            stmt = stmt.where(FileManage.uploaded_at < self.uploaded_before)
+        return stmt
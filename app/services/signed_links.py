@@ -0,0 +1,84 @@
+import base64
+import hashlib
+import hmac
+import json
+import time
+from datetime import datetime, timezone
+
+from app.core.config import DOWNLOAD_LINK_SECRET
+from app.services.file_cache import FileMeta, lookup_file_meta
+
+# Keeps link signatures distinct from anything else signed with the key.
+_PURPOSE = b"file-management:download-link:"
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _signature(payload: str) -> str:
+    digest = hmac.new(
+        DOWNLOAD_LINK_SECRET.encode(), _PURPOSE + payload.encode(), hashlib.sha256
+    ).digest()
+    return _b64encode(digest)
+
+
+def sign_link(user_id: int, meta: FileMeta, expires_at: int) -> str:
+    """A token carrying everything needed to serve `meta` until `expires_at`.
+
+    The payload is signed, not encrypted: it reveals the file's name, type,
+    hash and storage key to whoever holds the link.
+    """
+    uploaded_at = meta.uploaded_at
+    if uploaded_at.tzinfo is None:
+        uploaded_at = uploaded_at.replace(tzinfo=timezone.utc)
+    claims = {
+        "user_id": user_id,
+        "id": meta.id,
+        "filename": meta.filename,
+        "file_type": meta.file_type,
+        "file_size": meta.file_size,
+        "sha256": meta.sha256,
+        "path": meta.path,
+        "content_encoding": meta.content_encoding,
+        "uploaded_at": uploaded_at.timestamp(),
+        "exp": expires_at,
+    }
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode())
+    return f"{payload}.{_signature(payload)}"
+
+
+def verify_link(token: str) -> tuple[int, FileMeta, int] | None:
+    """The owner, file and expiry time of a valid, unexpired token, or None."""
+    payload, _, signature = token.partition(".")
+    if not hmac.compare_digest(signature.encode(), _signature(payload).encode()):
+        return None
+    try:
+        claims = json.loads(_b64decode(payload))
+        expires_at = claims.pop("exp")
+        user_id = claims.pop("user_id")
+        claims["uploaded_at"] = datetime.fromtimestamp(
+            claims["uploaded_at"], timezone.utc
+        )
+        meta = FileMeta(**claims)
+    except (ValueError, TypeError, KeyError):
+        return None
+    if expires_at <= time.time():
+        return None
+    return user_id, meta, expires_at
+
+
+async def link_is_current(user_id: int, meta: FileMeta) -> bool:
+    """Whether the name a link was made for still holds the same file.
+
+    Deleting or replacing the file revokes its links. Answered from
+    file_cache, so only a miss reads the database.
+    """
+    current = await lookup_file_meta(user_id, meta.filename)
+    if current is None:
+        return False
+    return current.id == meta.id and current.sha256 == meta.sha256
@@ -0,0 +1,244 @@
+import errno
+import os
+import shutil
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import (
+    S3_BUCKET,
+    S3_ENDPOINT_URL,
+    S3_PREFIX,
+    S3_PRESIGN_TTL,
+    S3_REGION,
+    STORAGE_BACKEND,
+    STORAGE_ROOT,
+)
+from app.core.metrics import STORAGE_LATENCY
+from app.services.downloads import content_disposition
+
+
+def shard_key(sha256: str) -> str:
+    # Two levels of 256 directories keep any one directory small even with
+    # hundreds of millions of blobs.
+    return f"{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+
+class StorageBackend:
+    """Where blob contents live, addressed by backend-relative keys.
+
+    Keys are what FileManage.path and Blob.path store, so moving blobs to a
+    different layout or backend only rewrites keys.
+    """
+
+    def key_for(self, sha256: str, encoding: str | None = None) -> str:
+        # Compressed copies get their own key: two first uploads of the same
+        # content racing with different encodings must not overwrite each
+        # other's bytes, as the blob row records only one encoding.
+        key = shard_key(sha256)
+        return f"{key}.{encoding}" if encoding else key
+
+    async def put(self, source_path: str, key: str):
+        """Moves a finished local temp file into storage under `key`."""
+        raise NotImplementedError
+
+    async def delete(self, key: str):
+        raise NotImplementedError
+
+    async def delete_older(self, key: str, cutoff: float) -> bool:
+        """Deletes `key` unless it was written at or after `cutoff` (a Unix
+        timestamp); returns whether it was deleted."""
+        raise NotImplementedError
+
+    async def exists(self, key: str) -> bool:
+        raise NotImplementedError
+
+    def local_path(self, key: str) -> str | None:
+        """Filesystem path for `key`, or None if it must be fetched remotely."""
+        return None
+
+    def open_read(self, key: str):
+        """Returns a readable binary file object. Blocking; call off the loop."""
+        raise NotImplementedError
+
+    async def download_url(
+        self, key: str, filename: str, media_type: str, encoding: str | None = None
+    ) -> str:
+        raise NotImplementedError
+
+
+class LocalStorage(StorageBackend):
+    def __init__(self, root: str):
+        self.root = root
+        self._dirs = set()
+
+    def local_path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def open_read(self, key: str):
+        return open(self.local_path(key), "rb")
+
+    def _put(self, source_path: str, key: str):
+        path = self.local_path(key)
+        directory = os.path.dirname(path)
+        if directory not in self._dirs:
+            os.makedirs(directory, exist_ok=True)
+            self._dirs.add(directory)
+        # Written now as far as delete_older is concerned, however long ago
+        # the upload finished staging.
+        os.utime(source_path)
+        try:
+            os.replace(source_path, path)
+        except OSError as exc:
+            if exc.errno != errno.EXDEV:
+                raise
+            # Temp dir on another filesystem: copy next to the target first so
+            # the final rename is still atomic.
+            part = f"{path}.{uuid.uuid4()}.part"
+            try:
+                shutil.copyfile(source_path, part)
+                os.replace(part, path)
+            finally:
+                if os.path.exists(part):
+                    os.remove(part)
+            os.remove(source_path)
+
+    async def put(self, source_path: str, key: str):
+        with STORAGE_LATENCY.labels("local", "put").time():
+            await run_in_threadpool(self._put, source_path, key)
+
+    def _delete(self, key: str):
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+    async def delete(self, key: str):
+        with STORAGE_LATENCY.labels("local", "delete").time():
+            await run_in_threadpool(self._delete, key)
+
+    def _delete_older(self, key: str, cutoff: float) -> bool:
+        path = self.local_path(key)
+        # Moved aside before looking at it, so a put landing meanwhile makes
+        # a new file instead of being deleted along with the old one.
+        aside = f"{path}.{uuid.uuid4()}.deleting"
+        try:
+            os.rename(path, aside)
+        except FileNotFoundError:
+            return False
+        if os.stat(aside).st_mtime >= cutoff:
+            # Any put since has the same bytes, so either copy may stay.
+            os.replace(aside, path)
+            return False
+        os.remove(aside)
+        return True
+
+    async def delete_older(self, key: str, cutoff: float) -> bool:
+        with STORAGE_LATENCY.labels("local", "delete").time():
+            return await run_in_threadpool(self._delete_older, key, cutoff)
+
+    async def exists(self, key: str) -> bool:
+        return await run_in_threadpool(os.path.exists, self.local_path(key))
+
+
+class S3Storage(StorageBackend):
+    """Stores blobs as objects in an S3-compatible bucket.
+
+    Downloads are served by redirecting to a short-lived presigned URL, so
+    the bytes never pass through this service.
+    """
+
+    def __init__(self, bucket: str, prefix: str = "", endpoint_url=None, region=None):
+        try:
+            import boto3
+        except ImportError:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs the 'boto3' package installed")
+        if not bucket:
+            raise RuntimeError("STORAGE_BACKEND=s3 needs S3_BUCKET to be set")
+        self.bucket = bucket
+        self.prefix = prefix.strip("/")
+        # boto3 clients are thread-safe, so one is shared by the threadpool.
+        self._client = boto3.client("s3", endpoint_url=endpoint_url, region_name=region)
+
+    def _object(self, key: str) -> str:
+        return f"{self.prefix}/{key}" if self.prefix else key
+
+    def open_read(self, key: str):
+        response = self._client.get_object(Bucket=self.bucket, Key=self._object(key))
+        return response["Body"]
+
+    def _put(self, source_path: str, key: str):
+        # upload_file switches to parallel multipart uploads for large files.
+        self._client.upload_file(source_path, self.bucket, self._object(key))
+        os.remove(source_path)
+
+    async def put(self, source_path: str, key: str):
+        with STORAGE_LATENCY.labels("s3", "put").time():
+            await run_in_threadpool(self._put, source_path, key)
+
+    async def delete(self, key: str):
+        with STORAGE_LATENCY.labels("s3", "delete").time():
+            await run_in_threadpool(
+                self._client.delete_object, Bucket=self.bucket, Key=self._object(key)
+            )
+
+    def _delete_older(self, key: str, cutoff: float) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            head = self._client.head_object(Bucket=self.bucket, Key=self._object(key))
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        if head["LastModified"].timestamp() >= cutoff:
+            return False
+        # S3 has no conditional delete, so a put landing between the two
+        # requests is lost; the window is one round trip, not a whole upload.
+        self._client.delete_object(Bucket=self.bucket, Key=self._object(key))
+        return True
+
+    async def delete_older(self, key: str, cutoff: float) -> bool:
+        with STORAGE_LATENCY.labels("s3", "delete").time():
+            return await run_in_threadpool(self._delete_older, key, cutoff)
+
+    def _exists(self, key: str) -> bool:
+        from botocore.exceptions import ClientError
+
+        try:
+            self._client.head_object(Bucket=self.bucket, Key=self._object(key))
+        except ClientError as exc:
+            if exc.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return False
+            raise
+        return True
+
+    async def exists(self, key: str) -> bool:
+        return await run_in_threadpool(self._exists, key)
+
+    async def download_url(
+        self, key: str, filename: str, media_type: str, encoding: str | None = None
+    ) -> str:
+        params = {
+            "Bucket": self.bucket,
+            "Key": self._object(key),
+            "ResponseContentType": media_type,
+            "ResponseContentDisposition": content_disposition(filename),
+        }
+        if encoding:
+            params["ResponseContentEncoding"] = encoding
+        # Presigning is local computation, no request is made.
+        return self._client.generate_presigned_url(
+            "get_object", Params=params, ExpiresIn=S3_PRESIGN_TTL
+        )
+
+
+def create_storage() -> StorageBackend:
+    if STORAGE_BACKEND == "s3":
+        return S3Storage(S3_BUCKET, S3_PREFIX, S3_ENDPOINT_URL, S3_REGION)
+    if STORAGE_BACKEND == "local":
+        return LocalStorage(STORAGE_ROOT)
+    raise RuntimeError(f"Unknown STORAGE_BACKEND {STORAGE_BACKEND!r}")
+
+
+storage = create_storage()
@@ -0,0 +1,147 @@
+import hashlib
+import os
+import shutil
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, select
+from starlette.concurrency import run_in_threadpool
+
+from app.core.config import UPLOAD_CHUNK_SIZE, UPLOAD_DIR, UPLOAD_SESSION_TTL
+from app.core.database import SessionLocal
+from app.models.models import UploadSession
+from app.services.blobs import TEMP_DIR, StagedBlob
+from app.services.compression import Compressor, choose_encoding
+
+SESSION_DIR = os.path.join(UPLOAD_DIR, "sessions")
+
+
+def session_dir(session_id: str) -> str:
+    return os.path.join(SESSION_DIR, session_id)
+
+
+def chunk_path(session_id: str, index: int) -> str:
+    return os.path.join(session_dir(session_id), str(index))
+
+
+def chunk_length(upload: UploadSession, index: int) -> int:
+    if index < upload.chunk_count - 1:
+        return upload.chunk_size
+    return upload.file_size - upload.chunk_size * (upload.chunk_count - 1)
+
+
+def new_session(
+    user_id: int, filename: str, file_type: str, file_size: int, chunk_size: int
+):
+    upload = UploadSession(
+        id=str(uuid.uuid4()),
+        user_id=user_id,
+        filename=filename,
+        file_type=file_type,
+        file_size=file_size,
+        chunk_size=chunk_size,
+        chunk_count=-(-file_size // chunk_size),
+        status="open",
+        expires_at=datetime.now(timezone.utc) + timedelta(seconds=UPLOAD_SESSION_TTL),
+    )
+    os.makedirs(session_dir(upload.id), exist_ok=True)
+    return upload
+
+
+def received_chunks(session_id: str) -> list[int]:
+    try:
+        names = os.listdir(session_dir(session_id))
+    except FileNotFoundError:
+        return []
+    return sorted(int(name) for name in names if name.isdigit())
+
+
+def assemble(upload: UploadSession) -> StagedBlob:
+    """Concatenates the chunks into a temp file, hashing on the same pass.
+
+    Each chunk is read exactly once, and compressed on the way if the file
+    type calls for it.
+    """
+    temp_path = os.path.join(TEMP_DIR, str(uuid.uuid4()))
+    encoding = choose_encoding(upload.file_type)
+    compressor = Compressor(encoding) if encoding else None
+    digest = hashlib.sha256()
+    size = stored_size = 0
+    try:
+        with open(temp_path, "wb") as out:
+            for index in range(upload.chunk_count):
+                with open(chunk_path(upload.id, index), "rb") as chunk:
+                    while block := chunk.read(UPLOAD_CHUNK_SIZE):
+                        digest.update(block)
+                        size += len(block)
+                        if compressor is not None:
+                            block = compressor.compress(block)
+                        out.write(block)
+                        stored_size += len(block)
+            if compressor is not None:
+                tail = compressor.flush()
+                out.write(tail)
+                stored_size += len(tail)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+    return StagedBlob(
+        temp_path,
+        digest.hexdigest(),
+        size,
+        encoding,
+        stored_size if encoding else None,
+    )
+
+
+def discard(session_id: str):
+    shutil.rmtree(session_dir(session_id), ignore_errors=True)
+
+
+def _old_session_dirs(cutoff: float) -> list[str]:
+    """Session directories last changed before `cutoff` (a timestamp)."""
+    try:
+        entries = list(os.scandir(SESSION_DIR))
+    except FileNotFoundError:
+        return []
+    return [
+        entry.name
+        for entry in entries
+        if entry.is_dir(follow_symlinks=False)
+        and entry.stat(follow_symlinks=False).st_mtime < cutoff
+    ]
+
+
+async def purge_expired_sessions() -> int:
+    """Deletes expired sessions and their chunks; returns how many.
+
+    Directories whose row is already gone, left by a crash between the
+    delete and discard(), are removed too once they are older than
+    UPLOAD_SESSION_TTL, which no live session's directory can be.
+    """
+    now = datetime.now(timezone.utc)
+    async with SessionLocal() as db:
+        expired = list(
+            await db.scalars(
+                select(UploadSession.id).where(UploadSession.expires_at < now)
+            )
+        )
+        if expired:
+            await db.execute(delete(UploadSession).where(UploadSession.id.in_(expired)))
+            await db.commit()
+
+        old = await run_in_threadpool(
+            _old_session_dirs, now.timestamp() - UPLOAD_SESSION_TTL
+        )
+        live = set()
+        for start in range(0, len(old), 500):
+            batch = old[start : start + 500]
+            live.update(
+                await db.scalars(
+                    select(UploadSession.id).where(UploadSession.id.in_(batch))
+                )
+            )
+    abandoned = [session_id for session_id in old if session_id not in live]
+    for session_id in set(expired) | set(abandoned):
+        await run_in_threadpool(discard, session_id)
+    return len(set(expired) | set(abandoned))
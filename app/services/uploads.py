@@ -0,0 +1,265 @@
+import hashlib
+import os
+import time
+
+from fastapi import HTTPException, Request, status
+from python_multipart.multipart import MultipartParser, parse_options_header
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import ClientDisconnect
+
+from app.core.config import UPLOAD_CHUNK_SIZE
+from app.core.metrics import UPLOAD_BYTES, UPLOAD_STORED_BYTES, UPLOAD_THROUGHPUT
+from app.services.compression import Compressor, choose_encoding
+
+# OpenAPI description for endpoints that parse multipart bodies themselves,
+# so the docs still show a file picker.
+MULTIPART_FILE_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"],
+                }
+            }
+        },
+    }
+}
+
+MULTIPART_FILES_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "files": {
+                            "type": "array",
+                            "items": {"type": "string", "format": "binary"},
+                        }
+                    },
+                    "required": ["files"],
+                }
+            }
+        },
+    }
+}
+
+
+class FileSink:
+    """Writes an upload straight to its final path off the event loop.
+
+    Incoming chunks are coalesced into a buffer of at most UPLOAD_CHUNK_SIZE
+    bytes before each threadpool hop, and the size and SHA-256 are computed
+    on the same pass, so memory per upload stays bounded. Compressible
+    content types are compressed on that pass too; size and sha256 always
+    describe the original bytes.
+    """
+
+    def __init__(self, path: str, filename: str, content_type: str | None):
+        self.path = path
+        self.filename = filename
+        self.content_type = content_type or "application/octet-stream"
+        self.size = 0
+        self.sha256 = None
+        self.encoding = choose_encoding(self.content_type)
+        self.stored_size = 0 if self.encoding else None
+        self._compressor = Compressor(self.encoding) if self.encoding else None
+        self._hash = hashlib.sha256()
+        self._buffer = bytearray()
+        self._file = None
+        self._opened = None
+
+    async def open(self):
+        self._file = await run_in_threadpool(open, self.path, "wb")
+        self._opened = time.perf_counter()
+
+    async def write(self, data: bytes):
+        self._buffer += data
+        if len(self._buffer) >= UPLOAD_CHUNK_SIZE:
+            await self._flush()
+
+    async def close(self):
+        await self._flush()
+        await run_in_threadpool(self._finish)
+        self.sha256 = self._hash.hexdigest()
+        elapsed = time.perf_counter() - self._opened
+        UPLOAD_BYTES.inc(self.size)
+        UPLOAD_STORED_BYTES.inc(
+            self.size if self.stored_size is None else self.stored_size
+        )
+        if elapsed > 0:
+            UPLOAD_THROUGHPUT.observe(self.size / elapsed)
+
+    async def abort(self):
+        if self._file is not None:
+            await run_in_threadpool(self._discard)
+
+    async def _flush(self):
+        if not self._buffer:
+            return
+        chunk, self._buffer = self._buffer, bytearray()
+        await run_in_threadpool(self._write_chunk, chunk)
+
+    def _write_chunk(self, chunk: bytearray):
+        self._hash.update(chunk)
+        self.size += len(chunk)
+        if self._compressor is not None:
+            chunk = self._compressor.compress(chunk)
+            self.stored_size += len(chunk)
+        self._file.write(chunk)
+
+    def _finish(self):
+        if self._compressor is not None:
+            tail = self._compressor.flush()
+            self.stored_size += len(tail)
+            self._file.write(tail)
+        self._file.close()
+
+    def _discard(self):
+        self._file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+def _over_quota():
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail="Upload exceeds the remaining storage quota",
+    )
+
+
+async def _limited(request: Request, limit: int | None, too_large=_over_quota):
+    """The request body's chunks; raises too_large() once past `limit` bytes."""
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if limit is not None and received > limit:
+            raise too_large()
+        yield chunk
+
+
+async def receive_body(
+    request: Request, sink: FileSink, limit: int | None = None, too_large=_over_quota
+) -> FileSink:
+    await sink.open()
+    try:
+        async for chunk in _limited(request, limit, too_large):
+            await sink.write(chunk)
+        await sink.close()
+    except BaseException as exc:
+        await sink.abort()
+        if isinstance(exc, ClientDisconnect):
+            raise _interrupted()
+        raise
+    return sink
+
+
+def _interrupted():
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST, detail="Upload was interrupted"
+    )
+
+
+async def receive_multipart(
+    request: Request, open_sink, field_name: str = "file", limit: int | None = None
+):
+    """Streams every file part named `field_name` of a multipart body.
+
+    `open_sink(filename, content_type)` is called at the start of each file
+    part and must return an unopened FileSink. Other form fields are skipped.
+    A body longer than `limit` bytes is refused with 413.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type"))
+    boundary = params.get(b"boundary")
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Expected a multipart/form-data body",
+        )
+
+    events = []
+    header_field = bytearray()
+    header_value = bytearray()
+    headers = {}
+
+    def on_part_begin():
+        headers.clear()
+
+    def on_header_field(data, start, end):
+        header_field.extend(data[start:end])
+
+    def on_header_value(data, start, end):
+        header_value.extend(data[start:end])
+
+    def on_header_end():
+        headers[bytes(header_field).lower()] = bytes(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished():
+        events.append(("headers", dict(headers)))
+
+    def on_part_data(data, start, end):
+        events.append(("data", data[start:end]))
+
+    def on_part_end():
+        events.append(("end", None))
+
+    parser = MultipartParser(
+        boundary,
+        {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+        },
+    )
+
+    sinks = []
+    current = None
+    try:
+        async for chunk in _limited(request, limit):
+            parser.write(chunk)
+            for event, payload in events:
+                if event == "headers":
+                    _, disposition = parse_options_header(
+                        payload.get(b"content-disposition")
+                    )
+                    name = disposition.get(b"name", b"").decode()
+                    filename = disposition.get(b"filename")
+                    if name == field_name and filename:
+                        current = open_sink(
+                            filename.decode(),
+                            payload.get(b"content-type", b"").decode() or None,
+                        )
+                        await current.open()
+                        sinks.append(current)
+                elif event == "data" and current is not None:
+                    await current.write(payload)
+                elif event == "end" and current is not None:
+                    await current.close()
+                    current = None
+            events.clear()
+        parser.finalize()
+        if current is not None:
+            # The body ended inside a file part, before its boundary.
+            raise _interrupted()
+    except BaseException as exc:
+        for sink in sinks:
+            await sink.abort()
+        if isinstance(exc, ClientDisconnect):
+            raise _interrupted()
+        raise
+
+    if not sinks:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="No file provided"
+        )
+    return sinks
@@ -0,0 +1,214 @@
+from collections import defaultdict
+
+from fastapi import HTTPException, Request, status
+from sqlalchemy import func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import STORAGE_QUOTA_BYTES
+from app.core.database import SessionLocal
+from app.models.models import FileManage, UserUsage, Users
+
+# Bytes of a multipart body not counted against the quota up front.
+MULTIPART_ALLOWANCE = 64 * 1024
+
+# Effective quota in SQL; 0 (or less) means unlimited.
+_LIMIT = func.coalesce(UserUsage.quota_bytes, STORAGE_QUOTA_BYTES)
+
+
+def quota_for(usage: UserUsage | None) -> int | None:
+    """The user's quota in bytes, or None if unlimited."""
+    limit = STORAGE_QUOTA_BYTES
+    if usage is not None and usage.quota_bytes is not None:
+        limit = usage.quota_bytes
+    return limit if limit > 0 else None
+
+
+def _quota_exceeded(quota: int) -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"Storage quota of {quota} bytes exceeded",
+    )
+
+
+async def _count_files(db: AsyncSession, user_id: int) -> tuple[int, int]:
+    row = (
+        await db.execute(
+            select(
+                func.coalesce(func.sum(FileManage.file_size), 0), func.count()
+            ).where(FileManage.user_id == user_id)
+        )
+    ).one()
+    return int(row[0]), row[1]
+
+
+async def get_usage(db: AsyncSession, user_id: int) -> UserUsage:
+    """The user's usage row, or an unsaved one computed from their files.
+
+    Rows are created at registration and by repair_usage, so the fallback
+    only runs for accounts that predate usage tracking.
+    """
+    usage = await db.get(UserUsage, user_id)
+    if usage is None:
+        bytes_used, file_count = await _count_files(db, user_id)
+        usage = UserUsage(user_id=user_id, bytes_used=bytes_used, file_count=file_count)
+    return usage
+
+
+async def check_quota(db: AsyncSession, user_id: int, size: int):
+    """Raises 413 if `size` more bytes would put the user over quota."""
+    usage = await get_usage(db, user_id)
+    quota = quota_for(usage)
+    if quota is not None and usage.bytes_used + size > quota:
+        raise _quota_exceeded(quota)
+
+
+async def check_upload_quota(
+    db: AsyncSession, user_id: int, request: Request
+) -> int | None:
+    """Rejects an upload by its declared Content-Length before it streams.
+
+    Returns the most body bytes the upload may send, or None if the user has
+    no quota, so bodies without a Content-Length are stopped as they arrive.
+    """
+    usage = await get_usage(db, user_id)
+    quota = quota_for(usage)
+    if quota is None:
+        return None
+    allowance = 0
+    if request.headers.get("content-type", "").startswith("multipart/"):
+        # Allow for part headers and boundaries so uploads that just fit
+        # aren't refused; charge_usage enforces the exact quota at commit.
+        allowance = MULTIPART_ALLOWANCE
+    try:
+        declared = int(request.headers.get("content-length") or 0)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid Content-Length"
+        )
+    if usage.bytes_used + max(0, declared - allowance) > quota:
+        raise _quota_exceeded(quota)
+    return max(0, quota - usage.bytes_used) + allowance
+
+
+def _totals(rows) -> dict:
+    totals = defaultdict(lambda: [0, 0])
+    for row in rows:
+        totals[row.user_id][0] += row.file_size
+        totals[row.user_id][1] += 1
+    return totals
+
+
+async def check_rows_quota(db: AsyncSession, rows):
+    for user_id, (size, _) in _totals(rows).items():
+        await check_quota(db, user_id, size)
+
+
+async def charge_usage(db: AsyncSession, rows):
+    """Adds new file rows to their owners' usage in the caller's transaction.
+
+    The update only applies while the result stays within quota, so
+    concurrent uploads can't overshoot it; raises 413 otherwise.
+    """
+    for user_id, (size, count) in _totals(rows).items():
+        result = await db.execute(
+            update(UserUsage)
+            .where(
+                UserUsage.user_id == user_id,
+                or_(_LIMIT <= 0, UserUsage.bytes_used + size <= _LIMIT),
+            )
+            .values(
+                bytes_used=UserUsage.bytes_used + size,
+                file_count=UserUsage.file_count + count,
+            )
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            continue
+        usage = await db.get(UserUsage, user_id)
+        if usage is not None:
+            raise _quota_exceeded(quota_for(usage))
+        # First upload of an account from before usage tracking.
+        usage = await get_usage(db, user_id)
+        quota = quota_for(usage)
+        if quota is not None and usage.bytes_used + size > quota:
+            raise _quota_exceeded(quota)
+        usage.bytes_used += size
+        usage.file_count += count
+        db.add(usage)
+
+
+async def release_usage(db: AsyncSession, user_id: int, size: int, count: int):
+    """Takes deleted files off the user's usage in the caller's transaction."""
+    await db.execute(
+        update(UserUsage)
+        .where(UserUsage.user_id == user_id)
+        .values(
+            bytes_used=UserUsage.bytes_used - size,
+            file_count=UserUsage.file_count - count,
+        )
+        .execution_options(synchronize_session=False)
+    )
+
+
+async def repair_usage(batch_size: int = 500) -> tuple[int, int]:
+    """Recomputes every user's usage from their files, in batches of users.
+
+    Each batch locks its usage rows (on Postgres) before counting, so
+    uploads and deletes committing meanwhile are not lost. Returns the
+    number of users checked and the number whose usage had drifted.
+    """
+    checked = drifted = 0
+    last = 0
+    while True:
+        async with SessionLocal() as db:
+            user_ids = (
+                await db.scalars(
+                    select(Users.id)
+                    .where(Users.id > last)
+                    .order_by(Users.id)
+                    .limit(batch_size)
+                )
+            ).all()
+            if not user_ids:
+                return checked, drifted
+            last = user_ids[-1]
+
+            current = {
+                usage.user_id: usage
+                for usage in await db.scalars(
+                    select(UserUsage)
+                    .where(UserUsage.user_id.in_(user_ids))
+                    .order_by(UserUsage.user_id)
+                    .with_for_update()
+                )
+            }
+            actual = {
+                row.user_id: (int(row.bytes_used), row.file_count)
+                for row in await db.execute(
+                    select(
+                        FileManage.user_id,
+                        func.sum(FileManage.file_size).label("bytes_used"),
+                        func.count().label("file_count"),
+                    )
+                    .where(FileManage.user_id.in_(user_ids))
+                    .group_by(FileManage.user_id)
+                )
+            }
+            for user_id in user_ids:
+                bytes_used, file_count = actual.get(user_id, (0, 0))
+                usage = current.get(user_id)
+                if usage is None:
+                    db.add(
+                        UserUsage(
+                            user_id=user_id,
+                            bytes_used=bytes_used,
+                            file_count=file_count,
+                        )
+                    )
+                    drifted += 1
+                elif (usage.bytes_used, usage.file_count) != (bytes_used, file_count):
+                    usage.bytes_used = bytes_used
+                    usage.file_count = file_count
+                    drifted += 1
+            checked += len(user_ids)
+            await db.commit()
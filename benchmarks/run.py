@@ -0,0 +1,659 @@
+"""Load and benchmark suite for the API.
+
+Starts the app with `python -m app.server` against each target database,
+seeds it, drives a fixed, seeded mix of requests and writes the results,
+along with import and startup times, as JSON:
+
+    python -m benchmarks.run
+    python -m benchmarks.run --postgres postgresql://bench@localhost/bench
+    python -m benchmarks.run --profile full --save-baseline
+
+SQLite always runs; Postgres runs when --postgres or BENCH_POSTGRES_URL is
+set and is skipped if it can't be reached. It must be a throwaway database,
+since its tables are dropped. When the baseline file exists the results are
+compared against it and the exit status is 1 if any scenario or startup
+time regressed.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, "benchmarks", "baseline.json")
+RESULTS = os.path.join(ROOT, "benchmarks", "results.json")
+PASSWORD = "bench-password"
+KIB = 1024
+MIB = 1024 * KIB
+
+# Startup times are short enough that scheduling noise outweighs a relative
+# threshold, so they may also grow by this many seconds before regressing.
+STARTUP_SLACK = 0.1
+
+PROFILES = {
+    "quick": {
+        "users": 50,
+        "accounts": [10_000],
+        "logins": 100,
+        "registers": 20,
+        "uploads": {
+            "small": (4 * KIB, 200),
+            "medium": (1 * MIB, 40),
+            "large": (16 * MIB, 4),
+        },
+        "downloads": 100,
+        "ranges": 200,
+        "list_requests": 50,
+        "import_runs": 5,
+        "concurrency": 16,
+    },
+    "full": {
+        "users": 500,
+        "accounts": [10_000, 100_000, 1_000_000],
+        "logins": 1000,
+        "registers": 200,
+        "uploads": {
+            "small": (4 * KIB, 2000),
+            "medium": (1 * MIB, 200),
+            "large": (64 * MIB, 10),
+        },
+        "downloads": 500,
+        "ranges": 2000,
+        "list_requests": 200,
+        "import_runs": 15,
+        "concurrency": 64,
+    },
+}
+
+
+def percentile(values: list, p: float) -> float:
+    # Nearest rank on sorted values.
+    if not values:
+        return 0.0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+class Samples:
+    def __init__(self):
+        self.latencies = []
+        self.errors = 0
+        self.rejected = 0
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def summary(self) -> dict:
+        latencies = sorted(self.latencies)
+        ok = len(latencies) - self.errors - self.rejected
+        result = {
+            "requests": len(latencies),
+            "errors": self.errors,
+            "rejected": self.rejected,
+            "seconds": round(self.seconds, 3),
+            "throughput_rps": round(ok / self.seconds, 2) if self.seconds else 0.0,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+            "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        }
+        if self.bytes:
+            result["mb_per_s"] = round(self.bytes / MIB / self.seconds, 2)
+        return result
+
+
+async def drive(client: httpx.AsyncClient, prepare, count: int, concurrency: int):
+    """Sends `count` requests from `concurrency` workers and times each one.
+
+    `prepare(index)` returns the request and the bytes it uploads; it runs
+    outside the timed section. 503s are counted as rejected, not as errors.
+    """
+    samples = Samples()
+    next_index = 0
+
+    async def worker():
+        nonlocal next_index
+        while next_index < count:
+            index = next_index
+            next_index += 1
+            request, sent = prepare(index)
+            start = time.perf_counter()
+            try:
+                response = await client.send(request)
+            except httpx.HTTPError:
+                samples.latencies.append(time.perf_counter() - start)
+                samples.errors += 1
+                continue
+            samples.latencies.append(time.perf_counter() - start)
+            if response.status_code == 503:
+                samples.rejected += 1
+            elif response.status_code >= 400:
+                samples.errors += 1
+            else:
+                samples.bytes += sent + len(response.content)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, count))))
+    samples.seconds = time.perf_counter() - start
+    return samples
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _proc_status(pid: int, field: str) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) * KIB
+    except FileNotFoundError:
+        pass  # exited meanwhile
+    return 0
+
+
+def _descendants(pid: int) -> list:
+    pids = [pid]
+    for task in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{task}/children") as children:
+                for child in children.read().split():
+                    pids.extend(_descendants(int(child)))
+        except FileNotFoundError:
+            pass
+    return pids
+
+
+class Server:
+    """The app under app.server in a subprocess, logging to the work directory."""
+
+    def __init__(self, env: dict, workdir: str, workers: int):
+        self.env = env
+        self.workers = workers
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.log_path = os.path.join(workdir, "server.log")
+        self.process = None
+        self.ready_seconds = None
+        self._log = None
+
+    def start(self, timeout: float = 60):
+        self._log = open(self.log_path, "wb")
+        started = time.monotonic()
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "app.server",
+                "--host",
+                "127.0.0.1",
+                "--port",
+                str(self.port),
+                "--workers",
+                str(self.workers),
+            ],
+            cwd=ROOT,
+            env=self.env,
+            stdout=self._log,
+            stderr=subprocess.STDOUT,
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"server exited, see {self.log_path}")
+            try:
+                if httpx.get(f"{self.url}/health/db", timeout=1).status_code == 200:
+                    self.ready_seconds = time.monotonic() - started
+                    return
+            except httpx.HTTPError:
+                pass
+            time.sleep(0.2)
+        self.stop()
+        raise RuntimeError(f"server did not start in {timeout}s, see {self.log_path}")
+
+    def peak_rss_mb(self) -> float | None:
+        """High-water RSS of the server and its workers (Linux only)."""
+        try:
+            pids = _descendants(self.process.pid)
+            return round(sum(_proc_status(pid, "VmHWM") for pid in pids) / MIB, 1)
+        except OSError:
+            return None
+
+    def stop(self):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+        self._log.close()
+
+
+def startup_times(server: Server, env: dict, runs: int) -> dict:
+    """Import time of app.main in fresh interpreters, and the server's startup.
+
+    ready_s runs from spawning the server to its first healthy response;
+    worker_import_s and lifespan_s are what the answering worker reports.
+    """
+    imports = []
+    for _ in range(runs):
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import time; t = time.perf_counter(); import app.main;"
+                " print(time.perf_counter() - t)",
+            ],
+            cwd=ROOT,
+            env=env,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        imports.append(float(result.stdout.strip().splitlines()[-1]))
+    reported = httpx.get(f"{server.url}/health/startup", timeout=5).json()
+    return {
+        "import_s": round(percentile(imports, 50), 3),
+        "ready_s": round(server.ready_seconds, 3),
+        "worker_import_s": round(reported["import_seconds"], 3),
+        "lifespan_s": round(reported["lifespan_seconds"], 3),
+    }
+
+
+def seed(env: dict, profile: dict) -> dict:
+    accounts = ",".join(str(rows) for rows in profile["accounts"])
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.seed",
+            "--users",
+            str(profile["users"]),
+            "--accounts",
+            accounts,
+            "--password",
+            PASSWORD,
+        ],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        lines = result.stderr.strip().splitlines() or ["seeding failed"]
+        raise RuntimeError(lines[-1])
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+async def _login(client: httpx.AsyncClient, email: str) -> dict:
+    response = await client.post(
+        "/auth/login", json={"email": email, "password": PASSWORD}
+    )
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def run_scenarios(server: Server, seeded: dict, profile: dict, args) -> dict:
+    results = {}
+    rng = random.Random(args.seed)
+    concurrency = args.concurrency or profile["concurrency"]
+
+    async with httpx.AsyncClient(
+        base_url=server.url,
+        timeout=300,
+        limits=httpx.Limits(max_connections=concurrency),
+    ) as client:
+
+        async def run(name, prepare, count):
+            samples = await drive(client, prepare, count, concurrency)
+            results[name] = {**samples.summary(), "peak_rss_mb": server.peak_rss_mb()}
+            report(name, results[name])
+
+        users = seeded["users"]
+        # Untimed logins first, so starting the hashing processes isn't
+        # counted against the login storm.
+        await asyncio.gather(*(_login(client, email) for email in users[:concurrency]))
+        await run(
+            "login",
+            lambda i: (
+                client.build_request(
+                    "POST",
+                    "/auth/login",
+                    json={"email": users[i % len(users)], "password": PASSWORD},
+                ),
+                0,
+            ),
+            profile["logins"],
+        )
+        await run(
+            "register",
+            lambda i: (
+                client.build_request(
+                    "POST",
+                    "/auth/register",
+                    json={
+                        "first_name": "New",
+                        "last_name": "User",
+                        "email": f"new{i}@bench.example",
+                        "password": PASSWORD,
+                        "confirm_password": PASSWORD,
+                    },
+                ),
+                0,
+            ),
+            profile["registers"],
+        )
+
+        headers = await _login(client, seeded["uploader"])
+        uploaded = []
+        for label, (size, count) in profile["uploads"].items():
+            template = rng.randbytes(size)
+
+            def upload(i, label=label, template=template):
+                # A distinct prefix per file keeps deduplication out of it.
+                payload = i.to_bytes(8, "big") + template[8:]
+                files = {
+                    "file": (f"{label}-{i}.bin", payload, "application/octet-stream")
+                }
+                request = client.build_request(
+                    "POST", "/files/upload", headers=headers, files=files
+                )
+                return request, len(payload)
+
+            await run(f"upload_{label}", upload, count)
+            uploaded.extend((f"{label}-{i}.bin", size) for i in range(count))
+
+        picks = [rng.choice(uploaded) for _ in range(profile["downloads"])]
+        await run(
+            "download_full",
+            lambda i: (
+                client.build_request(
+                    "GET", f"/files/download/{picks[i][0]}", headers=headers
+                ),
+                0,
+            ),
+            len(picks),
+        )
+        ranges = []
+        for _ in range(profile["ranges"]):
+            name, size = rng.choice(uploaded)
+            start = rng.randrange(max(1, size - 64 * KIB))
+            ranges.append((name, f"bytes={start}-{start + 64 * KIB - 1}"))
+        await run(
+            "download_range",
+            lambda i: (
+                client.build_request(
+                    "GET",
+                    f"/files/download/{ranges[i][0]}",
+                    headers={**headers, "Range": ranges[i][1]},
+                ),
+                0,
+            ),
+            len(ranges),
+        )
+
+        for rows, email in seeded["accounts"].items():
+            await list_scenarios(client, run, rows, email, profile["list_requests"])
+    return results
+
+
+async def list_scenarios(client, run, rows: str, email: str, count: int):
+    headers = await _login(client, email)
+
+    def listing(params, path="/files/list"):
+        return lambda i: (
+            client.build_request("GET", path, headers=headers, params=params(i)),
+            0,
+        )
+
+    # Collect cursors spread over the account to time deep pages with.
+    cursors = []
+    cursor = None
+    step = max(1, int(rows) // 100 // count)
+    for page in range(count * step):
+        params = {"limit": 100, **({"cursor": cursor} if cursor else {})}
+        response = await client.get("/files/list", headers=headers, params=params)
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+        if page % step == step - 1:
+            cursors.append(cursor)
+    cursors = cursors or [None]
+
+    await run(f"list_first_page[{rows}]", listing(lambda i: {"limit": 100}), count)
+    await run(
+        f"list_deep_page[{rows}]",
+        listing(lambda i: {"limit": 100, "cursor": cursors[i % len(cursors)]}),
+        count,
+    )
+    await run(
+        f"list_by_size[{rows}]",
+        listing(lambda i: {"limit": 100, "sort": "file_size", "order": "asc"}),
+        count,
+    )
+    await run(
+        f"list_search[{rows}]",
+        listing(lambda i: {"filename": f"{i % 1000:03d}", "limit": 100}),
+        count,
+    )
+    await run(
+        f"search_ranked[{rows}]",
+        listing(
+            lambda i: {"q": f"report {i % 1000:03d}", "limit": 20},
+            path="/files/search",
+        ),
+        count,
+    )
+    await run(
+        f"list_total[{rows}]",
+        listing(lambda i: {"limit": 1, "include_total": "true"}),
+        count,
+    )
+    # Each request streams the whole account.
+    await run(
+        f"export[{rows}]",
+        listing(lambda i: {}, path="/files/export"),
+        max(1, count // 10),
+    )
+
+
+def report(name: str, result: dict):
+    print(
+        f"  {name:<28} {result['throughput_rps']:>9.1f} req/s"
+        f"  p50 {result['p50_ms']:>8.1f}  p95 {result['p95_ms']:>8.1f}"
+        f"  p99 {result['p99_ms']:>8.1f} ms"
+        f"  err {result['errors']}  503 {result['rejected']}"
+        f"  rss {result['peak_rss_mb']} MiB",
+        flush=True,
+    )
+
+
+def run_target(name: str, url: str, profile: dict, args) -> tuple[dict, dict]:
+    workdir = tempfile.mkdtemp(prefix=f"bench-{name}-")
+    if url is None:
+        url = f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    env = {
+        **os.environ,
+        "DATABASE_URL": url,
+        "UPLOAD_DIR": os.path.join(workdir, "uploads"),
+        "SECRET_KEY": os.environ.get("SECRET_KEY", "benchmark-secret"),
+        "ALGORITHM": os.environ.get("ALGORITHM", "HS256"),
+        # Nothing listens here, so verification emails fail fast and retry.
+        "MAIL_SERVER": "127.0.0.1",
+        "MAIL_PORT": str(free_port()),
+        "MAIL_SSL_TLS": "false",
+        # Every simulated client shares one IP.
+        "RATE_LIMITS": "",
+    }
+    server = Server(env, workdir, args.workers)
+    try:
+        print(f"{name}: seeding", flush=True)
+        seeded = seed(env, profile)
+        server.start()
+        startup = startup_times(server, env, profile["import_runs"])
+        print(
+            f"{name}: running against {server.url}, ready in"
+            f" {startup['ready_s']} s, app.main imports in {startup['import_s']} s",
+            flush=True,
+        )
+        return asyncio.run(run_scenarios(server, seeded, profile, args)), startup
+    finally:
+        server.stop()
+        if args.keep:
+            print(f"{name}: kept {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _git_commit() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Lists scenarios slower than the baseline by more than `threshold`."""
+    regressions = []
+    for target, scenarios in results["targets"].items():
+        for name, current in scenarios.items():
+            base = baseline["targets"].get(target, {}).get(name)
+            if base is None:
+                continue
+            label = f"{target}/{name}"
+            if current["throughput_rps"] < base["throughput_rps"] * (1 - threshold):
+                regressions.append(
+                    f"{label}: throughput {current['throughput_rps']} req/s,"
+                    f" baseline {base['throughput_rps']}"
+                )
+            if current["p95_ms"] > base["p95_ms"] * (1 + threshold):
+                regressions.append(
+                    f"{label}: p95 {current['p95_ms']} ms, baseline {base['p95_ms']}"
+                )
+            if current["errors"] > base["errors"]:
+                regressions.append(
+                    f"{label}: {current['errors']} errors, baseline {base['errors']}"
+                )
+    for target, current in results["startup"].items():
+        base = baseline.get("startup", {}).get(target)
+        if base is None:
+            continue
+        for key in ("import_s", "ready_s"):
+            if current[key] > base[key] * (1 + threshold) + STARTUP_SLACK:
+                regressions.append(
+                    f"{target}/startup: {key} {current[key]} s, baseline {base[key]}"
+                )
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    parser.add_argument("--profile", choices=PROFILES, default="quick")
+    parser.add_argument(
+        "--postgres",
+        default=os.getenv("BENCH_POSTGRES_URL"),
+        metavar="URL",
+        help="throwaway Postgres database to benchmark as well",
+    )
+    parser.add_argument("--concurrency", type=int, help="overrides the profile's")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="server worker processes"
+    )
+    parser.add_argument("--seed", type=int, default=1, help="random seed")
+    parser.add_argument("--out", default=RESULTS, help="where to write results")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="store these results as the baseline instead of comparing",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.2,
+        help="allowed relative slowdown before a scenario counts as regressed",
+    )
+    parser.add_argument("--keep", action="store_true", help="keep work directories")
+    args = parser.parse_args(argv)
+
+    profile = PROFILES[args.profile]
+    targets = {"sqlite": None}
+    if args.postgres:
+        targets["postgres"] = args.postgres
+
+    results = {
+        "meta": {
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "profile": args.profile,
+            "seed": args.seed,
+            "concurrency": args.concurrency or profile["concurrency"],
+            "workers": args.workers,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+        },
+        "targets": {},
+        "startup": {},
+        "skipped": {},
+    }
+    for name, url in targets.items():
+        try:
+            results["targets"][name], results["startup"][name] = run_target(
+                name, url, profile, args
+            )
+        except RuntimeError as exc:
+            print(f"{name}: skipped, {exc}")
+            results["skipped"][name] = str(exc)
+
+    with open(args.out, "w") as out:
+        json.dump(results, out, indent=2)
+    print(f"results written to {args.out}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as out:
+            json.dump(results, out, indent=2)
+        print(f"baseline saved to {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["meta"]["profile"] != args.profile:
+        print(
+            f"baseline is for the {baseline['meta']['profile']!r} profile, not compared"
+        )
+        return 0
+    regressions = compare(results, baseline, args.threshold)
+    for regression in regressions:
+        print("REGRESSION", regression)
+    if not regressions:
+        print(f"no regressions against {args.baseline}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
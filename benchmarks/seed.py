@@ -0,0 +1,87 @@
+import argparse
+import asyncio
+import json
+
+from sqlalchemy import insert
+
+from app.core.database import engine
+from app.core.passwords import pwd_context
+from app.models.models import FileManage, Users
+from app.models.schema import create_schema
+
+FILE_TYPES = ("text/plain", "application/pdf", "image/png", "application/json")
+
+
+def _user(email: str, hashed: str) -> dict:
+    return {
+        "first_name": "Bench",
+        "last_name": "User",
+        "email": email,
+        "hashed_password": hashed,
+        "is_active": True,
+        "is_verified": True,
+    }
+
+
+async def seed(users: int, accounts: list[int], password: str, batch_size: int):
+    """Recreates the schema and fills it with benchmark users and files.
+
+    Every table in the target database is dropped first.
+    """
+    await create_schema(drop=True)
+
+    # One hash for everyone: seeding shouldn't spend minutes in bcrypt.
+    hashed = pwd_context.hash(password)
+    seeded = {"users": [], "accounts": {}}
+    async with engine.begin() as conn:
+        emails = [f"login{n}@bench.example" for n in range(users)]
+        emails.append("uploader@bench.example")
+        await conn.execute(insert(Users), [_user(email, hashed) for email in emails])
+        seeded["users"] = emails[:-1]
+        seeded["uploader"] = emails[-1]
+
+    for rows in accounts:
+        email = f"list{rows}@bench.example"
+        async with engine.begin() as conn:
+            user_id = (
+                await conn.execute(
+                    insert(Users).values(**_user(email, hashed)).returning(Users.id)
+                )
+            ).scalar_one()
+        for start in range(0, rows, batch_size):
+            async with engine.begin() as conn:
+                await conn.execute(
+                    insert(FileManage),
+                    [
+                        {
+                            "user_id": user_id,
+                            "filename": f"report-{n:07d}.dat",
+                            "stored_filename": f"report-{n:07d}.dat",
+                            "file_type": FILE_TYPES[n % len(FILE_TYPES)],
+                            "file_size": 1024 + n % 65536,
+                            "path": "seed",
+                            "download_count": 0,
+                        }
+                        for n in range(start, min(start + batch_size, rows))
+                    ],
+                )
+        seeded["accounts"][str(rows)] = email
+    await engine.dispose()
+    return seeded
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.seed")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--accounts", default="10000")
+    parser.add_argument("--password", default="bench-password")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args(argv)
+    accounts = [int(rows) for rows in args.accounts.split(",") if rows]
+    seeded = asyncio.run(seed(args.users, accounts, args.password, args.batch_size))
+    # The runner reads this line to learn what was created.
+    print(json.dumps(seeded))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import asyncio
+import os
+import socket
+import tempfile
+import uuid
+
+# Settings are read when app.core.config is imported, so they go in first.
+TEST_ROOT = tempfile.mkdtemp(prefix="file-management-tests-")
+with socket.socket() as probe:
+    probe.bind(("127.0.0.1", 0))
+    SMTP_PORT = probe.getsockname()[1]
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{TEST_ROOT}/app.db",
+    SECRET_KEY="test-secret",
+    ALGORITHM="HS256",
+    UPLOAD_DIR=os.path.join(TEST_ROOT, "uploads"),
+    MAIL_USERNAME="test",
+    MAIL_PASSWORD="test",
+    MAIL_FROM="noreply@example.com",
+    MAIL_SERVER="127.0.0.1",
+    MAIL_PORT=str(SMTP_PORT),
+    MAIL_SSL_TLS="false",
+    MAIL_USE_CREDENTIALS="false",
+    # The outbox tests deliver by hand; the app's sender only runs when woken.
+    MAIL_POLL_INTERVAL="3600",
+    FILE_JOBS_IN_APP="false",
+    RATE_LIMITS="",
+    BCRYPT_ROUNDS="4",
+    PASSWORD_HASH_WORKERS="1",
+)
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.database import SessionLocal, engine
+from app.core.security import create_access_token
+from app.main import app
+from app.models.models import Users
+from app.models.schema import create_schema
+
+
+async def _create_schema():
+    try:
+        await create_schema(drop=True)
+    finally:
+        # The app's event loop opens its own connections.
+        await engine.dispose()
+
+
+@pytest.fixture(scope="session")
+def client():
+    # Before startup, so the app's background loops find their tables.
+    asyncio.run(_create_schema())
+    with TestClient(app) as client:
+        yield client
+
+
+@pytest.fixture
+def run(client):
+    """Runs a coroutine function on the app's event loop."""
+    return client.portal.call
+
+
+async def _create_user(email: str) -> int:
+    async with SessionLocal() as db:
+        user = Users(
+            first_name="Test",
+            last_name="User",
+            email=email,
+            hashed_password="!",
+            is_verified=True,
+        )
+        db.add(user)
+        await db.commit()
+        return user.id
+
+
+@pytest.fixture
+def make_user(run):
+    """Creates users with their auth headers; each test gets fresh ones, so
+    caches and quotas never carry over."""
+
+    def make():
+        email = f"{uuid.uuid4().hex}@example.com"
+        user_id = run(_create_user, email)
+        token = create_access_token({"sub": email, "id": user_id})
+        return {
+            "id": user_id,
+            "email": email,
+            "headers": {"Authorization": f"Bearer {token}"},
+        }
+
+    return make
+
+
+@pytest.fixture
+def user(make_user):
+    return make_user()
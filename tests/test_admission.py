@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from app.core import admission
+from app.core.admission import AdmissionMiddleware, LocalAdmission
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    monkeypatch.setattr(admission, "UPLOAD_INFLIGHT_BYTES", 1000)
+    monkeypatch.setattr(admission, "UPLOAD_UNKNOWN_LENGTH_BYTES", 100)
+    monkeypatch.setattr(admission, "ROUTE_CONCURRENCY", {})
+    return LocalAdmission(100)
+
+
+def _upload(backend, chunks, headers=()):
+    """Sends `chunks` as an upload body; returns the bytes held after each."""
+    held = []
+
+    async def app(scope, receive, send):
+        held.append(backend._in_use["upload-bytes"])
+        while True:
+            message = await receive()
+            held.append(backend._in_use["upload-bytes"])
+            if not message["more_body"]:
+                break
+        await send({"type": "http.response.start", "status": 201, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    messages = [
+        {"type": "http.request", "body": chunk, "more_body": i < len(chunks) - 1}
+        for i, chunk in enumerate(chunks)
+    ]
+
+    async def receive():
+        return messages.pop(0)
+
+    async def send(message):
+        pass
+
+    scope = {
+        "type": "http",
+        "method": "PUT",
+        "path": "/files/upload/data.bin",
+        "client": ("127.0.0.1", 1234),
+        "headers": list(headers),
+    }
+    asyncio.run(AdmissionMiddleware(app, backend)(scope, receive, send))
+    return held
+
+
+def test_declared_length_is_held(backend):
+    held = _upload(backend, [b"x" * 60] * 3, [(b"content-length", b"180")])
+    assert held == [180, 180, 180, 180]
+    assert backend._in_use["upload-bytes"] == 0
+
+
+def test_unknown_length_is_charged_then_settled(backend):
+    held = _upload(backend, [b"x" * 60] * 3)
+    # Charged the default up front, grown past it, then the real size.
+    assert held == [100, 100, 220, 180]
+    assert backend._in_use["upload-bytes"] == 0
+
+
+def test_unknown_length_waits_for_budget(backend):
+    # 100 bytes are charged even though the body's size isn't known yet.
+    backend._in_use["upload-bytes"] = 950
+    assert _upload(backend, [b"x"]) == []
+    assert backend._in_use["upload-bytes"] == 950
@@ -0,0 +1,144 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+from jose import jwt
+from passlib.hash import bcrypt
+from sqlalchemy import select, update
+
+from app.core.config import ALGORITHM, BCRYPT_ROUNDS, SECRET_KEY
+from app.core.database import SessionLocal
+from app.core.passwords import PasswordHasher, password_hasher, pwd_context
+from app.core.security import create_verification_token
+from app.models.models import Users
+from app.services.principals import get_principal
+
+
+def test_token_without_exp(client, user):
+    token = jwt.encode(
+        {"sub": user["email"], "id": user["id"]}, SECRET_KEY, algorithm=ALGORITHM
+    )
+    response = client.get("/files/usage", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+
+
+def test_invalid_token(client):
+    response = client.get("/files/usage", headers={"Authorization": "Bearer nope"})
+    assert response.status_code == 401
+
+
+def test_password_reset_revokes_tokens(client, user):
+    # Cached before the reset, so revocation must get past the cache too.
+    assert client.get("/files/usage", headers=user["headers"]).status_code == 200
+
+    reset = client.post("/auth/reset_password", json={"email": user["email"]})
+    assert reset.status_code == 200
+    confirm = client.post(
+        "/auth/confirm_password_reset",
+        json={
+            "token": reset.json()["token"],
+            "new_password": "n3w-Password!",
+            "confirm_password": "n3w-Password!",
+        },
+    )
+    assert confirm.status_code == 200
+
+    assert client.get("/files/usage", headers=user["headers"]).status_code == 401
+
+    login = client.post(
+        "/auth/login", json={"email": user["email"], "password": "n3w-Password!"}
+    )
+    assert login.status_code == 200
+    token = login.json()["access_token"]
+    response = client.get("/files/usage", headers={"Authorization": f"Bearer {token}"})
+    assert response.status_code == 200
+
+
+async def _set_password_hash(user_id, hashed):
+    async with SessionLocal() as db:
+        await db.execute(
+            update(Users).where(Users.id == user_id).values(hashed_password=hashed)
+        )
+        await db.commit()
+
+
+async def _set_verified(user_id, verified):
+    async with SessionLocal() as db:
+        await db.execute(
+            update(Users).where(Users.id == user_id).values(is_verified=verified)
+        )
+        await db.commit()
+
+
+async def _password_hash(user_id):
+    async with SessionLocal() as db:
+        return await db.scalar(select(Users.hashed_password).where(Users.id == user_id))
+
+
+def test_login_rehashes_old_cost(client, user, run):
+    old = bcrypt.using(rounds=BCRYPT_ROUNDS + 1).hash("0ld-Password!")
+    run(_set_password_hash, user["id"], old)
+
+    login = client.post(
+        "/auth/login", json={"email": user["email"], "password": "0ld-Password!"}
+    )
+    assert login.status_code == 200
+    upgraded = run(_password_hash, user["id"])
+    assert upgraded != old
+    assert upgraded.startswith(f"$2b${BCRYPT_ROUNDS:02d}$")
+    assert pwd_context.verify("0ld-Password!", upgraded)
+
+    # Already at the configured cost, so nothing is written.
+    client.post(
+        "/auth/login", json={"email": user["email"], "password": "0ld-Password!"}
+    )
+    assert run(_password_hash, user["id"]) == upgraded
+
+
+async def _saturate(hasher):
+    # Holds the only slot while the next request arrives.
+    running = asyncio.create_task(hasher.run(time.sleep, 0.5))
+    await asyncio.sleep(0)
+    try:
+        with pytest.raises(HTTPException) as rejected:
+            await hasher.run(time.sleep, 0)
+        await running
+        # Accepted again once the slot is free.
+        await hasher.run(time.sleep, 0)
+    finally:
+        hasher.shutdown()
+    return rejected.value
+
+
+def test_saturated_pool_rejects_with_retry_after(run):
+    rejected = run(_saturate, PasswordHasher(workers=1, concurrency=1, queue=0))
+    assert rejected.status_code == 503
+    assert rejected.headers == {"Retry-After": "1"}
+
+
+def test_saturated_login_gets_503(client, user, monkeypatch):
+    limit = password_hasher.concurrency + password_hasher.queue
+    monkeypatch.setattr(password_hasher, "pending", limit)
+
+    login = client.post(
+        "/auth/login", json={"email": user["email"], "password": "anything"}
+    )
+    assert login.status_code == 503
+    assert login.headers["retry-after"] == "1"
+
+
+def test_verification_refreshes_cached_principal(client, user, run):
+    run(_set_verified, user["id"], False)
+    token = user["headers"]["Authorization"].removeprefix("Bearer ")
+    assert client.get("/files/usage", headers=user["headers"]).status_code == 200
+    assert get_principal(token).is_verified is False
+
+    response = client.get(
+        "/auth/verify", params={"token": create_verification_token(user["email"])}
+    )
+    assert "Verification Successful" in response.text
+
+    assert get_principal(token) is None
+    assert client.get("/files/usage", headers=user["headers"]).status_code == 200
+    assert get_principal(token).is_verified is True
@@ -0,0 +1,80 @@
+import hashlib
+import io
+import os
+import zipfile
+
+from sqlalchemy import select
+
+from app.core.database import SessionLocal
+from app.models.models import Blob
+
+
+def _upload(client, headers, files):
+    for name, content in files.items():
+        response = client.put(f"/files/upload/{name}", content=content, headers=headers)
+        assert response.status_code == 201
+
+
+async def _ref_counts(*contents):
+    sha256s = [hashlib.sha256(content).hexdigest() for content in contents]
+    async with SessionLocal() as db:
+        rows = await db.execute(
+            select(Blob.sha256, Blob.ref_count).where(Blob.sha256.in_(sha256s))
+        )
+        counts = dict(rows.all())
+    return [counts.get(sha256) for sha256 in sha256s]
+
+
+def test_batch_delete_keeps_usage_and_references(client, user, run):
+    shared, single = os.urandom(3000), os.urandom(5000)
+    files = {"a.bin": shared, "b.bin": shared, "c.bin": single}
+    _upload(client, user["headers"], files)
+    assert run(_ref_counts, shared, single) == [2, 1]
+
+    response = client.post(
+        "/files/delete/batch",
+        json={"filenames": ["a.bin", "c.bin", "missing.bin"]},
+        headers=user["headers"],
+    )
+    assert response.status_code == 200
+    assert response.json()["succeeded"] == 2
+    results = {r["filename"]: r["status"] for r in response.json()["results"]}
+    assert results == {"a.bin": 200, "c.bin": 200, "missing.bin": 404}
+
+    # b.bin still holds the shared contents; nothing holds the other blob.
+    assert run(_ref_counts, shared, single) == [1, None]
+    usage = client.get("/files/usage", headers=user["headers"]).json()
+    assert (usage["bytes_used"], usage["file_count"]) == (len(shared), 1)
+    download = client.get("/files/download/b.bin", headers=user["headers"])
+    assert download.content == shared
+
+    client.post(
+        "/files/delete/batch", json={"filenames": ["b.bin"]}, headers=user["headers"]
+    )
+    assert run(_ref_counts, shared) == [None]
+    usage = client.get("/files/usage", headers=user["headers"]).json()
+    assert (usage["bytes_used"], usage["file_count"]) == (0, 0)
+
+
+def test_archive_streams_uploaded_contents(client, user):
+    files = {
+        "one.bin": os.urandom(70_000),
+        "two.txt": b"plain text\n" * 500,
+        "empty.bin": b"",
+    }
+    _upload(client, user["headers"], files)
+
+    response = client.get(
+        "/files/archive",
+        params={"filename": [*files, "missing.bin"]},
+        headers=user["headers"],
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    assert response.headers["x-missing-files"] == "missing.bin"
+
+    with zipfile.ZipFile(io.BytesIO(response.content)) as archive:
+        assert archive.testzip() is None
+        assert archive.namelist() == list(files)
+        for name, content in files.items():
+            assert archive.read(name) == content
@@ -0,0 +1,106 @@
+import asyncio
+import hashlib
+import os
+import time
+import uuid
+
+from sqlalchemy import select
+
+from app.core.config import BLOB_UNLINK_GRACE
+from app.core.database import SessionLocal
+from app.models.models import Blob, FileManage
+from app.services import blobs
+from app.services.blobs import TEMP_DIR, StagedBlob, store_blob, unlink_blob
+from app.services.compression import Compressor, open_decoded
+from app.services.storage import storage
+
+
+def _stage(content: bytes, encoding: str | None) -> StagedBlob:
+    path = os.path.join(TEMP_DIR, str(uuid.uuid4()))
+    stored = content
+    if encoding:
+        compressor = Compressor(encoding)
+        stored = compressor.compress(content) + compressor.flush()
+    with open(path, "wb") as target:
+        target.write(stored)
+    sha256 = hashlib.sha256(content).hexdigest()
+    return StagedBlob(path, sha256, len(content), encoding, len(stored))
+
+
+def _row(user_id, filename, staged):
+    return FileManage(
+        user_id=user_id,
+        filename=filename,
+        stored_filename=staged.sha256,
+        file_type="text/plain",
+        file_size=staged.size,
+        path=storage.key_for(staged.sha256),
+        sha256=staged.sha256,
+    )
+
+
+def test_concurrent_first_uploads_with_different_encodings(run, user, monkeypatch):
+    content = b"the same text, twice " * 1000
+    plain, packed = _stage(content, None), _stage(content, "gzip")
+    put = storage.put
+    arrived = []
+    both_put = asyncio.Event()
+
+    async def racing_put(source_path, key):
+        # Both uploads missed the blob row and transfer before either commits.
+        await put(source_path, key)
+        arrived.append(key)
+        if len(arrived) == 2:
+            both_put.set()
+            # The last to store its bytes is the last to commit.
+            await asyncio.sleep(0.2)
+        await both_put.wait()
+
+    monkeypatch.setattr(blobs.storage, "put", racing_put)
+
+    async def race():
+        async def upload(filename, staged):
+            async with SessionLocal() as db:
+                await store_blob(db, staged, [_row(user["id"], filename, staged)])
+
+        await asyncio.gather(upload("plain.txt", plain), upload("packed.txt", packed))
+        async with SessionLocal() as db:
+            blob = await db.get(Blob, plain.sha256)
+            rows = (
+                await db.scalars(
+                    select(FileManage).where(FileManage.user_id == user["id"])
+                )
+            ).all()
+        return blob, rows
+
+    blob, rows = run(race)
+    assert blob.ref_count == 2
+    # Whichever won, its bytes are the ones stored under its key.
+    with open_decoded(storage.open_read(blob.path), blob.content_encoding) as source:
+        assert source.read() == content
+    for row in rows:
+        assert (row.path, row.content_encoding) == (blob.path, blob.content_encoding)
+    # The losing copy is referenced by nothing and was removed.
+    [lost] = set(arrived) - {blob.path}
+    assert not os.path.exists(storage.local_path(lost))
+
+
+def test_unlink_spares_contents_stored_again(run):
+    # The last reference just went, and an upload that found no blob row
+    # has stored the same content again but not committed its row yet.
+    staged = _stage(os.urandom(1000), None)
+    key = storage.key_for(staged.sha256)
+    run(storage.put, staged.path, key)
+
+    async def unlink():
+        async with SessionLocal() as db:
+            return await unlink_blob(db, staged.sha256, key)
+
+    assert run(unlink) is False
+    assert os.path.exists(storage.local_path(key))
+
+    # Contents that old can't be an upload still committing.
+    stale = time.time() - BLOB_UNLINK_GRACE - 60
+    os.utime(storage.local_path(key), (stale, stale))
+    assert run(unlink) is True
+    assert not os.path.exists(storage.local_path(key))
@@ -0,0 +1,117 @@
+import gzip
+import hashlib
+import os
+
+import pytest
+import zstandard
+from sqlalchemy import select
+
+from app.core.database import SessionLocal
+from app.models.models import Blob
+from app.services import compression
+from app.services.downloads import make_etag
+from app.services.storage import storage
+
+# Compressible, but unique to each test so it is never deduplicated.
+LINES = 10_000
+
+
+async def _blob(sha256):
+    async with SessionLocal() as db:
+        return await db.scalar(select(Blob).where(Blob.sha256 == sha256))
+
+
+@pytest.fixture(params=["gzip", "zstd"])
+def stored(request, client, user, run, monkeypatch):
+    """Uploads text stored with each encoding; returns what a test needs."""
+    monkeypatch.setattr(compression, "COMPRESSION_ENCODING", request.param)
+    prefix = os.urandom(16).hex()
+    content = "".join(f"{prefix} line {i}\n" for i in range(LINES)).encode()
+    response = client.put(
+        "/files/upload/notes.txt",
+        content=content,
+        headers={**user["headers"], "Content-Type": "text/plain"},
+    )
+    assert response.status_code == 201
+
+    sha256 = hashlib.sha256(content).hexdigest()
+    blob = run(_blob, sha256)
+    with open(storage.local_path(blob.path), "rb") as source:
+        raw = source.read()
+    return {
+        "encoding": request.param,
+        "content": content,
+        "sha256": sha256,
+        "blob": blob,
+        "raw": raw,
+        "headers": user["headers"],
+    }
+
+
+def _get(client, stored, accept, **headers):
+    # Read undecoded, so the test sees exactly the bytes that were sent.
+    with client.stream(
+        "GET",
+        "/files/download/notes.txt",
+        headers={**stored["headers"], "Accept-Encoding": accept, **headers},
+    ) as response:
+        return response, b"".join(response.iter_raw())
+
+
+def test_compressible_upload_is_stored_compressed(stored):
+    assert stored["blob"].content_encoding == stored["encoding"]
+    assert len(stored["raw"]) < len(stored["content"]) // 4
+    if stored["encoding"] == "gzip":
+        assert gzip.decompress(stored["raw"]) == stored["content"]
+    else:
+        decoded = zstandard.ZstdDecompressor().stream_reader(stored["raw"]).read()
+        assert decoded == stored["content"]
+
+
+def test_accepting_client_gets_stored_bytes(client, stored):
+    response, body = _get(client, stored, stored["encoding"])
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == stored["encoding"]
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert body == stored["raw"]
+
+
+def test_other_clients_get_decoded_bytes(client, stored):
+    response, body = _get(client, stored, "identity")
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+    assert int(response.headers["content-length"]) == len(stored["content"])
+    assert body == stored["content"]
+
+
+def test_range_covers_stored_bytes(client, stored):
+    response, body = _get(client, stored, stored["encoding"], Range="bytes=0-99")
+    assert response.status_code == 206
+    assert response.headers["content-encoding"] == stored["encoding"]
+    assert response.headers["content-range"] == f"bytes 0-99/{len(stored['raw'])}"
+    assert body == stored["raw"][:100]
+
+    # Decoded downloads can't seek, so the whole file is sent.
+    response, body = _get(client, stored, "identity", Range="bytes=0-99")
+    assert response.status_code == 200
+    assert response.headers["accept-ranges"] == "none"
+    assert body == stored["content"]
+
+
+def test_each_representation_has_its_own_etag(client, stored):
+    encoded_etag = make_etag(stored["sha256"], stored["encoding"])
+    decoded_etag = make_etag(stored["sha256"])
+
+    response, _ = _get(client, stored, stored["encoding"])
+    assert response.headers["etag"] == encoded_etag
+    response, _ = _get(
+        client, stored, stored["encoding"], **{"If-None-Match": encoded_etag}
+    )
+    assert response.status_code == 304
+
+    response, _ = _get(client, stored, "identity")
+    assert response.headers["etag"] == decoded_etag
+    response, _ = _get(client, stored, "identity", **{"If-None-Match": decoded_etag})
+    assert response.status_code == 304
+    response, _ = _get(client, stored, "identity", **{"If-None-Match": encoded_etag})
+    assert response.status_code == 200
@@ -0,0 +1,115 @@
+import os
+
+import pytest
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+
+from app.core.database import SessionLocal
+from app.models.models import FileManage
+from app.services import counters
+from app.services.counters import CounterAggregator, download_counts
+
+
+@pytest.fixture
+def files(client, user, run):
+    """Three uploaded files; returns their ids by name."""
+    for name in ("a.bin", "b.bin", "c.bin"):
+        response = client.put(
+            f"/files/upload/{name}", content=os.urandom(500), headers=user["headers"]
+        )
+        assert response.status_code == 201
+    return run(_file_ids, user["id"])
+
+
+async def _file_ids(user_id):
+    async with SessionLocal() as db:
+        rows = await db.execute(
+            select(FileManage.filename, FileManage.id).where(
+                FileManage.user_id == user_id
+            )
+        )
+        return dict(rows.all())
+
+
+async def _download_counts(ids):
+    async with SessionLocal() as db:
+        rows = await db.execute(
+            select(FileManage.id, FileManage.download_count).where(
+                FileManage.id.in_(ids)
+            )
+        )
+        return dict(rows.all())
+
+
+def _add(aggregator, files, **hits):
+    for name, count in hits.items():
+        for _ in range(count):
+            aggregator.add(files[f"{name}.bin"])
+
+
+def test_flush_writes_aggregated_increments(run, files):
+    aggregator = CounterAggregator(FileManage, "download_count")
+    _add(aggregator, files, a=3, b=5, c=1)
+    assert aggregator.pending() == 9
+
+    assert run(aggregator.flush) == 3
+    assert aggregator.pending() == 0
+    assert run(_download_counts, files.values()) == {
+        files["a.bin"]: 3,
+        files["b.bin"]: 5,
+        files["c.bin"]: 1,
+    }
+    # Nothing pending, nothing written.
+    assert run(aggregator.flush) == 0
+
+
+def test_increments_survive_a_failed_flush(run, files, monkeypatch):
+    aggregator = CounterAggregator(FileManage, "download_count")
+    _add(aggregator, files, a=2, b=2, c=1)
+    # One UPDATE per row, failing after the first one went through.
+    monkeypatch.setattr(counters, "FLUSH_BATCH", 1)
+    executed = 0
+
+    def failing_session():
+        db = SessionLocal()
+        execute = db.execute
+
+        async def execute_until_failure(*args, **kwargs):
+            nonlocal executed
+            executed += 1
+            if executed == 2:
+                raise OperationalError("UPDATE", {}, Exception("connection lost"))
+            return await execute(*args, **kwargs)
+
+        db.execute = execute_until_failure
+        return db
+
+    monkeypatch.setattr(counters, "SessionLocal", failing_session)
+    with pytest.raises(OperationalError):
+        run(aggregator.flush)
+    # The first update was rolled back with the rest, and kept for retrying.
+    assert run(_download_counts, files.values()) == dict.fromkeys(files.values(), 0)
+    assert aggregator.pending() == 5
+
+    # Hits during the outage add to what is kept; none is counted twice.
+    _add(aggregator, files, a=1)
+    assert run(aggregator.flush) == 3
+    assert run(_download_counts, files.values()) == {
+        files["a.bin"]: 3,
+        files["b.bin"]: 2,
+        files["c.bin"]: 1,
+    }
+
+
+def test_downloads_are_counted(client, user, run, files):
+    for _ in range(2):
+        client.get("/files/download/a.bin", headers=user["headers"])
+    client.get(
+        "/files/archive",
+        params={"filename": ["a.bin", "b.bin"]},
+        headers=user["headers"],
+    )
+
+    run(download_counts.flush)
+    counts = run(_download_counts, files.values())
+    assert (counts[files["a.bin"]], counts[files["b.bin"]]) == (3, 1)
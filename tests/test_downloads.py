@@ -0,0 +1,141 @@
+import os
+import re
+
+import pytest
+
+from app.main import app
+
+CONTENT = os.urandom(100_000)
+
+
+@pytest.fixture
+def stored(client, user):
+    response = client.put(
+        "/files/upload/data.bin",
+        content=CONTENT,
+        headers={**user["headers"], "Content-Type": "application/octet-stream"},
+    )
+    assert response.status_code == 201
+    return user["headers"]
+
+
+def test_full_download(client, stored):
+    response = client.get("/files/download/data.bin", headers=stored)
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["accept-ranges"] == "bytes"
+    assert response.headers["etag"]
+
+
+def test_head(client, stored):
+    response = client.head("/files/download/data.bin", headers=stored)
+    assert response.status_code == 200
+    assert int(response.headers["content-length"]) == len(CONTENT)
+    assert response.content == b""
+
+
+def test_single_range(client, stored):
+    response = client.get(
+        "/files/download/data.bin", headers={**stored, "Range": "bytes=100-199"}
+    )
+    assert response.status_code == 206
+    assert response.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+    assert response.content == CONTENT[100:200]
+
+    suffix = client.get(
+        "/files/download/data.bin", headers={**stored, "Range": "bytes=-50"}
+    )
+    assert suffix.content == CONTENT[-50:]
+
+
+def test_multiple_ranges(client, stored):
+    response = client.get(
+        "/files/download/data.bin", headers={**stored, "Range": "bytes=0-9,20-29"}
+    )
+    assert response.status_code == 206
+    body = response.content
+    assert len(body) == int(response.headers["content-length"])
+
+    content_type = response.headers["content-type"]
+    assert content_type.startswith("multipart/byteranges; boundary=")
+    boundary = content_type.split("boundary=")[1]
+    # Every delimiter is a newline and the boundary, except that the body
+    # starts with the first one.
+    delimiter = f"\n--{boundary}".encode()
+    first, *parts, last = (b"\n" + body).split(delimiter)
+    assert first == b"" and last == b"--\n"
+    parts = [part.split(b"\n\n", 1) for part in parts]
+    assert [content for _, content in parts] == [CONTENT[0:10], CONTENT[20:30]]
+    assert re.search(rb"Content-Range: bytes 20-29/100000", parts[1][0])
+
+
+def test_unsatisfiable_range(client, stored):
+    response = client.get(
+        "/files/download/data.bin", headers={**stored, "Range": "bytes=200000-"}
+    )
+    assert response.status_code == 416
+
+
+def test_conditional_get(client, stored):
+    etag = client.get("/files/download/data.bin", headers=stored).headers["etag"]
+    response = client.get(
+        "/files/download/data.bin", headers={**stored, "If-None-Match": etag}
+    )
+    assert response.status_code == 304
+
+    stale = client.get(
+        "/files/download/data.bin",
+        headers={**stored, "Range": "bytes=0-9", "If-Range": '"stale"'},
+    )
+    assert stale.status_code == 200
+    assert stale.content == CONTENT
+
+
+def test_missing_file(client, user):
+    response = client.get("/files/download/nothing.bin", headers=user["headers"])
+    assert response.status_code == 404
+
+
+async def _asgi_get(path, headers, extensions):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 1234),
+        "root_path": "",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers.items()],
+        "extensions": extensions,
+    }
+    messages = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.zerocopysend":
+            file = message["file"]
+            file.seek(message["offset"])
+            message = {**message, "body": file.read(message.get("count", -1))}
+        messages.append(message)
+
+    await app(scope, receive, send)
+    return messages
+
+
+def test_zerocopy_send_passes_through_middleware(client, stored, run):
+    # No server used here advertises the extension, so act as one that does.
+    messages = run(
+        _asgi_get,
+        "/files/download/data.bin",
+        {**stored, "Range": "bytes=10-19"},
+        {"http.response.zerocopysend": {}},
+    )
+    assert messages[0]["status"] == 206
+    assert [m["type"] for m in messages[1:]] == ["http.response.zerocopysend"]
+    assert messages[1]["body"] == CONTENT[10:20]
@@ -0,0 +1,96 @@
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import delete, insert, select
+
+from app.core.config import EXPORT_BATCH_SIZE
+from app.core.database import SessionLocal
+from app.models.models import FileManage
+from app.services.export import EXPORT_COLUMNS, stream_ndjson
+
+ROWS = EXPORT_BATCH_SIZE * 2 + 500
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def catalog(run, user):
+    async def add_rows():
+        async with SessionLocal() as db:
+            await db.execute(
+                insert(FileManage),
+                [
+                    {
+                        "user_id": user["id"],
+                        "filename": f"file-{index:05d}.txt",
+                        "stored_filename": f"file-{index:05d}.txt",
+                        "file_type": "text/plain" if index % 2 else "image/png",
+                        "file_size": index,
+                        "path": f"legacy/file-{index:05d}.txt",
+                        "uploaded_at": START + timedelta(seconds=index),
+                    }
+                    for index in range(ROWS)
+                ],
+            )
+            await db.commit()
+
+    async def remove_rows():
+        # They have no contents, which the reconcile tests would find.
+        async with SessionLocal() as db:
+            await db.execute(delete(FileManage).where(FileManage.user_id == user["id"]))
+            await db.commit()
+
+    run(add_rows)
+    yield user["headers"]
+    run(remove_rows)
+
+
+def _export(client, headers, **params):
+    response = client.get("/files/export", params=params, headers=headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.content.endswith(b"\n")
+    return [json.loads(line) for line in response.content.split(b"\n")[:-1]]
+
+
+async def _chunks(user_id):
+    query = select(*EXPORT_COLUMNS).where(FileManage.user_id == user_id)
+    return [chunk async for chunk in stream_ndjson(query, user_id=user_id)]
+
+
+def test_export_has_one_object_per_line(client, catalog):
+    records = _export(client, catalog)
+
+    assert len(records) == ROWS
+    assert all(isinstance(record, dict) for record in records)
+    assert [record["filename"] for record in records] == [
+        f"file-{index:05d}.txt" for index in range(ROWS)
+    ]
+    assert set(records[0]) == {
+        "id",
+        "filename",
+        "file_type",
+        "file_size",
+        "sha256",
+        "uploaded_at",
+        "download_count",
+        "processing_status",
+    }
+
+
+def test_export_applies_filters(client, catalog):
+    records = _export(client, catalog, file_type="text/plain")
+    assert len(records) == ROWS // 2
+    assert {record["file_type"] for record in records} == {"text/plain"}
+
+
+def test_export_sends_a_chunk_per_batch(run, user, catalog):
+    chunks = run(_chunks, user["id"])
+    assert len(chunks) == 3
+    # Whole lines only, so a client can parse each chunk as it arrives.
+    assert [chunk.count(b"\n") for chunk in chunks] == [
+        EXPORT_BATCH_SIZE,
+        EXPORT_BATCH_SIZE,
+        ROWS - 2 * EXPORT_BATCH_SIZE,
+    ]
+    assert all(chunk.endswith(b"\n") for chunk in chunks)
@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from app.core.database import SessionLocal
+from app.services.file_cache import (
+    content_cache,
+    file_cache,
+    get_file_meta,
+    invalidate_files,
+)
+
+
+@pytest.fixture
+def cached(client, user):
+    """A small file downloaded twice, so the second read was a cache hit."""
+    content = os.urandom(10_000)
+    response = client.put(
+        "/files/upload/cached.bin", content=content, headers=user["headers"]
+    )
+    assert response.status_code == 201
+
+    hits = file_cache.hits
+    for _ in range(2):
+        download = client.get("/files/download/cached.bin", headers=user["headers"])
+        assert download.content == content
+    assert file_cache.hits > hits
+    meta = file_cache.get((user["id"], "cached.bin"))
+    assert content_cache.get(meta.path) == content
+    return {"user": user, "content": content, "meta": meta}
+
+
+def test_delete_is_visible_after_a_cache_hit(client, cached):
+    user = cached["user"]
+    response = client.delete("/files/delete/cached.bin", headers=user["headers"])
+    assert response.status_code == 200
+
+    assert file_cache.get((user["id"], "cached.bin")) is None
+    assert content_cache.get(cached["meta"].path) is None
+    download = client.get("/files/download/cached.bin", headers=user["headers"])
+    assert download.status_code == 404
+
+
+def test_replacement_is_visible_after_a_cache_hit(client, cached):
+    user = cached["user"]
+    client.delete("/files/delete/cached.bin", headers=user["headers"])
+    replacement = os.urandom(10_000)
+    client.put("/files/upload/cached.bin", content=replacement, headers=user["headers"])
+
+    for _ in range(2):
+        download = client.get("/files/download/cached.bin", headers=user["headers"])
+        assert download.status_code == 200
+        assert download.content == replacement
+    assert download.headers["etag"] != f'"{cached["meta"].sha256}"'
+
+
+def test_batch_delete_is_visible_after_a_cache_hit(client, cached):
+    user = cached["user"]
+    response = client.post(
+        "/files/delete/batch",
+        json={"filenames": ["cached.bin"]},
+        headers=user["headers"],
+    )
+    assert response.json()["succeeded"] == 1
+
+    download = client.get("/files/download/cached.bin", headers=user["headers"])
+    assert download.status_code == 404
+
+
+async def _read_racing_a_change(user_id):
+    async with SessionLocal() as db:
+        execute = db.execute
+
+        async def execute_then_change(*args, **kwargs):
+            result = await execute(*args, **kwargs)
+            # Committed by another request after our row was read.
+            await invalidate_files(user_id, ["cached.bin"])
+            return result
+
+        db.execute = execute_then_change
+        return await get_file_meta(db, user_id, "cached.bin")
+
+
+def test_read_racing_a_change_is_not_cached(run, cached):
+    key = (cached["user"]["id"], "cached.bin")
+    file_cache.pop(key)
+
+    assert run(_read_racing_a_change, key[0]) == cached["meta"]
+    assert file_cache.get(key) is None
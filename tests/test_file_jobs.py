@@ -0,0 +1,204 @@
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, update
+
+from app.core.database import SessionLocal
+from app.models.models import FileJob, FileManage
+from app.services import file_jobs, processors
+from app.services.file_jobs import _claim, _load_file, _run_job
+from app.services.processors import (
+    ChecksumProcessor,
+    FileProcessor,
+    ProcessingFailed,
+    enabled_processors,
+)
+from app.services.storage import storage
+
+PNG = b"\x89PNG\r\n\x1a\n" + os.urandom(2000)
+
+
+class Flaky(FileProcessor):
+    """Fails `failures` times with `error`, then succeeds."""
+
+    def __init__(self, failures=0, error=OSError("storage unavailable")):
+        # A name of its own, so no other test's jobs are claimed.
+        self.name = f"flaky-{uuid.uuid4().hex[:8]}"
+        self.failures = failures
+        self.error = error
+
+    def run(self, file):
+        if self.failures:
+            self.failures -= 1
+            raise self.error
+        return {"ok": True}
+
+
+async def _file_id(user_id, filename):
+    async with SessionLocal() as db:
+        return await db.scalar(
+            select(FileManage.id).where(
+                FileManage.user_id == user_id, FileManage.filename == filename
+            )
+        )
+
+
+async def _add_job(file_id, processor):
+    async with SessionLocal() as db:
+        job = FileJob(
+            file_id=file_id,
+            processor=processor,
+            next_attempt_at=datetime.now(timezone.utc),
+        )
+        db.add(job)
+        await db.commit()
+        return job.id
+
+
+async def _expire(job_id):
+    # As if the lease or backoff had run out.
+    async with SessionLocal() as db:
+        await db.execute(
+            update(FileJob)
+            .where(FileJob.id == job_id)
+            .values(next_attempt_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+        )
+        await db.commit()
+
+
+async def _job(job_id):
+    async with SessionLocal() as db:
+        return await db.get(FileJob, job_id)
+
+
+async def _run_due(processor):
+    for job in await _claim(processor.name, 1000):
+        await _run_job(processor, job)
+
+
+@pytest.fixture
+def uploaded(client, user, run):
+    response = client.put(
+        "/files/upload/image.bin",
+        content=PNG + os.urandom(100),
+        headers={**user["headers"], "Content-Type": "application/octet-stream"},
+    )
+    assert response.status_code == 201
+    return {**user, "file_id": run(_file_id, user["id"], "image.bin")}
+
+
+def _processing(client, uploaded):
+    response = client.get("/files/processing/image.bin", headers=uploaded["headers"])
+    assert response.status_code == 200
+    return {job["processor"]: job for job in response.json()}
+
+
+def _listed(client, uploaded):
+    listing = client.get("/files/list", headers=uploaded["headers"]).json()
+    return {f["filename"]: f for f in listing}["image.bin"]
+
+
+def test_processing_status_on_file_detail(client, run, uploaded):
+    detail = _listed(client, uploaded)
+    assert detail["processing_status"] == "pending"
+    assert detail["file_type"] == "application/octet-stream"
+
+    run(_run_due, enabled_processors()["mime"])
+
+    detail = _listed(client, uploaded)
+    assert detail["processing_status"] == "done"
+    assert detail["file_type"] == "image/png"
+    assert _processing(client, uploaded)["mime"]["result"]["detected"] == "image/png"
+
+
+def test_expired_lease_is_claimed_again(run, uploaded):
+    processor = Flaky()
+    job_id = run(_add_job, uploaded["file_id"], processor.name)
+
+    first = run(_claim, processor.name, 10)
+    assert [(job.id, job.attempts) for job in first] == [(job_id, 1)]
+    # Leased to the worker that claimed it, which may still be running it.
+    assert run(_claim, processor.name, 10) == []
+
+    run(_expire, job_id)
+    again = run(_claim, processor.name, 10)
+    assert [(job.id, job.attempts) for job in again] == [(job_id, 2)]
+
+
+def test_failed_job_is_retried(run, uploaded, monkeypatch):
+    monkeypatch.setattr(file_jobs, "FILE_JOB_RETRY_BASE", 60)
+    processor = Flaky(failures=1)
+    job_id = run(_add_job, uploaded["file_id"], processor.name)
+
+    run(_run_due, processor)
+    job = run(_job, job_id)
+    assert (job.status, job.attempts) == ("pending", 1)
+    assert job.last_error == "OSError: storage unavailable"
+    # Backing off, so not yet due again.
+    assert job.next_attempt_at.replace(tzinfo=timezone.utc) > datetime.now(
+        timezone.utc
+    ) + timedelta(seconds=50)
+    assert run(_claim, processor.name, 10) == []
+
+    run(_expire, job_id)
+    run(_run_due, processor)
+    job = run(_job, job_id)
+    assert (job.status, job.attempts, job.result) == ("done", 2, {"ok": True})
+    assert job.last_error is None
+
+
+def test_job_fails_after_its_last_attempt(client, run, uploaded, monkeypatch):
+    monkeypatch.setattr(file_jobs, "FILE_JOB_MAX_ATTEMPTS", 2)
+    monkeypatch.setattr(file_jobs, "FILE_JOB_RETRY_BASE", 0)
+    processor = Flaky(failures=5)
+    job_id = run(_add_job, uploaded["file_id"], processor.name)
+    run(_run_due, enabled_processors()["mime"])
+
+    run(_run_due, processor)
+    assert _listed(client, uploaded)["processing_status"] == "pending"
+    run(_run_due, processor)
+    job = run(_job, job_id)
+    assert (job.status, job.attempts) == ("failed", 2)
+    assert job.finished_at is not None
+    assert _listed(client, uploaded)["processing_status"] == "failed"
+
+
+def test_permanent_failure_is_not_retried(run, uploaded):
+    processor = Flaky(failures=1, error=ProcessingFailed("unreadable"))
+    job_id = run(_add_job, uploaded["file_id"], processor.name)
+
+    run(_run_due, processor)
+    job = run(_job, job_id)
+    assert (job.status, job.attempts) == ("failed", 1)
+
+
+@pytest.fixture
+def checksum_enabled(monkeypatch):
+    monkeypatch.setattr(processors, "FILE_PROCESSORS", ["mime", "checksum"])
+    enabled_processors.cache_clear()
+    yield enabled_processors()["checksum"]
+    monkeypatch.undo()
+    enabled_processors.cache_clear()
+
+
+def test_checksum_processor_is_opt_in(client, user):
+    assert "checksum" not in enabled_processors()
+
+
+def test_checksum_processor_verifies_stored_content(
+    client, run, checksum_enabled, uploaded
+):
+    assert set(_processing(client, uploaded)) == {"mime", "checksum"}
+    run(_run_due, checksum_enabled)
+    job = _processing(client, uploaded)["checksum"]
+    assert (job["status"], job["result"]) == ("done", {"verified": True})
+
+
+def test_checksum_processor_detects_corruption(run, uploaded):
+    file = run(_load_file, uploaded["file_id"])
+    with open(storage.local_path(file.path), "r+b") as stored:
+        stored.write(b"corrupt")
+    with pytest.raises(ProcessingFailed, match="does not match"):
+        ChecksumProcessor().run(file)
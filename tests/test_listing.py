@@ -0,0 +1,117 @@
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import delete
+
+from app.api.v1.endpoints import files as files_endpoints
+from app.core.database import SessionLocal
+from app.models.models import FileManage
+
+# Fewer distinct times than files, so pages split runs of equal uploaded_at.
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def catalog(run, user):
+    """Fourteen files whose upload times come in ties of two and three."""
+
+    async def add_rows():
+        async with SessionLocal() as db:
+            for index in range(14):
+                db.add(
+                    FileManage(
+                        user_id=user["id"],
+                        filename=f"file-{index:02d}.bin",
+                        stored_filename=f"file-{index:02d}.bin",
+                        file_type="application/octet-stream",
+                        file_size=100 * (index % 4),
+                        path=f"legacy/file-{index:02d}.bin",
+                        uploaded_at=START + timedelta(minutes=index // 3),
+                    )
+                )
+            await db.commit()
+
+    async def remove_rows():
+        # They have no contents, which the reconcile tests would find.
+        async with SessionLocal() as db:
+            await db.execute(delete(FileManage).where(FileManage.user_id == user["id"]))
+            await db.commit()
+
+    run(add_rows)
+    yield user["headers"]
+    run(remove_rows)
+
+
+def _pages(client, headers, **params):
+    names, cursors = [], []
+    cursor = None
+    while True:
+        response = client.get(
+            "/files/list",
+            params={**params, **({"cursor": cursor} if cursor else {})},
+            headers=headers,
+        )
+        assert response.status_code == 200
+        names.append([f["filename"] for f in response.json()])
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            return names, cursors
+        cursors.append(cursor)
+
+
+@pytest.mark.parametrize("order", ["asc", "desc"])
+@pytest.mark.parametrize("sort", ["uploaded_at", "file_size", "filename"])
+def test_pages_cover_every_file_once(client, catalog, sort, order):
+    everything = client.get(
+        "/files/list", params={"sort": sort, "order": order}, headers=catalog
+    ).json()
+    pages, cursors = _pages(client, catalog, sort=sort, order=order, limit=4)
+
+    assert [len(page) for page in pages] == [4, 4, 4, 2]
+    assert len(set(cursors)) == 3
+    # Ties keep their id order, so paging matches the unpaged listing.
+    assert sum(pages, []) == [f["filename"] for f in everything]
+
+
+def test_ties_on_uploaded_at_are_split_by_id(client, catalog):
+    pages, _ = _pages(client, catalog, sort="uploaded_at", order="asc", limit=2)
+    # Times repeat in threes, so pages of two break up every tie.
+    assert pages[:2] == [["file-00.bin", "file-01.bin"], ["file-02.bin", "file-03.bin"]]
+
+
+@pytest.mark.parametrize("cursor", ["not-base64!", "bm90IGpzb24", "WzEsMiwzXQ"])
+def test_invalid_cursor(client, catalog, cursor):
+    response = client.get(
+        "/files/list",
+        params={"sort": "uploaded_at", "cursor": cursor},
+        headers=catalog,
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+def test_total_of_unfiltered_listing_comes_from_usage(client, user, monkeypatch):
+    for name in ("a.bin", "b.bin", "c.bin"):
+        client.put(
+            f"/files/upload/{name}", content=os.urandom(500), headers=user["headers"]
+        )
+
+    async def no_count(db, stmt):
+        raise AssertionError("counted rows for an unfiltered listing")
+
+    monkeypatch.setattr(files_endpoints, "count_files", no_count)
+    response = client.get(
+        "/files/list",
+        params={"include_total": True, "limit": 1},
+        headers=user["headers"],
+    )
+    assert response.headers["x-total-count"] == "3"
+
+    monkeypatch.undo()
+    response = client.get(
+        "/files/list",
+        params={"include_total": True, "filename": "b."},
+        headers=user["headers"],
+    )
+    assert response.headers["x-total-count"] == "1"
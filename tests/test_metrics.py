@@ -0,0 +1,24 @@
+import re
+
+
+def _lookups(client, result):
+    body = client.get("/metrics").text
+    assert "# TYPE cache_lookups_total counter" in body
+    match = re.search(
+        rf'^cache_lookups_total{{cache="files",result="{result}"}} (\S+)$',
+        body,
+        re.MULTILINE,
+    )
+    return float(match.group(1)) if match else 0.0
+
+
+def test_cache_lookups_are_counters(client, user):
+    client.put("/files/upload/counted.txt", content=b"x", headers=user["headers"])
+    hits = _lookups(client, "hit")
+    for _ in range(3):
+        response = client.get("/files/download/counted.txt", headers=user["headers"])
+        assert response.status_code == 200
+
+    # Counted once each, however often /metrics is scraped.
+    assert _lookups(client, "hit") >= hits + 2
+    assert _lookups(client, "hit") == _lookups(client, "hit")
@@ -0,0 +1,133 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from aiosmtpd.controller import Controller
+from sqlalchemy import select, update
+
+from app.core.config import MAIL_PORT, MAIL_RETRY_BASE, MAIL_SERVER
+from app.core.database import SessionLocal
+from app.models.models import EmailOutbox
+from app.services import outbox
+from app.services.email import queue_password_reset_email
+
+
+class Inbox:
+    def __init__(self):
+        self.messages = []
+
+    async def handle_DATA(self, server, session, envelope):
+        self.messages.append(envelope)
+        return "250 OK"
+
+
+@pytest.fixture
+def smtp():
+    """Starts the local SMTP server; call it to start one, stop() to stop."""
+    servers = []
+
+    def start():
+        inbox = Inbox()
+        controller = Controller(inbox, hostname=MAIL_SERVER, port=MAIL_PORT)
+        controller.start()
+        servers.append(controller)
+        return inbox
+
+    yield start
+    for controller in servers:
+        controller.stop()
+
+
+@pytest.fixture
+def queued(run):
+    """Queues a password reset email to a new address; returns the address."""
+    recipient = f"{uuid.uuid4().hex}@example.com"
+
+    async def queue():
+        async with SessionLocal() as db:
+            queue_password_reset_email(db, recipient, "http://localhost/reset")
+            await db.commit()
+
+    run(queue)
+    yield recipient
+    # Connections to a server a test stopped mustn't be reused by the next.
+    run(outbox.smtp_pool.close)
+
+
+async def _row(recipient):
+    async with SessionLocal() as db:
+        return await db.scalar(
+            select(EmailOutbox).where(EmailOutbox.recipient == recipient)
+        )
+
+
+async def _make_due(recipient):
+    async with SessionLocal() as db:
+        await db.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.recipient == recipient)
+            .values(next_attempt_at=datetime.now(timezone.utc))
+        )
+        await db.commit()
+
+
+def _utc(value):
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def test_delivers_queued_email(run, smtp, queued):
+    inbox = smtp()
+    run(outbox.deliver_due)
+
+    row = run(_row, queued)
+    assert row.status == "sent"
+    assert row.sent_at is not None
+    assert row.attempts == 1
+    [message] = [m for m in inbox.messages if m.rcpt_tos == [queued]]
+    assert b"Subject: Password Reset Request" in message.content
+    assert b"http://localhost/reset" in message.content
+
+
+def test_retries_with_backoff(run, smtp, queued):
+    # No server listening: each attempt fails and waits twice as long.
+    for attempt in (1, 2):
+        started = datetime.now(timezone.utc)
+        run(outbox.deliver_due)
+        row = run(_row, queued)
+        assert row.status == "pending"
+        assert row.attempts == attempt
+        assert row.last_error
+        delay = timedelta(seconds=MAIL_RETRY_BASE * 2 ** (attempt - 1))
+        wait = _utc(row.next_attempt_at) - started
+        assert delay - timedelta(seconds=1) <= wait <= delay + timedelta(seconds=5)
+
+        # Not due yet, so another pass leaves it alone.
+        run(outbox.deliver_due)
+        assert run(_row, queued).attempts == attempt
+        run(_make_due, queued)
+
+    inbox = smtp()
+    run(outbox.deliver_due)
+    row = run(_row, queued)
+    assert row.status == "sent"
+    assert row.attempts == 3
+    assert row.last_error is None
+    assert [m.rcpt_tos for m in inbox.messages if m.rcpt_tos == [queued]]
+
+
+def test_dead_letter_after_last_attempt(run, queued, monkeypatch):
+    monkeypatch.setattr(outbox, "MAIL_MAX_ATTEMPTS", 2)
+    run(outbox.deliver_due)
+    run(_make_due, queued)
+    run(outbox.deliver_due)
+
+    row = run(_row, queued)
+    assert row.status == "failed"
+    assert row.attempts == 2
+    assert row.last_error
+
+    # Failed rows are kept for inspection but never claimed again.
+    run(_make_due, queued)
+    run(outbox.deliver_due)
+    assert run(_row, queued).attempts == 2
+    assert run(outbox.outbox_status)["failed"] >= 1
@@ -0,0 +1,109 @@
+import os
+import time
+from functools import partial
+
+import pytest
+from sqlalchemy import select
+
+from app.core.database import SessionLocal
+from app.models.models import FileManage
+from app.services import reconcile
+from app.services.reconcile import Checkpoint, Throttle, find_dangling, find_orphans
+from app.services.storage import storage
+
+
+@pytest.fixture
+def stored(client, user):
+    """Uploads three files; returns their ids and storage keys by name."""
+    for name in ("a.bin", "b.bin", "c.bin"):
+        response = client.put(
+            f"/files/upload/{name}", content=os.urandom(1000), headers=user["headers"]
+        )
+        assert response.status_code == 201
+    return user
+
+
+async def _rows(user_id):
+    async with SessionLocal() as db:
+        rows = await db.execute(
+            select(FileManage.filename, FileManage.id, FileManage.path).where(
+                FileManage.user_id == user_id
+            )
+        )
+        return {row.filename: (row.id, row.path) for row in rows}
+
+
+def _find(run, **kwargs):
+    reported = []
+
+    def report(kind, detail):
+        reported.append(detail)
+
+    counts = run(
+        partial(find_dangling, **kwargs), Checkpoint(None), Throttle(0), report
+    )
+    return counts, reported
+
+
+def test_repair_deletes_dangling_rows(run, stored):
+    rows = run(_rows, stored["id"])
+    run(storage.delete, rows["b.bin"][1])
+
+    counts, reported = _find(run, repair=True, max_missing=0.5)
+    assert counts["deleted"] == 1
+    assert any(f"file {rows['b.bin'][0]} " in detail for detail in reported)
+    assert set(run(_rows, stored["id"])) == {"a.bin", "c.bin"}
+
+
+def test_repair_aborts_when_too_much_is_missing(run, stored):
+    rows = run(_rows, stored["id"])
+    for _, key in rows.values():
+        run(storage.delete, key)
+
+    # Reported, but nothing is deleted.
+    with pytest.raises(RuntimeError, match="check the storage configuration"):
+        _find(run, repair=True, max_missing=0)
+    assert run(_rows, stored["id"]) == rows
+
+    counts, _ = _find(run, repair=True, max_missing=0, force=True)
+    assert counts["deleted"] >= 3
+    assert run(_rows, stored["id"]) == {}
+
+
+def _orphan(sha256):
+    path = os.path.join(storage.root, storage.key_for(sha256))
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as target:
+        target.write(os.urandom(100))
+    old = time.time() - 3600
+    os.utime(path, (old, old))
+    return path
+
+
+def test_repair_spares_orphans_written_again(run, monkeypatch):
+    # One shard directory of its own, so the scan stays small.
+    prefix = "feed"
+    stale = _orphan(prefix + os.urandom(30).hex())
+    stored_again = _orphan(prefix + os.urandom(30).hex())
+    known_keys = reconcile._known_keys
+
+    async def touch_after_scan(sha256s):
+        # An upload stores the same contents while the batch is checked.
+        os.utime(stored_again)
+        return await known_keys(sha256s)
+
+    monkeypatch.setattr(reconcile, "_known_keys", touch_after_scan)
+    checkpoint = Checkpoint(None)
+    checkpoint.state["pending_dirs"] = [f"{prefix[:2]}/{prefix[2:]}"]
+    counts = run(
+        partial(find_orphans, repair=True, grace=60),
+        checkpoint,
+        Throttle(0),
+        lambda kind, detail: None,
+    )
+
+    assert counts["orphan"] == 2
+    assert counts["removed"] == 1
+    assert counts["spared"] == 1
+    assert not os.path.exists(stale)
+    assert os.path.exists(stored_again)
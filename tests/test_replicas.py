@@ -0,0 +1,81 @@
+import sqlite3
+
+import pytest
+
+from app.core import database
+from app.core.database import (
+    ReplicaRouter,
+    create_replica_engine,
+    engine,
+    read_session,
+)
+
+
+def _copy_primary(path):
+    # What a replica has replicated so far: the primary as of now.
+    with sqlite3.connect(engine.url.database) as source:
+        with sqlite3.connect(path) as target:
+            source.backup(target)
+
+
+@pytest.fixture
+def replicas(run, tmp_path, user, monkeypatch):
+    """Two replicas copied from the primary once `user` exists, routed to."""
+    engines = []
+    for name in ("replica-1.db", "replica-2.db"):
+        _copy_primary(tmp_path / name)
+        engines.append(create_replica_engine(f"sqlite:///{tmp_path / name}"))
+    router = ReplicaRouter(engines, sticky_seconds=60, retry_seconds=60)
+    monkeypatch.setattr(database, "replica_router", router)
+    yield router
+    for replica in engines:
+        run(replica.dispose)
+
+
+def _read_from(run, user_id=None):
+    """The engine a read session for `user_id` was opened on."""
+
+    async def bind():
+        async with await read_session(user_id) as db:
+            return db.bind, db.info.get("replica", False)
+
+    return run(bind)
+
+
+def test_round_robin(run, replicas, user):
+    first, second = replicas.replicas
+    assert _read_from(run, user["id"]) == (first, True)
+    assert _read_from(run, user["id"]) == (second, True)
+    assert _read_from(run) == (first, True)
+
+
+def test_primary_after_write(run, client, replicas, user, make_user):
+    other = make_user()
+    response = client.put(
+        "/files/upload/fresh.txt", content=b"fresh", headers=user["headers"]
+    )
+    assert response.status_code == 201
+
+    # The replicas were copied before the upload and never see it, so the
+    # listing is only right if it was read from the primary.
+    assert _read_from(run, user["id"]) == (engine, False)
+    listing = client.get("/files/list", headers=user["headers"])
+    assert [f["filename"] for f in listing.json()] == ["fresh.txt"]
+    # Other users still read from the replicas.
+    assert _read_from(run, other["id"])[1] is True
+
+
+def test_dead_replica_falls_back(run, replicas, user, tmp_path):
+    dead = create_replica_engine(f"sqlite:///{tmp_path}/missing/replica.db")
+    live = replicas.replicas[0]
+    replicas.replicas = [dead, live]
+    try:
+        assert _read_from(run, user["id"]) == (live, True)
+        assert [r["available"] for r in replicas.status()] == [False, True]
+        # Left out while it is marked down, rather than retried every time.
+        assert replicas.candidates(user["id"]) == [live]
+
+        replicas.replicas = [dead]
+        assert _read_from(run, user["id"]) == (engine, False)
+    finally:
+        run(dead.dispose)
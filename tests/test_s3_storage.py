@@ -0,0 +1,95 @@
+import hashlib
+import os
+import time
+import uuid
+
+import httpx
+import pytest
+from moto.server import ThreadedMotoServer
+
+from app.services.storage import S3Storage
+
+CONTENT = os.urandom(50_000)
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+@pytest.fixture(scope="module")
+def s3_endpoint():
+    # A real HTTP endpoint, so presigned URLs can be fetched as clients would.
+    server = ThreadedMotoServer(ip_address="127.0.0.1", port=0, verbose=False)
+    server.start()
+    host, port = server.get_host_and_port()
+    yield f"http://{host}:{port}"
+    server.stop()
+
+
+@pytest.fixture
+def s3(s3_endpoint, monkeypatch):
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    bucket = f"blobs-{uuid.uuid4().hex[:12]}"
+    storage = S3Storage(bucket, "tenant/", s3_endpoint, "us-east-1")
+    storage._client.create_bucket(Bucket=bucket)
+    return storage
+
+
+@pytest.fixture
+def staged(tmp_path):
+    path = tmp_path / "upload.part"
+    path.write_bytes(CONTENT)
+    return str(path)
+
+
+def test_put_and_get(run, s3, staged):
+    key = s3.key_for(SHA256)
+    run(s3.put, staged, key)
+
+    assert not os.path.exists(staged)
+    assert run(s3.exists, key)
+    head = s3._client.head_object(Bucket=s3.bucket, Key=f"tenant/{key}")
+    assert head["ContentLength"] == len(CONTENT)
+    assert s3.open_read(key).read() == CONTENT
+
+
+def test_exists_and_delete(run, s3, staged):
+    key = s3.key_for(SHA256)
+    assert not run(s3.exists, key)
+    run(s3.put, staged, key)
+    run(s3.delete, key)
+    assert not run(s3.exists, key)
+    # Deleting what is already gone is not an error.
+    run(s3.delete, key)
+
+
+def test_download_url(run, s3, staged):
+    key = s3.key_for(SHA256)
+    run(s3.put, staged, key)
+    url = run(s3.download_url, key, "report 1.pdf", "application/pdf")
+
+    response = httpx.get(url)
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["content-type"] == "application/pdf"
+    assert "report%201.pdf" in response.headers["content-disposition"]
+
+
+def test_download_url_range(run, s3, staged):
+    key = s3.key_for(SHA256)
+    run(s3.put, staged, key)
+    url = run(s3.download_url, key, "data.bin", "application/octet-stream")
+
+    response = httpx.get(url, headers={"Range": "bytes=100-199"})
+    assert response.status_code == 206
+    assert response.content == CONTENT[100:200]
+    assert response.headers["content-range"] == f"bytes 100-199/{len(CONTENT)}"
+
+
+def test_delete_older(run, s3, staged):
+    key = s3.key_for(SHA256)
+    run(s3.put, staged, key)
+    # Written after the cutoff, so it may be about to be referenced.
+    assert not run(s3.delete_older, key, time.time() - 60)
+    assert run(s3.exists, key)
+    assert run(s3.delete_older, key, time.time() + 60)
+    assert not run(s3.exists, key)
+    assert not run(s3.delete_older, key, time.time() + 60)
@@ -0,0 +1,153 @@
+import pytest
+from sqlalchemy import (
+    Boolean,
+    Column,
+    DateTime,
+    ForeignKey,
+    Integer,
+    MetaData,
+    String,
+    Table,
+    func,
+    inspect,
+    select,
+    text,
+)
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.models.models import FileManage
+from app.models.schema import create_schema
+
+# The user and files tables as the first release created them.
+baseline = MetaData()
+Table(
+    "user",
+    baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("first_name", String, nullable=False),
+    Column("middle_name", String, nullable=True),
+    Column("last_name", String, nullable=False),
+    Column("email", String, unique=True, nullable=False, index=True),
+    Column("hashed_password", String, nullable=False),
+    Column("is_active", Boolean, default=True),
+    Column("is_verified", Boolean, default=False),
+    Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    Column("updated_at", DateTime(timezone=True)),
+    Column("password_reset_token", String, nullable=True),
+    Column("password_reset_expires", DateTime, nullable=True),
+)
+Table(
+    "files",
+    baseline,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("user_id", Integer, ForeignKey("user.id"), nullable=False),
+    Column("filename", String, nullable=False),
+    Column("stored_filename", String, nullable=False),
+    Column("file_type", String, nullable=False),
+    Column("file_size", Integer, nullable=False),
+    Column("path", String, nullable=False),
+    Column("uploaded_at", DateTime(timezone=True), server_default=func.now()),
+    Column("download_count", Integer, default=0),
+)
+
+
+@pytest.fixture
+def baseline_engine(run, tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/baseline.db")
+
+    async def build():
+        async with engine.begin() as conn:
+            await conn.run_sync(baseline.create_all)
+            await conn.execute(
+                text(
+                    "INSERT INTO user (id, first_name, last_name, email, hashed_password)"
+                    " VALUES (1, 'Old', 'User', 'old@example.com', '!')"
+                )
+            )
+            await conn.execute(
+                text(
+                    "INSERT INTO files (user_id, filename, stored_filename, file_type,"
+                    " file_size, path) VALUES (1, 'report.pdf', 'abc_report.pdf',"
+                    " 'application/pdf', 42, 'uploaded_files/abc_report.pdf')"
+                )
+            )
+
+    run(build)
+    yield engine
+    run(engine.dispose)
+
+
+def _columns(conn, table):
+    return {column["name"] for column in inspect(conn).get_columns(table)}
+
+
+def _indexes(conn, table):
+    return {index["name"] for index in inspect(conn).get_indexes(table)}
+
+
+def test_upgrade_from_baseline(run, baseline_engine):
+    changes = run(create_schema, False, baseline_engine)
+    assert "added column files.sha256" in changes
+    assert "added column files.content_encoding" in changes
+    assert "added column files.processing_status" in changes
+    assert "added column user.password_changed_at" in changes
+    for index in (
+        "ix_files_user_uploaded_at",
+        "ix_files_user_filename",
+        "ix_files_user_file_size",
+        "ix_files_sha256",
+    ):
+        assert f"added index {index}" in changes
+
+    async def check():
+        async with baseline_engine.connect() as conn:
+            columns = await conn.run_sync(_columns, "files")
+            indexes = await conn.run_sync(_indexes, "files")
+        async with AsyncSession(baseline_engine) as db:
+            row = await db.scalar(select(FileManage))
+            found = await db.scalar(
+                text("SELECT rowid FROM files_fts WHERE files_fts MATCH '\"report\"'")
+            )
+        return columns, indexes, row, found
+
+    columns, indexes, row, found = run(check)
+    assert {"sha256", "content_encoding", "processing_status"} <= columns
+    assert {"ix_files_user_uploaded_at", "ix_files_user_filename"} <= indexes
+    # Stored before content addressing: no hash, the original path.
+    assert row.filename == "report.pdf"
+    assert row.sha256 is None
+    assert row.path == "uploaded_files/abc_report.pdf"
+    # Rows from before the search table are indexed too.
+    assert found == row.id
+
+    # A second run has nothing left to do.
+    assert run(create_schema, False, baseline_engine) == []
+
+
+def test_fresh_database(run, tmp_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/fresh.db")
+    try:
+        changes = run(create_schema, False, engine)
+        assert "created table files" in changes
+        assert not [c for c in changes if not c.startswith("created table")]
+        assert run(create_schema, False, engine) == []
+    finally:
+        run(engine.dispose)
+
+
+def test_unsupported_upgrade_fails(run, tmp_path):
+    # A required column without a default can't be filled in for old rows.
+    legacy = MetaData()
+    Table("blobs", legacy, Column("sha256", String, primary_key=True))
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path}/legacy.db")
+
+    async def build():
+        async with engine.begin() as conn:
+            await conn.run_sync(legacy.create_all)
+
+    try:
+        run(build)
+        with pytest.raises(RuntimeError, match="migrate it by hand"):
+            run(create_schema, False, engine)
+    finally:
+        run(engine.dispose)
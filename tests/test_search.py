@@ -0,0 +1,44 @@
+import pytest
+
+
+@pytest.fixture
+def files(client, user):
+    for name in ("Q3-report_final.pdf", "q3 notes.txt", "holiday.jpg", "report.pdf"):
+        response = client.put(
+            f"/files/upload/{name}", content=name.encode(), headers=user["headers"]
+        )
+        assert response.status_code == 201
+    return user["headers"]
+
+
+def search(client, headers, **params):
+    response = client.get("/files/search", params=params, headers=headers)
+    assert response.status_code == 200
+    return [f["filename"] for f in response.json()]
+
+
+def test_ranked_search(client, files):
+    # Names starting with the query first, then shorter names first.
+    assert search(client, files, q="report", match="substring") == [
+        "report.pdf",
+        "Q3-report_final.pdf",
+    ]
+
+
+def test_token_search(client, files):
+    assert search(client, files, q="final q3") == ["Q3-report_final.pdf"]
+    assert search(client, files, q="q3", match="prefix") == [
+        "q3 notes.txt",
+        "Q3-report_final.pdf",
+    ]
+
+
+def test_search_is_per_user(client, files, make_user):
+    other = make_user()
+    client.put("/files/upload/holiday-2.jpg", content=b"x", headers=other["headers"])
+    assert search(client, files, q="holiday") == ["holiday.jpg"]
+    assert search(client, other["headers"], q="holiday") == ["holiday-2.jpg"]
+
+
+def test_search_escapes_wildcards(client, files):
+    assert search(client, files, q="%", match="substring") == []
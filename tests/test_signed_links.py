@@ -0,0 +1,70 @@
+import os
+import time
+from urllib.parse import urlsplit
+
+import pytest
+
+from app.services.signed_links import sign_link, verify_link
+
+CONTENT = os.urandom(20_000)
+
+
+def _upload(client, headers, content=CONTENT):
+    response = client.put("/files/upload/report.bin", content=content, headers=headers)
+    assert response.status_code == 201
+
+
+def _link(client, headers, **params):
+    response = client.post("/files/links/report.bin", params=params, headers=headers)
+    assert response.status_code == 201
+    return urlsplit(response.json()["url"]).path
+
+
+@pytest.fixture
+def link(client, user):
+    _upload(client, user["headers"])
+    return _link(client, user["headers"])
+
+
+def test_link_downloads_without_auth(client, link):
+    response = client.get(link)
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers["cache-control"].startswith("public, max-age=")
+
+
+def test_tampered_link_is_refused(client, link):
+    prefix, token, filename = link.rsplit("/", 2)
+    payload, signature = token.split(".")
+    flipped = ("A" if signature[0] != "A" else "B") + signature[1:]
+
+    assert client.get(f"{prefix}/{payload}.{flipped}/{filename}").status_code == 403
+    assert client.get(f"{prefix}/{token}/other.bin").status_code == 403
+
+
+def test_expired_link_is_refused(client, link):
+    prefix, token, filename = link.rsplit("/", 2)
+    user_id, meta, _ = verify_link(token)
+    expired = sign_link(user_id, meta, int(time.time()) - 1)
+
+    assert verify_link(expired) is None
+    assert client.get(f"{prefix}/{expired}/{filename}").status_code == 403
+
+
+def test_link_is_revoked_with_its_file(client, user, link):
+    assert client.get(link).status_code == 200
+    response = client.delete("/files/delete/report.bin", headers=user["headers"])
+    assert response.status_code == 200
+    # The contents are still stored for a while, but the link no longer works.
+    assert client.get(link).status_code == 403
+
+
+def test_link_is_revoked_when_its_file_is_replaced(client, user, link):
+    client.delete("/files/delete/report.bin", headers=user["headers"])
+    replacement = os.urandom(20_000)
+    _upload(client, user["headers"], replacement)
+
+    assert client.get(link).status_code == 403
+    response = client.get(_link(client, user["headers"]))
+    assert response.status_code == 200
+    assert response.content == replacement
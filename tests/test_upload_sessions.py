@@ -0,0 +1,138 @@
+import hashlib
+import os
+import time
+
+from sqlalchemy import update
+
+from app.core.config import UPLOAD_SESSION_TTL
+from app.core.database import SessionLocal
+from app.models.models import UploadSession
+from app.services import upload_sessions
+from app.services.uploads import FileSink
+
+
+def create_session(client, user, content, chunk_size):
+    response = client.post(
+        "/files/sessions",
+        json={
+            "filename": "video.bin",
+            "file_size": len(content),
+            "chunk_size": chunk_size,
+        },
+        headers=user["headers"],
+    )
+    assert response.status_code == 201
+    return response.json()
+
+
+def put_chunk(client, user, session, index, data):
+    return client.put(
+        f"/files/sessions/{session['session_id']}/chunks/{index}",
+        content=data,
+        headers=user["headers"],
+    )
+
+
+def test_chunks_out_of_order_and_resume(client, user):
+    content = os.urandom(25_000)
+    session = create_session(client, user, content, 10_000)
+    assert session["chunk_count"] == 3
+    chunks = [content[i : i + 10_000] for i in range(0, len(content), 10_000)]
+
+    assert put_chunk(client, user, session, 2, chunks[2]).status_code == 200
+    assert put_chunk(client, user, session, 0, chunks[0]).status_code == 200
+
+    # Resuming: the session reports what it already has.
+    detail = client.get(
+        f"/files/sessions/{session['session_id']}", headers=user["headers"]
+    ).json()
+    assert sorted(detail["received"]) == [0, 2]
+
+    complete = client.post(
+        f"/files/sessions/{session['session_id']}/complete", headers=user["headers"]
+    )
+    assert complete.status_code == 409
+
+    assert put_chunk(client, user, session, 1, chunks[1]).status_code == 200
+    complete = client.post(
+        f"/files/sessions/{session['session_id']}/complete", headers=user["headers"]
+    )
+    assert complete.status_code == 201
+    assert complete.json()["sha256"] == hashlib.sha256(content).hexdigest()
+
+    download = client.get("/files/download/video.bin", headers=user["headers"])
+    assert download.content == content
+    gone = client.get(
+        f"/files/sessions/{session['session_id']}", headers=user["headers"]
+    )
+    assert gone.status_code == 404
+
+
+def test_chunk_of_wrong_size_is_rejected(client, user):
+    session = create_session(client, user, b"x" * 100, 60)
+    assert put_chunk(client, user, session, 0, b"x" * 59).status_code == 400
+    assert put_chunk(client, user, session, 2, b"x" * 60).status_code == 400
+    assert put_chunk(client, user, session, 1, b"x" * 40).status_code == 200
+
+
+def test_oversized_chunk_stops_at_expected_length(client, user, monkeypatch):
+    written = []
+    write = FileSink.write
+
+    async def counting_write(self, data):
+        written.append(len(data))
+        await write(self, data)
+
+    monkeypatch.setattr(FileSink, "write", counting_write)
+    session = create_session(client, user, b"x" * 100, 60)
+    response = put_chunk(client, user, session, 0, b"x" * 1_000_000)
+    assert response.status_code == 400
+    assert sum(written) <= 60
+    assert os.listdir(upload_sessions.session_dir(session["session_id"])) == []
+
+
+def test_no_chunks_while_completing(client, run, user):
+    session = create_session(client, user, b"z" * 10, 5)
+
+    async def assembling():
+        async with SessionLocal() as db:
+            await db.execute(
+                update(UploadSession)
+                .where(UploadSession.id == session["session_id"])
+                .values(status="assembling")
+            )
+            await db.commit()
+
+    run(assembling)
+    assert put_chunk(client, user, session, 0, b"z" * 5).status_code == 409
+
+
+def test_abort_session(client, user):
+    session = create_session(client, user, b"y" * 10, 5)
+    put_chunk(client, user, session, 0, b"y" * 5)
+    response = client.delete(
+        f"/files/sessions/{session['session_id']}", headers=user["headers"]
+    )
+    assert response.status_code == 200
+    assert put_chunk(client, user, session, 1, b"y" * 5).status_code == 404
+
+
+def test_sweep_removes_abandoned_chunk_dirs(client, run, user):
+    live = create_session(client, user, b"w" * 10, 5)
+    put_chunk(client, user, live, 0, b"w" * 5)
+    abandoned = upload_sessions.session_dir("abandoned-session")
+    recent = upload_sessions.session_dir("recent-session")
+    for directory in (abandoned, recent):
+        os.makedirs(directory)
+        with open(os.path.join(directory, "0"), "wb") as chunk:
+            chunk.write(b"w")
+    # Left by a crash after its row was deleted, longer ago than the TTL.
+    stale = time.time() - UPLOAD_SESSION_TTL - 60
+    os.utime(abandoned, (stale, stale))
+
+    run(upload_sessions.purge_expired_sessions)
+    assert not os.path.exists(abandoned)
+    # Maybe a session whose row is still being committed.
+    assert os.path.exists(recent)
+    assert os.listdir(upload_sessions.session_dir(live["session_id"])) == ["0"]
+    upload_sessions.discard("recent-session")
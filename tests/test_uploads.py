@@ -0,0 +1,236 @@
+import hashlib
+import os
+
+import pytest
+
+from app.core.database import SessionLocal
+from app.models.models import UserUsage
+from app.services import blobs
+from app.services.blobs import TEMP_DIR
+from app.services.uploads import FileSink
+
+BOUNDARY = "test-boundary"
+
+
+def multipart(*parts, field="file"):
+    body = b""
+    for filename, content in parts:
+        body += (
+            (
+                f"--{BOUNDARY}\r\n"
+                f'Content-Disposition: form-data; name="{field}"; filename="{filename}"\r\n'
+                "Content-Type: application/octet-stream\r\n\r\n"
+            ).encode()
+            + content
+            + b"\r\n"
+        )
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+
+@pytest.fixture
+def quota(run, user):
+    """Gives the user a 50 KB quota of which 10 KB is used."""
+
+    async def set_quota():
+        async with SessionLocal() as db:
+            db.add(
+                UserUsage(
+                    user_id=user["id"],
+                    bytes_used=10_000,
+                    file_count=0,
+                    quota_bytes=50_000,
+                )
+            )
+            await db.commit()
+
+    run(set_quota)
+    return 40_000
+
+
+def _chunks(size, chunk=8192):
+    # A generator body is sent chunked, without a Content-Length.
+    for start in range(0, size, chunk):
+        yield b"x" * min(chunk, size - start)
+
+
+def post_multipart(client, url, body, headers):
+    return client.post(
+        url,
+        content=body,
+        headers={
+            **headers,
+            "Content-Type": f"multipart/form-data; boundary={BOUNDARY}",
+        },
+    )
+
+
+def test_multipart_upload(client, user):
+    content = os.urandom(300_000)
+    response = client.post(
+        "/files/upload",
+        files={"file": ("photo.bin", content, "application/octet-stream")},
+        headers=user["headers"],
+    )
+    assert response.status_code == 201
+    assert response.json()["file_size"] == len(content)
+    assert response.json()["sha256"] == hashlib.sha256(content).hexdigest()
+
+    download = client.get("/files/download/photo.bin", headers=user["headers"])
+    assert download.status_code == 200
+    assert download.content == content
+
+
+def test_raw_upload(client, user):
+    content = b"raw body " * 1000
+    response = client.put(
+        "/files/upload/notes.txt",
+        content=content,
+        headers={**user["headers"], "Content-Type": "text/plain"},
+    )
+    assert response.status_code == 201
+    assert response.json()["sha256"] == hashlib.sha256(content).hexdigest()
+
+    listing = client.get("/files/list", headers=user["headers"]).json()
+    assert [(f["filename"], f["file_size"]) for f in listing] == [
+        ("notes.txt", len(content))
+    ]
+
+
+def test_batch_upload(client, user):
+    body = multipart(("a.txt", b"first"), ("b.txt", b"second"), field="files")
+    response = post_multipart(client, "/files/upload/batch", body, user["headers"])
+    assert response.status_code == 200
+    results = {r["filename"]: r["status"] for r in response.json()["results"]}
+    assert results == {"a.txt": 201, "b.txt": 201}
+
+    download = client.get("/files/download/b.txt", headers=user["headers"])
+    assert download.content == b"second"
+
+
+def test_batch_upload_reports_each_item(client, user, monkeypatch):
+    good, bad = os.urandom(1000), os.urandom(2000)
+    bad_sha256 = hashlib.sha256(bad).hexdigest()
+    put = blobs.storage.put
+
+    async def failing_put(source_path, key):
+        if bad_sha256 in key:
+            raise OSError("disk full")
+        await put(source_path, key)
+
+    monkeypatch.setattr(blobs.storage, "put", failing_put)
+    body = multipart(("good.bin", good), ("bad.bin", bad), field="files")
+    response = post_multipart(client, "/files/upload/batch", body, user["headers"])
+    assert response.status_code == 200
+    assert response.json()["succeeded"] == 1
+    assert response.json()["failed"] == 1
+    results = {r["filename"]: r for r in response.json()["results"]}
+    assert results["good.bin"]["status"] == 201
+    assert results["good.bin"]["sha256"] == hashlib.sha256(good).hexdigest()
+    assert results["bad.bin"]["status"] == 500
+
+    # Only the stored item became a file, and only it counts toward usage.
+    listing = client.get("/files/list", headers=user["headers"]).json()
+    assert [f["filename"] for f in listing] == ["good.bin"]
+    usage = client.get("/files/usage", headers=user["headers"]).json()
+    assert (usage["bytes_used"], usage["file_count"]) == (len(good), 1)
+
+
+def test_truncated_multipart_is_rejected(client, user):
+    before = set(os.listdir(TEMP_DIR))
+    body = multipart(("cut.bin", b"x" * 10_000))
+    # Ends inside the part, before its terminating boundary.
+    response = post_multipart(
+        client, "/files/upload", body[: len(body) // 2], user["headers"]
+    )
+    assert response.status_code == 400
+    assert set(os.listdir(TEMP_DIR)) == before
+    usage = client.get("/files/usage", headers=user["headers"]).json()
+    assert usage["file_count"] == 0
+
+
+def test_upload_without_file_part(client, user):
+    body = (
+        f"--{BOUNDARY}\r\n"
+        'Content-Disposition: form-data; name="note"\r\n\r\n'
+        f"hello\r\n--{BOUNDARY}--\r\n"
+    ).encode()
+    response = post_multipart(client, "/files/upload", body, user["headers"])
+    assert response.status_code == 400
+
+
+def test_declared_length_over_quota(client, user, quota):
+    response = client.put(
+        "/files/upload/big.bin", content=b"x" * (quota + 1), headers=user["headers"]
+    )
+    assert response.status_code == 413
+
+
+def test_malformed_length_is_rejected(client, user, quota):
+    response = client.put(
+        "/files/upload/odd.bin",
+        content=b"x" * 100,
+        headers={**user["headers"], "Content-Length": "100abc"},
+    )
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid Content-Length"
+
+
+def test_unknown_length_over_quota(client, user, quota, monkeypatch):
+    written = []
+    write = FileSink.write
+
+    async def counting_write(self, data):
+        written.append(len(data))
+        await write(self, data)
+
+    monkeypatch.setattr(FileSink, "write", counting_write)
+    before = set(os.listdir(TEMP_DIR))
+    response = client.put(
+        "/files/upload/big.bin", content=_chunks(1_000_000), headers=user["headers"]
+    )
+    # Refused while streaming, long before the whole body was written.
+    assert response.status_code == 413
+    assert sum(written) <= quota
+    assert set(os.listdir(TEMP_DIR)) == before
+
+    body = iter([multipart(("big.bin", b"x" * 200_000))])
+    response = client.post(
+        "/files/upload",
+        content=body,
+        headers={
+            **user["headers"],
+            "Content-Type": f"multipart/form-data; boundary={BOUNDARY}",
+        },
+    )
+    assert response.status_code == 413
+    assert set(os.listdir(TEMP_DIR)) == before
+
+
+def test_unknown_length_within_quota(client, user, quota):
+    response = client.put(
+        "/files/upload/fits.bin", content=_chunks(quota), headers=user["headers"]
+    )
+    assert response.status_code == 201
+    assert response.json()["file_size"] == quota
+
+
+def test_instant_upload_only_claims_own_content(client, user, make_user):
+    content = os.urandom(5000)
+    client.put("/files/upload/secret.bin", content=content, headers=user["headers"])
+    claim = {
+        "filename": "copy.bin",
+        "file_size": len(content),
+        "sha256": hashlib.sha256(content).hexdigest(),
+    }
+
+    # Knowing the hash is no proof of having the content.
+    other = make_user()
+    response = client.post("/files/upload/check", json=claim, headers=other["headers"])
+    assert response.json()["exists"] is False
+    download = client.get("/files/download/copy.bin", headers=other["headers"])
+    assert download.status_code == 404
+
+    response = client.post("/files/upload/check", json=claim, headers=user["headers"])
+    assert response.json()["exists"] is True
+    download = client.get("/files/download/copy.bin", headers=user["headers"])
+    assert download.content == content